@@ -75,13 +75,12 @@ class Op(object):
     to perform special code generation logic
     """
     if hasattr(self, "c"):
-      # XXX: implement this 
       # the operator has a child, so need to maintain the stack and continue the producer phase
-      pass
+      ctx.stack.append(self)
+      self.c.produce(ctx)
     else:
-      # XXX: implement this 
       # the operator doesn't have a child, so done with the producer phase and should start consumer phase
-      pass
+      self.consume(ctx)
 
   def consume(self, ctx):
     raise Exception("Op.consume not implemented")
@@ -0,0 +1,86 @@
+"""
+Cache of parsed queries and expressions.
+
+The prompt and batch jobs submit the same query strings over and over,
+and ops.cond_to_func() parses the same expression strings each time a
+plan is built by hand.  ASTCache remembers the trees that a parse
+function returned for the most recently used strings.
+
+The optimizer and the operators rewrite and annotate the trees that
+they are given (e.g., the optimizer replaces the FROM clause with
+joins), so the cache never hands out the trees it stores.  Each lookup
+returns a copy made by copy_tree(), which is faster than parsing the
+string again, or than copy.deepcopy().
+"""
+from collections import OrderedDict
+from ops import Op
+
+
+def copy_tree(v, memo=None):
+  """
+  Copy the tree of operators and expressions @v.  Lists, tuples and
+  dictionaries are copied, and other values are shared.  Objects that
+  appear more than once in the tree (e.g., the list that a query's
+  Params share) are copied once.
+  """
+  if memo is None:
+    memo = {}
+  if isinstance(v, Op):
+    new = memo.get(id(v))
+    if new is None:
+      new = memo[id(v)] = object.__new__(v.__class__)
+      # set the attributes without calling __setattr__, which updates
+      # the parent pointers that are copied here
+      attrs = new.__dict__
+      for key, val in v.__dict__.iteritems():
+        attrs[key] = copy_tree(val, memo)
+    return new
+  if isinstance(v, list):
+    new = memo.get(id(v))
+    if new is None:
+      new = memo[id(v)] = []
+      new.extend([copy_tree(x, memo) for x in v])
+    return new
+  if isinstance(v, tuple):
+    return tuple([copy_tree(x, memo) for x in v])
+  if isinstance(v, dict):
+    return dict((key, copy_tree(val, memo)) for key, val in v.iteritems())
+  return v
+
+
+class ASTCache(object):
+  """
+  LRU cache of the trees that @parse returns for the last @capacity
+  strings.  Strings that fail to parse are not cached.
+  """
+  def __init__(self, parse, capacity=256):
+    self.parse = parse
+    self.capacity = capacity
+    self.trees = OrderedDict()   # key -> tree, least recent first
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __call__(self, s, *args):
+    """
+    Returns a copy of the tree of parse(@s, *@args)
+    """
+    key = (s,) + args
+    tree = self.trees.pop(key, None)
+    if tree is not None:
+      self.hits += 1
+    else:
+      self.misses += 1
+      tree = self.parse(s, *args)
+    self.trees[key] = tree
+    while len(self.trees) > self.capacity:
+      self.trees.popitem(last=False)
+      self.evictions += 1
+    return copy_tree(tree)
+
+  def clear(self):
+    self.trees.clear()
+
+  def __len__(self):
+    return len(self.trees)
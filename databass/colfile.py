@@ -0,0 +1,224 @@
+"""
+DataBass' native columnar file format (.dbass files).
+
+A file is laid out as
+
+    DATABASS1\n
+    <length of the header>\n
+    <JSON header>
+    <column data, each column starts at a multiple of ALIGN bytes>
+
+The header records the table's fields and number of rows, plus the
+encoding, offset and size of every column:
+
+* "raw":  numeric columns are stored as fixed-width arrays, and are read
+          back as read-only numpy.memmap arrays without copying them.
+* "dict": string columns are dictionary encoded.  The distinct values
+          are pickled into a dictionary, and the column stores a
+          fixed-width array of codes into the dictionary (-1 for nulls).
+* "pickle": anything else (e.g., unhashable values) is pickled.
+
+The header can also hold arbitrary JSON metadata, e.g., tablecache.py
+stores the identity of the CSV file that the file was built from.
+
+    python colfile.py data/iowa-liquor-sample.csv
+
+converts a CSV file (or any table in the database) to the format.
+"""
+import os
+import json
+import pickle
+import numpy as np
+
+MAGIC = "DATABASS1\n"
+EXTENSION = ".dbass"
+
+# column data starts at multiples of ALIGN bytes
+ALIGN = 64
+
+
+def pad(offset):
+  return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def code_dtype(n):
+  """
+  Smallest signed integer type that can hold the codes of a dictionary
+  with @n values, and -1
+  """
+  for dtype in (np.int8, np.int16, np.int32):
+    if n <= np.iinfo(dtype).max:
+      return np.dtype(dtype)
+  return np.dtype(np.int64)
+
+def is_null(v):
+  return v is None or (isinstance(v, float) and v != v)
+
+def dict_encode(values):
+  """
+  @values list of values
+
+  Returns (codes, dictionary) where dictionary is the sorted list of
+  distinct non-null values, and codes is an array with the position of
+  each value in the dictionary, or -1 for nulls.
+  """
+  dictionary = sorted(set(v for v in values if not is_null(v)))
+  lookup = dict((v, i) for i, v in enumerate(dictionary))
+  codes = np.array([-1 if is_null(v) else lookup[v] for v in values],
+                   dtype=code_dtype(len(dictionary)))
+  return codes, dictionary
+
+def dict_decode(codes, dictionary):
+  """
+  Inverse of dict_encode().  Nulls are decoded as NaN, like pandas does.
+  The result is an object array that references the dictionary's values,
+  so each distinct string is only stored once.
+  """
+  values = np.empty(len(dictionary) + 1, dtype=object)
+  values[:len(dictionary)] = dictionary
+  values[len(dictionary)] = float("nan")
+  return values[codes]
+
+
+def encode_column(col):
+  """
+  Returns (encoding, dtype, list of byte strings) for numpy array @col
+  """
+  if col.dtype.kind in "biuf":
+    return "raw", col.dtype.str, [np.ascontiguousarray(col).tostring()]
+  values = col.tolist()
+  try:
+    codes, dictionary = dict_encode(values)
+  except TypeError:
+    return "pickle", None, [pickle.dumps(values, 2)]
+  return "dict", codes.dtype.str, [codes.tostring(), pickle.dumps(dictionary, 2)]
+
+
+def write_columns(path, fields, columns, meta=None, dicts=None):
+  """
+  @path     file to write
+  @fields   ordered list of field names
+  @columns  dictionary that maps each field name to a numpy array
+  @meta     JSON serializable metadata to store in the header
+  @dicts    maps fields that are already dictionary encoded to their
+            sorted list of distinct values.  Their columns hold the codes.
+
+  The file is written to a temporary file first and then renamed, so
+  readers never see a partially written file.
+  """
+  nrows = len(columns[fields[0]]) if fields else 0
+
+  # offsets are relative to the end of the header
+  blobs, colmeta = [], []
+  offset = 0
+  dicts = dicts or {}
+  for field in fields:
+    if field in dicts:
+      codes = columns[field].astype(code_dtype(len(dicts[field])))
+      encoding, dtype = "dict", codes.dtype.str
+      parts = [codes.tostring(), pickle.dumps(list(dicts[field]), 2)]
+    else:
+      encoding, dtype, parts = encode_column(columns[field])
+    m = dict(name=field, encoding=encoding, dtype=dtype, parts=[])
+    for data in parts:
+      m["parts"].append(dict(offset=offset, nbytes=len(data)))
+      blobs.append((offset, data))
+      offset = pad(offset + len(data))
+    colmeta.append(m)
+  header = json.dumps(dict(nrows=nrows, columns=colmeta, meta=meta or {}))
+
+  tmppath = "%s.%d.tmp" % (path, os.getpid())
+  with open(tmppath, "wb") as f:
+    f.write(MAGIC)
+    f.write("%d\n" % len(header))
+    f.write(header)
+    start = pad(f.tell())
+    for (offset, data) in blobs:
+      f.seek(start + offset)
+      f.write(data)
+  os.rename(tmppath, path)
+
+
+def read_header(path):
+  """
+  Returns the header of the file at @path, or None if it isn't a .dbass
+  file.  The header's "start" key is the file offset of the column data.
+  """
+  with open(path, "rb") as f:
+    if f.read(len(MAGIC)) != MAGIC:
+      return None
+    header = json.loads(f.read(int(f.readline())))
+    header["start"] = pad(f.tell())
+  # json decodes strings as unicode, pandas reads field names as str
+  for m in header["columns"]:
+    m["name"] = m["name"].encode("utf-8")
+  header["fields"] = [m["name"] for m in header["columns"]]
+  return header
+
+
+def read_columns(path, header=None, decode=True):
+  """
+  @path    .dbass file
+  @header  the file's header, if it was already read
+  @decode  decode the dictionary encoded columns
+
+  Returns (fields, columns, dicts).  columns maps each field to a numpy
+  array.  Numeric columns are read-only memory mapped arrays.  dicts maps
+  each dictionary encoded field to its sorted list of distinct values.
+  If @decode is False, the columns of these fields are the (memory
+  mapped) arrays of codes, otherwise they are decoded.
+  """
+  header = header or read_header(path)
+  if header is None:
+    raise Exception("%s is not a DataBass file" % path)
+  start, n = header["start"], header["nrows"]
+
+  def read_array(dtype, part):
+    dtype = np.dtype(str(dtype))
+    if n == 0:
+      return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=start + part["offset"], shape=(n,))
+
+  columns, dicts = {}, {}
+  with open(path, "rb") as f:
+    def read_pickle(part):
+      f.seek(start + part["offset"])
+      return pickle.loads(f.read(part["nbytes"]))
+
+    for m in header["columns"]:
+      field, parts = m["name"], m["parts"]
+      if m["encoding"] == "raw":
+        columns[field] = read_array(m["dtype"], parts[0])
+      elif m["encoding"] == "dict":
+        codes, dictionary = read_array(m["dtype"], parts[0]), read_pickle(parts[1])
+        dicts[field] = dictionary
+        columns[field] = dict_decode(codes, dictionary) if decode else codes
+      else:
+        values = read_pickle(parts[0])
+        columns[field] = np.empty(len(values), dtype=object)
+        columns[field][:] = values
+  return header["fields"], columns, dicts
+
+
+if __name__ == "__main__":
+  import sys
+  from db import Database
+
+  if len(sys.argv) < 2:
+    print "Usage: python colfile.py <csv file or table name> [output file]"
+    sys.exit(1)
+
+  name = sys.argv[1]
+  tablename, ext = os.path.splitext(os.path.basename(name))
+  outpath = sys.argv[2] if len(sys.argv) > 2 else None
+  if outpath is None:
+    if ext:
+      outpath = os.path.splitext(name)[0] + EXTENSION
+    else:
+      outpath = name + EXTENSION
+
+  db = Database()
+  if tablename not in db:
+    print "Table %s not found in database" % tablename
+    sys.exit(1)
+  db.save_table(tablename, outpath)
+  print "Wrote %s to %s" % (tablename, outpath)
@@ -1,6 +1,14 @@
 import pandas
 import numbers
+import numpy as np
 import os
+from collections import OrderedDict
+import sys
+import logging
+import timeit
+import colfile
+import tablecache
+from sketches import HyperLogLog, Reservoir
 try:
   import instabase.notebook.ipython.utils as ib
 except:
@@ -12,22 +20,673 @@ try:
 except:
   pass
 
+logger = logging.getLogger("databass")
+
+
+def is_null(v):
+  """
+  None and NaN (how pandas reads missing CSV values) are nulls
+  """
+  return v is None or (isinstance(v, float) and v != v)
+
+
+class Histogram(object):
+  """
+  Equi-depth histogram: every bucket holds (roughly) the same number of
+  values.  Each bucket is a (lo, hi, count) triple of the smallest and
+  largest value in the bucket and the number of values in it.
+  """
+  def __init__(self, values, nbuckets=10):
+    """
+    @values    sorted list of non-null values
+    @nbuckets  maximum number of buckets
+    """
+    self.n = len(values)
+    self.buckets = []
+    nbuckets = min(nbuckets, self.n)
+    for i in range(nbuckets):
+      start, end = i * self.n // nbuckets, (i+1) * self.n // nbuckets
+      self.buckets.append((values[start], values[end-1], end - start))
+
+  def selectivity(self, lo=None, hi=None):
+    """
+    @lo  lower bound, or None if the range is unbounded below
+    @hi  upper bound, or None if the range is unbounded above
+
+    Estimate the fraction of the values in the range [lo, hi].  Values
+    within a numeric bucket are assumed to be uniformly distributed, and
+    half of a non-numeric bucket that partially overlaps the range is
+    assumed to be in it.
+    """
+    if not self.n:
+      return 0.0
+    matches = 0.0
+    for (blo, bhi, count) in self.buckets:
+      if (lo is not None and bhi < lo) or (hi is not None and blo > hi):
+        continue
+      if (lo is None or lo <= blo) and (hi is None or bhi <= hi):
+        matches += count
+      elif isinstance(blo, numbers.Number) and blo != bhi:
+        l = blo if lo is None else max(lo, blo)
+        h = bhi if hi is None else min(hi, bhi)
+        matches += count * float(h - l) / (bhi - blo)
+      else:
+        matches += count / 2.0
+    return matches / self.n
+
+
+class ColumnStats(object):
+  """
+  Statistics about a single field of a table
+  """
+  def __init__(self, values, nbuckets=10):
+    """
+    @values    all of the field's values, including nulls
+    @nbuckets  number of histogram buckets
+    """
+    self.card = len(values)
+    nonnull = sorted(v for v in values if not is_null(v))
+    self.nulls = self.card - len(nonnull)
+    self.min = nonnull[0] if nonnull else None
+    self.max = nonnull[-1] if nonnull else None
+    self.ndistinct = sum(1 for i, v in enumerate(nonnull) 
+                         if i == 0 or v != nonnull[i-1])
+    self.hist = Histogram(nonnull, nbuckets)
+    # True if the values are in ascending order in the table, e.g., so
+    # that a SortMergeJoin doesn't need to sort them
+    self.sorted = not self.nulls and all(
+        values[i-1] <= values[i] for i in xrange(1, len(values)))
+
+  @property
+  def domain(self):
+    return [self.min, self.max]
+
+  def selectivity(self, op, v):
+    """
+    @op  comparison operator (=, <>, <, <=, >, >=)
+    @v   constant that the field is compared with
+
+    Estimate the fraction of the table's rows where "field op v" is true.
+    Nulls never satisfy the comparison.
+    """
+    if not self.card:
+      return 0.0
+    nonnull = float(self.card - self.nulls) / self.card
+    if op in ("=", "=="):
+      if self.ndistinct == 0 or v < self.min or v > self.max:
+        return 0.0
+      return nonnull / self.ndistinct
+    if op in ("!=", "<>"):
+      return nonnull - self.selectivity("=", v)
+    if op in ("<", "<="):
+      sel = self.hist.selectivity(hi=v)
+    elif op in (">", ">="):
+      sel = self.hist.selectivity(lo=v)
+    else:
+      raise Exception("Can't estimate selectivity of %s" % op)
+    return nonnull * sel
+
+
+class SketchColumnStats(ColumnStats):
+  """
+  ColumnStats estimated while streaming over the field's values, using
+  memory that doesn't depend on the size of the table.  The distinct
+  count comes from a HyperLogLog sketch and the histogram is built from
+  a reservoir sample of the values.
+  """
+  def __init__(self, precision, sample_size, nbuckets=10):
+    """
+    @precision    HyperLogLog precision, uses 2^precision bytes
+    @sample_size  number of values sampled for the histogram
+    @nbuckets     number of histogram buckets
+    """
+    self.card = 0
+    self.nulls = 0
+    self.min = self.max = None
+    self.sorted = True
+    self.last = None
+    self.hll = HyperLogLog(precision)
+    self.sample = Reservoir(sample_size)
+    self.nbuckets = nbuckets
+    self.hist = Histogram([], nbuckets)
+
+  def add(self, v):
+    self.card += 1
+    if is_null(v):
+      self.nulls += 1
+      self.sorted = False
+      return
+    if self.last is not None and v < self.last:
+      self.sorted = False
+    self.last = v
+    if self.min is None or v < self.min:
+      self.min = v
+    if self.max is None or v > self.max:
+      self.max = v
+    self.hll.add(v)
+    self.sample.add(v)
+
+  def finish(self):
+    self.hist = Histogram(sorted(self.sample), self.nbuckets)
+    self.sample = None
+
+  @property
+  def ndistinct(self):
+    nonnull = self.card - self.nulls
+    if not nonnull:
+      return 0
+    return max(1, min(len(self.hll), nonnull))
+
 
 class Stats(object):
+  """
+  Statistics about a table: its cardinality and a ColumnStats object
+  for each of its fields.  Computed in one pass over the table, and
+  cached by Table.stats.
+
+  By default the statistics are exact.  If @precision is set, each field
+  is summarized with SketchColumnStats instead, which trades accuracy
+  for memory: the distinct counts have a standard error of about
+  1.04/sqrt(2^precision), and the histograms are built from
+  @sample_size values.
+  """
+
+  # number of histogram buckets per field
+  NBUCKETS = 10
   
-  # XXX: Edit this to compute the table cardinality
-  def __init__(self, table):
+  def __init__(self, table, precision=None, sample_size=Reservoir.DEFAULT_SIZE):
     self.table = table
-    self.card = 10
+    self.columns = {}
+    if precision is None and table.streaming:
+      # exact statistics would need all of the table's values in memory
+      precision = HyperLogLog.DEFAULT_PRECISION
+    if precision is not None:
+      self.compute_sketches(precision, sample_size)
+      return
+
+    values = table.column_lists()
+    self.card = len(values[table.fields[0]]) if table.fields else 0
+    for field in table.fields:
+      self.columns[field] = ColumnStats(values[field], self.NBUCKETS)
+
+  def compute_sketches(self, precision, sample_size):
+    fields = self.table.fields
+    for field in fields:
+      self.columns[field] = SketchColumnStats(precision, sample_size, self.NBUCKETS)
+    cols = [(field, self.columns[field]) for field in fields]
+
+    self.card = 0
+    for row in self.table:
+      self.card += 1
+      for field, col in cols:
+        col.add(row[field])
+    for field, col in cols:
+      col.finish()
 
-  # XXX: edit this to return the domain of the field
   def __getitem__(self, field):
-    return [0, 1]
+    return self.columns[field]
+
+
+class Schema(object):
+  """
+  The layout of the rows that an operator outputs: an ordered list of
+  fields, and for each field the alias of the table it came from (or
+  None).  Schemas are shared, so use Schema.get() rather than the
+  constructor.  Each schema has a Row subclass whose instances are the
+  rows with that layout.
+  """
+
+  # (fields, tablenames) -> Schema
+  _schemas = {}
+
+  def __init__(self, fields, tablenames):
+    self.fields = fields
+    self.tablenames = tablenames
+
+    # like merging row dictionaries, the last field with a name wins
+    self.offsets = dict((f, i) for i, f in enumerate(fields))
+    self.row_class = type("Row", (Row,), 
+        dict(__slots__=(), schema=self, fields=fields, _offsets=self.offsets))
+    self._concats = {}
+    self._aliased = {}
+    self._extended = {}
+
+  @staticmethod
+  def get(fields, tablenames=None):
+    """
+    @fields      ordered list of field names
+    @tablenames  the table alias of each field, or a single alias for
+                 all of the fields
+    """
+    fields = tuple(fields)
+    if tablenames is None or isinstance(tablenames, basestring):
+      tablenames = (tablenames,) * len(fields)
+    key = (fields, tuple(tablenames))
+    schema = Schema._schemas.get(key)
+    if schema is None:
+      schema = Schema._schemas[key] = Schema(*key)
+    return schema
+
+  def index(self, name, tablename=None):
+    """
+    Offset of field @name of table @tablename, or None if there isn't one.
+    If @tablename is None, the offset of the last field called @name.
+    """
+    if tablename is None:
+      return self.offsets.get(name)
+    for i in range(len(self.fields) - 1, -1, -1):
+      if self.fields[i] == name and self.tablenames[i] == tablename:
+        return i
+    return None
+
+  def concat(self, other):
+    """
+    Schema of the rows that join rows of this schema with rows of @other
+    """
+    schema = self._concats.get(other)
+    if schema is None:
+      schema = self._concats[other] = Schema.get(
+          self.fields + other.fields, self.tablenames + other.tablenames)
+    return schema
+
+  def alias(self, tablename):
+    """
+    The same fields, all from table @tablename (e.g., a subquery's alias)
+    """
+    schema = self._aliased.get(tablename)
+    if schema is None:
+      schema = self._aliased[tablename] = Schema.get(self.fields, tablename)
+    return schema
+
+  def extend(self, fields):
+    """
+    Schema with extra @fields (that don't belong to a table) at the end
+    """
+    fields = tuple(fields)
+    schema = self._extended.get(fields)
+    if schema is None:
+      schema = self._extended[fields] = Schema.get(
+          self.fields + fields, self.tablenames + (None,) * len(fields))
+    return schema
+
+  def __len__(self):
+    return len(self.fields)
+
+  def __repr__(self):
+    return "Schema(%s)" % ", ".join(
+        "%s.%s" % (t, f) if t else f for f, t in zip(self.fields, self.tablenames))
+
+
+def make_row(fields, tablenames, values):
+  return Schema.get(fields, tablenames).row_class(values)
+
+
+class Row(tuple):
+  """
+  A row is a tuple of values whose layout is described by its class'
+  Schema.  Rows behave like read-only dictionaries when indexed by field
+  name (the last field with the name wins), and like tuples otherwise.
+  Rows compare equal to dictionaries with the same items.
+  """
+  __slots__ = ()
+  schema = None
+  fields = ()
+  _offsets = {}
+
+  def __getitem__(self, key):
+    if isinstance(key, basestring):
+      return tuple.__getitem__(self, self._offsets[key])
+    return tuple.__getitem__(self, key)
+
+  def get(self, key, default=None):
+    idx = self._offsets.get(key)
+    if idx is None:
+      return default
+    return tuple.__getitem__(self, idx)
+
+  def __contains__(self, key):
+    return key in self._offsets
+
+  def keys(self):
+    return list(self.fields)
+
+  def values(self):
+    return list(self)
+
+  def items(self):
+    return zip(self.fields, self)
+
+  def iteritems(self):
+    return iter(self.items())
+
+  def asdict(self):
+    return dict(zip(self.fields, self))
+
+  def concat(self, other):
+    """
+    The row that joins this row with @other
+    """
+    return self.schema.concat(other.schema).row_class(tuple.__add__(self, other))
+
+  def __eq__(self, other):
+    if isinstance(other, Row):
+      return self.fields == other.fields and tuple.__eq__(self, other)
+    if isinstance(other, dict):
+      return self.asdict() == other
+    return False
+
+  def __ne__(self, other):
+    return not self == other
+
+  __hash__ = tuple.__hash__
+
+  def __reduce__(self):
+    return (make_row, (self.fields, self.schema.tablenames, tuple(self)))
+
+  def __repr__(self):
+    return "{%s}" % ", ".join("%r: %r" % item for item in self.items())
+
+
+EMPTY_ROW = Schema.get(()).row_class(())
+
+
+def concat_rows(l, r):
+  """
+  Join rows @l and @r.  Dictionaries (e.g., when operators are run
+  directly over tables) are merged instead.
+  """
+  if isinstance(l, Row) and isinstance(r, Row):
+    return l.concat(r)
+  ret = dict(l)
+  ret.update(r)
+  return ret
+
+
+def to_array(values):
+  """
+  Turn a list of python values into a one dimensional numpy array.
+  Numeric values get a typed array, everything else an object array.
+  """
+  try:
+    arr = np.array(values)
+    if arr.ndim == 1 and arr.dtype.kind in "biuf":
+      return arr
+  except ValueError:
+    pass
+  arr = np.empty(len(values), dtype=object)
+  for i, v in enumerate(values):
+    arr[i] = v
+  return arr
+
+def column(v, n):
+  """
+  Make sure @v is a column of @n values.  Scalars (e.g., the result of
+  evaluating a Literal) are repeated @n times.
+  """
+  if isinstance(v, np.ndarray):
+    return v
+  return to_array([v] * n)
+
+
+class Dictionary(object):
+  """
+  The distinct values of a dictionary encoded column.  The column stores
+  the integer position (code) of each value in the sorted list of values,
+  and -1 for nulls.
+  """
+
+  # code of values that are not in the dictionary.  Never matches a
+  # value or a null.
+  MISSING = -2
+
+  def __init__(self, values):
+    self.values = list(values)
+    self.lookup = dict((v, i) for i, v in enumerate(self.values))
+
+    # nulls (code -1) decode to the NaN at the end
+    self.decoder = np.empty(len(self.values) + 1, dtype=object)
+    self.decoder[:len(self.values)] = self.values
+    self.decoder[len(self.values)] = float("nan")
+
+  @staticmethod
+  def encode_column(col, max_ratio=1.0):
+    """
+    @col        numpy array
+    @max_ratio  only encode the column if it has at most this many 
+                distinct values per row
+
+    Returns (codes, Dictionary) if @col is a string column that can be
+    encoded, otherwise None.
+    """
+    if col.dtype.kind != "O" or not len(col):
+      return None
+    values = col.tolist()
+    if not all(isinstance(v, basestring) or is_null(v) for v in values):
+      return None
+    codes, dictionary = colfile.dict_encode(values)
+    if len(dictionary) > max_ratio * len(values):
+      return None
+    return codes, Dictionary(dictionary)
+
+  def __len__(self):
+    return len(self.values)
+
+  def decode(self, codes):
+    return self.decoder[codes]
+
+  def code(self, v):
+    return self.lookup.get(v, self.MISSING)
+
+  def encode(self, values):
+    return np.array([self.lookup.get(v, self.MISSING) for v in values], dtype=np.int64)
+
+  def translate(self, other):
+    """
+    Returns an array that maps the codes of Dictionary @other to the codes
+    of the same values in this dictionary.  Index it with @other's codes.
+    """
+    if other is self:
+      codes = range(len(self.values)) + [-1]
+    else:
+      codes = [self.lookup.get(v, self.MISSING) for v in other.values] + [self.MISSING]
+    return np.array(codes, dtype=np.int64)
+
+  @property
+  def nbytes(self):
+    return self.decoder.nbytes + object_nbytes(self.values)
+
+
+class Batch(object):
+  """
+  A batch of rows stored column by column.  The batch interpretor moves
+  batches between operators instead of single rows.
+
+  Like a Row, a batch has a Schema, and its columns are stored by
+  position, so a join's batch keeps the columns of both sides even if
+  their names are the same.
+
+  Dictionary encoded string columns stay encoded: the batch's columns
+  hold their codes, and self.dicts holds each column's Dictionary (or
+  None).  Indexing the batch or iterating over its rows decodes them.
+  """
+  def __init__(self, schema, columns, n=None, dicts=None):
+    """
+    @schema   Schema of the rows, or a list of field names
+    @columns  list of numpy arrays, one for each field of @schema
+    @n        number of rows.  Only needed if there are no fields
+    @dicts    list of the columns' Dictionaries, or None if the
+              columns are not dictionary encoded
+    """
+    if not isinstance(schema, Schema):
+      schema = Schema.get(schema)
+    self.schema = schema
+    self.columns = list(columns)
+    if n is None:
+      n = len(self.columns[0]) if self.columns else 0
+    self.n = n
+    self.dicts = list(dicts) if dicts is not None else [None] * len(self.columns)
+
+  @staticmethod
+  def from_columns(fields, columns, n=None, dicts=None):
+    """
+    @columns  dictionary that maps each field name to a numpy array
+    @dicts    maps dictionary encoded fields to their Dictionary
+    """
+    dicts = dicts or {}
+    return Batch(fields, [columns[f] for f in fields], n, [dicts.get(f) for f in fields])
+
+  @staticmethod
+  def from_rows(fields, rows):
+    fields = list(fields)
+    return Batch(fields, [to_array([row[f] for row in rows]) for f in fields], len(rows))
+
+  @staticmethod
+  def from_tuples(schema, rows):
+    """
+    @rows  Rows or tuples whose values are in the order of @schema's fields
+    """
+    return Batch(schema, [to_array([row[i] for row in rows]) 
+                          for i in range(len(schema.fields))], len(rows))
+
+  @property
+  def fields(self):
+    return self.schema.fields
+
+  def take(self, idx):
+    """
+    @idx boolean mask or array of row positions
+
+    Returns a new batch containing the selected rows
+    """
+    idx = np.asarray(idx)
+    if idx.dtype == bool:
+      n = int(idx.sum())
+    else:
+      n = len(idx)
+      if not n:
+        idx = idx.astype(np.int64)
+    return Batch(self.schema, [col[idx] for col in self.columns], n, self.dicts)
+
+  def slice(self, start, end):
+    return Batch(self.schema, [col[start:end] for col in self.columns], 
+                 max(0, min(end, self.n) - start), self.dicts)
+
+  def merge(self, other):
+    """
+    Concatenate the columns of two batches with the same number of rows,
+    like Row.concat() concatenates two rows
+    """
+    return Batch(self.schema.concat(other.schema), self.columns + other.columns,
+                 self.n, self.dicts + other.dicts)
+
+  def alias(self, tablename):
+    """
+    The same batch, with all of its fields from table @tablename
+    """
+    return Batch(self.schema.alias(tablename), self.columns, self.n, self.dicts)
+
+  def extend(self, fields, columns):
+    """
+    The batch with extra @columns for @fields, which don't belong to a
+    table, at the end
+    """
+    return Batch(self.schema.extend(fields), self.columns + list(columns),
+                 self.n, self.dicts + [None] * len(fields))
+
+  @staticmethod
+  def concat(batches):
+    """
+    Stack batches that have the same schema into a single batch
+    """
+    batches = list(batches)
+    if not batches:
+      return Batch([], [], 0)
+    columns, dicts = [], []
+    for i in range(len(batches[0].columns)):
+      d = batches[0].dicts[i]
+      if d is not None and all(b.dicts[i] is d for b in batches):
+        # the codes are only comparable if they use the same dictionary
+        columns.append(np.concatenate([b.columns[i] for b in batches]))
+        dicts.append(d)
+        continue
+      cols = [b.column(i) for b in batches]
+      if any(col.dtype.kind == "O" for col in cols):
+        cols = [col.astype(object) for col in cols]
+      columns.append(np.concatenate(cols))
+      dicts.append(None)
+    return Batch(batches[0].schema, columns, sum(b.n for b in batches), dicts)
+
+  def __len__(self):
+    return self.n
+
+  def __contains__(self, field):
+    return field in self.schema.offsets
+
+  def __getitem__(self, field):
+    """
+    The decoded column of @field (the last field with the name), or of
+    the field at position @field
+    """
+    if isinstance(field, basestring):
+      return self.column(self.schema.offsets[field])
+    return self.column(field)
+
+  def column(self, i):
+    """
+    The decoded column at position @i
+    """
+    d = self.dicts[i]
+    if d is not None:
+      return d.decode(self.columns[i])
+    return self.columns[i]
+
+  def codes(self, i):
+    """
+    Returns the (codes, Dictionary) pair of the column at position @i if
+    it is dictionary encoded, otherwise None
+    """
+    d = self.dicts[i]
+    if d is not None:
+      return self.columns[i], d
+    return None
+
+  def __iter__(self):
+    row_class = self.schema.row_class
+    if not self.columns:
+      for i in range(self.n):
+        yield row_class(())
+      return
+    cols = [self.column(i).tolist() for i in range(len(self.columns))]
+    for vals in zip(*cols):
+      yield row_class(vals)
+
+  def __reduce__(self):
+    # like Row, pickle the Schema's fields instead of its row class, e.g.,
+    # when the rows of a group are spilled to disk
+    return (make_batch, (self.fields, self.schema.tablenames, self.columns, 
+                         self.n, self.dicts))
+
+
+def make_batch(fields, tablenames, columns, n, dicts):
+  return Batch(Schema.get(fields, tablenames), columns, n, dicts)
 
 
 class Table(object):
+
+  # streaming tables are read from disk every time they are iterated, and
+  # are never held in memory
+  streaming = False
+
   def __init__(self, fields):
     self.fields = fields
+    self._stats = None
+
+    # incremented whenever the statistics are dropped, so that plans
+    # based on them can tell that they are stale
+    self.stats_version = 0
+
+    # keyword arguments for Stats(), see Database.set_stats_mode()
+    self.stats_options = {}
 
   def type(self, field):
     """
@@ -40,7 +699,9 @@ class Table(object):
     return "str"
 
   @staticmethod
-  def from_dataframe(df):
+  def from_dataframe(df, columnar=False):
+    if columnar:
+      return ColumnarTable.from_dataframe(df)
     fields = list(df.columns)
     rows = df.T.to_dict().values()
     return InMemoryTable(fields, rows)
@@ -53,15 +714,82 @@ class Table(object):
 
   @property
   def stats(self):
-    return Stats(self)
+    if self._stats is None:
+      self._stats = Stats(self, **self.stats_options)
+    return self._stats
+
+  def clear_stats(self):
+    """
+    Drop the cached statistics, e.g., because the table's data changed
+    """
+    self._stats = None
+    self.stats_version += 1
 
   def col_values(self, field):
     return [row[field] for row in self]
 
+  def column_lists(self):
+    """
+    Returns a dictionary that maps each field to a list of its values,
+    collected in one pass over the table
+    """
+    values = dict((field, []) for field in self.fields)
+    for row in self:
+      for field in self.fields:
+        values[field].append(row[field])
+    return values
+
+  @property
+  def nbytes(self):
+    """
+    Estimate of the number of bytes used to store the table's data
+    """
+    return 0
+
+  def batches(self, size):
+    """
+    @size maximum number of rows per batch
+
+    Iterate over the table as a sequence of Batch objects
+    """
+    rows = []
+    for row in self:
+      rows.append(row)
+      if len(rows) >= size:
+        yield Batch.from_rows(self.fields, rows)
+        rows = []
+    if rows:
+      yield Batch.from_rows(self.fields, rows)
+
+  def tuples(self):
+    """
+    Iterate over the table's rows as tuples of values in self.fields order
+    """
+    fields = self.fields
+    for row in self:
+      yield tuple([row[f] for f in fields])
+
+  def __len__(self):
+    return sum(1 for row in self)
+
   def __iter__(self):
     yield
 
 
+def object_nbytes(values):
+  """
+  Sum the sizes of the distinct python objects in @values.  Objects that
+  are referenced multiple times are only counted once.
+  """
+  seen = set()
+  nbytes = 0
+  for v in values:
+    if id(v) in seen: continue
+    seen.add(id(v))
+    nbytes += sys.getsizeof(v)
+  return nbytes
+
+
 class InMemoryTable(Table):
   """
   Table that contains its data all in memory
@@ -70,40 +798,479 @@ class InMemoryTable(Table):
     super(InMemoryTable, self).__init__(fields)
     self.rows = rows
 
+  @property
+  def nbytes(self):
+    nbytes = sys.getsizeof(self.rows)
+    nbytes += sum(sys.getsizeof(row) for row in self.rows)
+    nbytes += object_nbytes(v for row in self.rows for v in row.values())
+    return nbytes
+
+  def __len__(self):
+    return len(self.rows)
+
   def __iter__(self):
     return iter(self.rows)
 
+
+class ColumnarTable(Table):
+  """
+  Table that keeps one typed numpy array per field.  Row dictionaries
+  are only constructed when the table is iterated.
+
+  String columns with few distinct values are dictionary encoded: their
+  array holds integer codes, and self.dicts maps the field to the
+  Dictionary of its values.  Values are decoded when rows are built.
+  """
+
+  # number of rows converted into dictionaries at a time during iteration
+  CHUNKSIZE = 4096
+
+  # dictionary encode string columns with at most this many distinct
+  # values per row
+  DICT_MAX_RATIO = 0.5
+
+  def __init__(self, fields, columns, dicts=None):
+    """
+    @fields   ordered list of field names
+    @columns  dictionary that maps each field name to a numpy array
+    @dicts    maps dictionary encoded fields to their Dictionary
+    """
+    super(ColumnarTable, self).__init__(fields)
+    self.columns = columns
+    self.dicts = dicts or {}
+
+  @staticmethod
+  def from_dataframe(df, encode=True):
+    """
+    @encode  dictionary encode low cardinality string columns
+    """
+    fields = list(df.columns)
+    columns, dicts = {}, {}
+    for field in fields:
+      col = df[field].values
+      encoded = None
+      if encode:
+        encoded = Dictionary.encode_column(col, ColumnarTable.DICT_MAX_RATIO)
+      if encoded:
+        columns[field], dicts[field] = encoded
+      else:
+        # copy so the table doesn't keep the dataframe's blocks alive
+        columns[field] = np.array(col, copy=True)
+    return ColumnarTable(fields, columns, dicts)
+
+  def type(self, field):
+    if field in self.dicts:
+      return "str"
+    if self.columns[field].dtype.kind in "biuf":
+      return "num"
+    return "str"
+
+  def decoded(self, field, start=None, end=None):
+    """
+    Returns the values of @field between rows @start and @end, decoded
+    if the field is dictionary encoded
+    """
+    col = self.columns[field][start:end]
+    if field in self.dicts:
+      return self.dicts[field].decode(col)
+    return col
+
+  def col_values(self, field):
+    return self.decoded(field).tolist()
+
+  def column_lists(self):
+    return dict((field, self.col_values(field)) for field in self.fields)
+
+  @property
+  def rows(self):
+    return list(self)
+
+  @property
+  def nbytes(self):
+    nbytes = 0
+    for col in self.columns.values():
+      nbytes += col.nbytes
+      if col.dtype.kind == "O":
+        nbytes += object_nbytes(col)
+    for d in self.dicts.values():
+      nbytes += d.nbytes
+    return nbytes
+
+  def __len__(self):
+    if not self.fields:
+      return 0
+    return len(self.columns[self.fields[0]])
+
+  def batches(self, size):
+    for start in range(0, len(self), size):
+      end = start + size
+      columns = dict((f, self.columns[f][start:end]) for f in self.fields)
+      yield Batch.from_columns(self.fields, columns, min(end, len(self)) - start, self.dicts)
+
+  def tuples(self):
+    for start in range(0, len(self), self.CHUNKSIZE):
+      end = start + self.CHUNKSIZE
+      cols = [self.decoded(f, start, end).tolist() for f in self.fields]
+      for vals in zip(*cols):
+        yield vals
+
+  def __iter__(self):
+    fields = self.fields
+    for vals in self.tuples():
+      yield dict(zip(fields, vals))
+
+
+class LazyTable(ColumnarTable):
+  """
+  ColumnarTable whose columns are only loaded the first time they are
+  used, e.g., by a Scan or to compute Stats.  Until then, the table only
+  knows its fields.  If the table belongs to a MemoryBudget, the budget
+  may later evict its columns, and they are reloaded when needed again.
+  """
+  def __init__(self, fields, loader, budget=None):
+    """
+    @fields  ordered list of field names
+    @loader  function that loads the table and returns the pair
+             (columns, dicts), see ColumnarTable
+    @budget  MemoryBudget that tracks the table, or None
+    """
+    self.loader = loader
+    self.budget = budget
+    super(LazyTable, self).__init__(fields, None)
+
+  @property
+  def columns(self):
+    if self._columns is None:
+      self._columns, self._dicts = self.loader()
+      if self.budget is not None:
+        self.budget.loaded(self)
+    elif self.budget is not None:
+      self.budget.touch(self)
+    return self._columns
+
+  @columns.setter
+  def columns(self, columns):
+    self._columns = columns
+
+  @property
+  def dicts(self):
+    self.columns
+    return self._dicts
+
+  @dicts.setter
+  def dicts(self, dicts):
+    self._dicts = dicts
+
+  @property
+  def is_loaded(self):
+    return self._columns is not None
+
+  def evict(self):
+    self._columns = self._dicts = None
+
+  @property
+  def nbytes(self):
+    if not self.is_loaded:
+      return 0
+    return super(LazyTable, self).nbytes
+
+
+class ColumnFileTable(LazyTable):
+  """
+  Table stored in DataBass' native columnar file format (see colfile.py).
+  Opening the table only reads the file's header.  Its numeric columns
+  are memory mapped with numpy.memmap the first time they are used, so
+  scans don't copy the data, and processes that open the same file share
+  its pages in the OS page cache.
+  """
+  def __init__(self, fpath, budget=None):
+    self.fpath = fpath
+    self.header = colfile.read_header(fpath)
+    if self.header is None:
+      raise Exception("%s is not a DataBass file" % fpath)
+    loader = lambda: self.load()
+    super(ColumnFileTable, self).__init__(self.header["fields"], loader, budget)
+
+  def load(self):
+    fields, columns, dicts = colfile.read_columns(self.fpath, self.header, decode=False)
+    return columns, dict((f, Dictionary(vals)) for f, vals in dicts.items())
+
+  def __len__(self):
+    return self.header["nrows"]
+
+
+class StreamingCSVTable(Table):
+  """
+  Table that reads its CSV file in chunks of CHUNKSIZE rows every time it
+  is iterated, so it can be much larger than memory.  Only one chunk is
+  in memory at a time, and pipelines such as Filter/Project/Limit over a
+  Scan of the table run in constant space.
+  """
+
+  CHUNKSIZE = 4096
+
+  streaming = True
+
+  def __init__(self, fpath, chunksize=None):
+    self.fpath = fpath
+    self.chunksize = chunksize or self.CHUNKSIZE
+    with openfile(fpath) as f:
+      head = pandas.read_csv(f, nrows=self.chunksize)
+    self.dtypes = dict((f, head[f].dtype) for f in head.columns)
+    super(StreamingCSVTable, self).__init__(list(head.columns))
+
+  def type(self, field):
+    if self.dtypes[field].kind in "biuf":
+      return "num"
+    return "str"
+
+  def chunks(self, size):
+    """
+    @size number of rows per chunk
+
+    Iterate over the CSV file as a sequence of (fields, columns) pairs,
+    where columns maps each field to a numpy array of at most @size values
+    """
+    with openfile(self.fpath) as f:
+      for df in pandas.read_csv(f, chunksize=size):
+        yield list(df.columns), dict((c, df[c].values) for c in df.columns)
+
+  def batches(self, size):
+    for fields, columns in self.chunks(size):
+      yield Batch.from_columns(fields, columns)
+
+  def tuples(self):
+    for fields, columns in self.chunks(self.chunksize):
+      cols = [columns[f].tolist() for f in self.fields]
+      for vals in zip(*cols):
+        yield vals
+
+  def __iter__(self):
+    fields = self.fields
+    for vals in self.tuples():
+      yield dict(zip(fields, vals))
+
+
+class MemoryBudget(object):
+  """
+  Keeps LazyTables' loaded data within a budget of bytes.  Loaded tables
+  are kept in least recently used order, and when the total size of the
+  loaded tables exceeds the budget, the least recently used ones are
+  evicted.  The most recently used table is never evicted, even if it is
+  larger than the budget on its own.
+  """
+  def __init__(self, nbytes=None):
+    """
+    @nbytes  the budget, or None for no limit
+    """
+    self.nbytes = nbytes
+    self.tables = OrderedDict()  # id(table) -> table, oldest first
+    self.nevictions = 0
+
+  def touch(self, table):
+    key = id(table)
+    if key in self.tables:
+      # move to the end of the LRU list
+      self.tables[key] = self.tables.pop(key)
+
+  def loaded(self, table):
+    self.tables.pop(id(table), None)
+    self.tables[id(table)] = table
+    self.evict()
+
+  def discard(self, table):
+    self.tables.pop(id(table), None)
+
+  @property
+  def used(self):
+    return sum(t.nbytes for t in self.tables.values())
+
+  def evict(self):
+    if self.nbytes is None:
+      return
+    used = self.used
+    while used > self.nbytes and len(self.tables) > 1:
+      _, table = self.tables.popitem(last=False)
+      nbytes = table.nbytes
+      used -= nbytes
+      table.evict()
+      self.nevictions += 1
+      logger.info("evicted table with %d bytes", nbytes)
+
+
 class Database(object):
   """
   Manages all tables registered in the database
   """
-  def __init__(self):
+  def __init__(self, use_cache=True, lazy=True, memory_budget=None, 
+               stream_threshold=None):
+    """
+    @use_cache      load CSV files from, and save them to, the binary
+                    cache files in tablecache.py
+    @lazy           only read the CSV files' headers during setup(), and
+                    load their data the first time the tables are used
+    @memory_budget  if lazy, the number of bytes of table data to keep
+                    loaded, or None for no limit.  The least recently
+                    used tables are unloaded to stay within the budget.
+    @stream_threshold  CSV files larger than this many bytes are
+                    registered as StreamingCSVTables, which are read in
+                    chunks instead of being loaded into memory
+    """
     self.registry = {}
+    self.stats_options = {}
+    self.use_cache = use_cache
+    self.lazy = lazy
+    self.budget = MemoryBudget(memory_budget)
+    self.stream_threshold = stream_threshold
+
+    # table name -> (seconds to load the table, "cache" or "csv")
+    self.load_times = {}
     self.setup()
 
   def setup(self):
     """
-    Walks all CSV files in the current directory and registers
-    them in the database
+    Walks all CSV and .dbass files in the current directory and registers
+    them in the database.  If a directory contains both foo.csv and
+    foo.dbass, the .dbass file is used.
     """
     for root, dirs, files in os.walk("."):
       for fname in files:
-        if fname.lower().endswith(".csv"):
-          tablename, _ = os.path.splitext(fname)
-          fpath = os.path.join(root, fname)
-          try:
-            with openfile(fpath) as f:
-              df = pandas.read_csv(f)
-              self.register_dataframe(tablename, df)
-          except Exception as e:
-            print("Failed to read data file %s" % fpath)
-            print(e)
+        tablename, ext = os.path.splitext(fname)
+        fpath = os.path.join(root, fname)
+        try:
+          if ext.lower() == colfile.EXTENSION:
+            self.register_table(tablename, ColumnFileTable(fpath, self.budget))
+          elif ext.lower() == ".csv":
+            if tablename + colfile.EXTENSION in files:
+              continue
+            self.register_csv(tablename, fpath)
+        except Exception as e:
+          print("Failed to read data file %s" % fpath)
+          print(e)
+
+  def register_csv(self, tablename, fpath):
+    """
+    Registers the CSV file @fpath as a ColumnarTable, or as a LazyTable
+    that only reads the file's header until it is used.  Files larger than
+    the stream threshold are registered as StreamingCSVTables.
+    """
+    if (self.stream_threshold is not None and 
+        os.path.getsize(fpath) > self.stream_threshold):
+      self.register_table(tablename, StreamingCSVTable(fpath))
+      return
+
+    if not self.lazy:
+      fields, columns, dicts = self.load_csv(tablename, fpath)
+      self.register_table(tablename, ColumnarTable(fields, columns, dicts))
+      return
+
+    with openfile(fpath) as f:
+      fields = list(pandas.read_csv(f, nrows=0).columns)
+    loader = lambda: self.load_csv(tablename, fpath)[1:]
+    self.register_table(tablename, LazyTable(fields, loader, self.budget))
+
+  def load_csv(self, tablename, fpath):
+    """
+    Reads the CSV file @fpath and returns (fields, columns, dicts), see
+    ColumnarTable.  Uses the file's binary cache if it is up to date,
+    otherwise parses the CSV file and (re)writes the cache.
+    """
+    start = timeit.default_timer()
+    cached = None
+    if self.use_cache:
+      try:
+        cached = tablecache.read_cache(fpath)
+      except Exception as e:
+        logger.warning("ignoring unreadable cache for %s: %s", fpath, e)
+
+    if cached is not None:
+      source = "cache"
+      fields, columns, dicts = cached
+      dicts = dict((f, Dictionary(vals)) for f, vals in dicts.items())
+    else:
+      source = "csv"
+      with openfile(fpath) as f:
+        df = pandas.read_csv(f)
+      table = ColumnarTable.from_dataframe(df)
+      fields, columns, dicts = table.fields, table.columns, table.dicts
+      if self.use_cache:
+        try:
+          tablecache.write_cache(fpath, fields, columns, 
+              dict((f, d.values) for f, d in dicts.items()))
+        except (IOError, OSError) as e:
+          logger.warning("could not write cache for %s: %s", fpath, e)
+
+    secs = timeit.default_timer() - start
+    self.load_times[tablename] = (secs, source)
+    logger.info("loaded table %s from %s in %.4f sec", tablename, source, secs)
+    return fields, columns, dicts
 
   def register_table(self, tablename, table):
+    """
+    Adds @table to the database, replacing any table with the same name.
+    Cached statistics are recomputed the next time they are used.
+    """
+    if tablename in self.registry:
+      self.registry[tablename].clear_stats()
+      self.budget.discard(self.registry[tablename])
+    table.stats_options = self.stats_options
+    table.clear_stats()
     self.registry[tablename] = table
 
-  def register_dataframe(self, tablename, df):
-    self.register_table(tablename, Table.from_dataframe(df))
+  def set_stats_mode(self, sketch=False, error=0.02, sample_size=Reservoir.DEFAULT_SIZE):
+    """
+    @sketch       estimate table statistics with sketches instead of
+                  computing them exactly
+    @error        target standard error of the distinct count estimates.
+                  Each field's HyperLogLog uses about (1.04/error)^2 bytes
+    @sample_size  number of values per field used to build histograms
+
+    Applies to all tables in the database.  Their statistics are
+    recomputed the next time they are used.
+    """
+    if sketch:
+      self.stats_options = dict(
+          precision=HyperLogLog.precision_for(error),
+          sample_size=sample_size)
+    else:
+      self.stats_options = {}
+    for table in self.registry.values():
+      table.stats_options = self.stats_options
+      table.clear_stats()
+
+  def save_table(self, tablename, fpath):
+    """
+    Write table @tablename to @fpath in the native columnar format, see
+    colfile.py.  Works for any registered table.
+    """
+    table = self[tablename]
+    if table is None:
+      raise Exception("Table \"%s\" not found in database" % tablename)
+    dicts = {}
+    if isinstance(table, ColumnarTable):
+      columns = table.columns
+      dicts = dict((f, d.values) for f, d in table.dicts.items())
+    else:
+      columns = dict((f, to_array(vals)) for f, vals in table.column_lists().items())
+    colfile.write_columns(fpath, table.fields, columns, dicts=dicts)
+
+  def register_dataframe(self, tablename, df, columnar=True):
+    self.register_table(tablename, Table.from_dataframe(df, columnar))
+
+  def prepare(self, sql, interpretor=None):
+    """
+    Parse and optimize @sql, which may contain ? or :name placeholders,
+    and return a PreparedStatement, see prepared.py
+    """
+    from prepared import prepare
+    return prepare(self, sql, interpretor)
+
+  def memory_usage(self):
+    """
+    Returns a dictionary that maps each table name to the estimated
+    number of bytes its data uses
+    """
+    return dict((name, table.nbytes) for name, table in self.registry.items())
 
   @property
   def tablenames(self):
@@ -1,4 +1,5 @@
 from collections import *
+import heapq
 try:
   import instabase.notebook.ipython.utils as ib
   ib.import_pyfile('./ops.py', 'ops')
@@ -6,6 +7,7 @@ try:
 except:
   pass
 from ops import *
+from db import Batch, Schema, EMPTY_ROW, concat_rows, column, to_array
 from parse_sql import parse
 
 
@@ -38,20 +40,26 @@ class PushBasedInterpretor(object):
     self(op.c, print_f)
 
   def run_subquerysource(self, op, f):
-    self(op.c, f)
+    def alias_f(tup):
+      if op.alias and isinstance(tup, Row):
+        tup = tup.schema.alias(op.alias).row_class(tup)
+      return f(tup)
+    self(op.c, alias_f)
 
   def run_scan(self, op, f):
     if op.tablename not in self.db:
       raise Exception("Table \"%s\" not found in database" % op.tablename)
     table = self.db[op.tablename]
-    for tup in table:
-      r = f(tup)
+    row_class = Schema.get(table.fields, op.alias).row_class
+    for vals in table.tuples():
+      r = f(row_class(vals))
       if r == False:
         break
 
   def run_thetajoin(self, op, f):
     idx = len(self.overlap_checkers)
     self.overlap_checkers.append(False)
+    cond = op.compiled(op.cond)
     def outer_loop(left):
       def inner_loop(right):
         if False and not self.overlap_checkers[idx]:
@@ -62,56 +70,56 @@ class PushBasedInterpretor(object):
           if overlap:
              print("WARNING: join has overlapping attributes: (%s)" % overlap)
 
-        if op.cond(left, right):
-          newtup = dict()
-          newtup.update(left)
-          newtup.update(right)
-          return f(newtup)
+        if cond(left, right):
+          return f(concat_rows(left, right))
       self(op.r, inner_loop)
     self(op.l, outer_loop)
     self.overlap_checkers.pop()
 
   def run_hashjoin(self, op, f):
-    # Comment the following line and write your code here
-    # raise Exception('Implement hash join!')
-
-    # Hash join is equality on left_attr and right_attr    
-    join_attrs = [str(x) for x in op.join_attrs]
-    left_attr = join_attrs[0]
-    right_attr = join_attrs[1]
+    # Hash join is equality on the left and right join attributes.
+    # Like HashJoin.__iter__, the index is built on the smaller input
+    if op.build_side(self.db) == "left":
+      build, battrs, probe, pattrs = op.l, op.lattrs, op.r, op.rattrs
+    else:
+      build, battrs, probe, pattrs = op.r, op.rattrs, op.l, op.lattrs
     
-    # Step 1. build a hash index (dictionary that maps join attribute value to list of tuples)
-    # 1.1 TODO: define a dictionary of index in the next line
+    # Step 1. build a hash index that maps the join attribute values
+    #         of the build side to the list of tuples with those values
     m = defaultdict(list)
     
-    # hash phase, remove pass and implement function add_to_index
     def add_to_index(tup):
-        # 1.2 TODO: add tuple (from right table) to your index, key should be the value of right_attr of tup
-        
-        # Hint: use tup[right_attr] as a key in index dictionary, and the corresponding value
-        #       is a list of tuples from the right side table with the same right_attr value
-        # e.g., left_attr is 'STORE' and right_attr is 's', tup['s'] gives the store number 2515
-        #       let's call index dictionary as m, you should add all tuples with s = 2515 to m[2515]
-        m[tup[right_attr]].append(tup)
+        m[op.key(tup, battrs)].append(tup)
     
-    # we now run the right side of the join, and for each tuple, run add_to_index
-    self(op.r, add_to_index)
+    # we now run the build side of the join, and for each tuple, run add_to_index
+    self(build, add_to_index)
     
-    # Step 2. for each left tuple, look up in your index:
-    def lookup_left_tuple(tup):
-        # 2.1 TODO: check if there is a match of the left tup attribute value in the index dictionary
-        #     if so, perform the join (as in Nested Loops Join above), merge left and right tuple
-        #     and call f() on the new tuple
-        if m[tup[left_attr]]:
-            for t in m[tup[left_attr]]:
-                newtup = dict()
-                newtup.update(tup)
-                newtup.update(t)
-                if f(newtup) == False:
-                  return False
+    # Step 2. for each probe tuple, look up matching tuples in the index,
+    #         merge the left and right tuple and call f() on the new tuple
+    def lookup_tuple(tup):
+        for t in m.get(op.key(tup, pattrs), ()):
+            row = concat_rows(t, tup) if build is op.l else concat_rows(tup, t)
+            if f(row) == False:
+              return False
     
-    # we now run the left side of the join, and for each tuple, run lookup_left_tuple
-    self(op.l, lookup_left_tuple)
+    # we now run the probe side of the join, and for each tuple, run lookup_tuple
+    self(probe, lookup_tuple)
+
+  def run_sortmergejoin(self, op, f):
+    # both inputs are sorted (or already in order) before they are merged
+    sides = []
+    for child, attrs, presorted in op.sides():
+      if presorted:
+        rows = []
+        self(child, rows.append)
+      else:
+        rows = op.sorter(attrs)
+        self(child, rows.add)
+      sides.append(rows)
+
+    for lrow, rrow in op.merge(*sides):
+      if f(concat_rows(lrow, rrow)) == False:
+        return False
 
   def run_limit(self, op, f):
     idx = len(self.limit_counters)
@@ -125,50 +133,53 @@ class PushBasedInterpretor(object):
     self.limit_counters.pop()
 
   def run_groupby(self, op, f):
-    hashtable = defaultdict(lambda: [None, None, []])
-    def group_f(tup):
-      key = tuple([e(tup) for e in op.group_exprs])
-      hashtable[key][0] = key
-      hashtable[key][1] = tup
-      hashtable[key][2].append(tup)
-    self(op.c, group_f)
-
-    for _, (key, tup, group) in hashtable.items():
-      tup = dict(tup)
-      tup["__key__"] = key
-      tup["__group__"] = group
-      f(tup)
+    groups = HashAggregator(op, op.budget())
+    self(op.c, groups.add)
+    for key, tup, group in groups:
+      if f(op.group_row(tup, key, group)) == False:
+        return False
 
   def run_orderby(self, op, f):
-    tup_buffer = []
-    def order_f(tup):
-      tup_buffer.append(tup)
-    self(op.c, order_f)
+    rows = ExternalSorter(op.row_key(), op.budget())
+    self(op.c, rows.add)
+    for row in rows:
+      if f(row) == False:
+        return False
+
+  def run_topk(self, op, f):
+    rows = TopKHeap(op, op.k())
+    self(op.c, rows.add)
+    for row in rows:
+      if f(row) == False:
+        return False
 
   def run_project(self, op, f):
     def project_f(tup):
-      ret = dict()
-      for exp, alias in zip(op.exprs, op.aliases):
-        if isinstance(exp, Star):
-          ret.update(exp(tup))
-        else:
-          ret[alias] = exp(tup)
-      return f(ret)
-    self(op.c, project_f)
+      return f(op.project(tup))
+
+    # if the query doesn't have a FROM clause (SELECT 1),
+    # then project an empty tuple
+    if op.c is None:
+      project_f(EMPTY_ROW)
+    else:
+      self(op.c, project_f)
 
   def run_filter(self, op, f):
+    cond = op.compiled(op.cond)
     def where_f(tup):
-      if op.cond(tup):
+      if cond(tup):
         return f(tup)
     self(op.c, where_f)
 
   def run_distinct(self, op, f):
-    tup_buffer = []
+    rows = HashDistinct(op.budget())
     def distinct_f(tup):
-      if tup not in tup_buffer:
-        tup_buffer.append(tup)
+      if rows.add(tup):
         return f(tup)
     self(op.c, distinct_f)
+    for row in rows.rest():
+      if f(row) == False:
+        return False
 
 
   def __call__(self, op, f=lambda t:t):
@@ -193,12 +204,16 @@ class PushBasedInterpretor(object):
       self.run_thetajoin(op, f)
     elif klass == "HashJoin":
       self.run_hashjoin(op, f)
+    elif klass == "SortMergeJoin":
+      self.run_sortmergejoin(op, f)
     elif klass == "Limit":
       self.run_limit(op, f)
     elif klass == "GroupBy":
       self.run_groupby(op, f)
     elif klass == "OrderBy":
       self.run_orderby(op, f)
+    elif klass == "TopK":
+      self.run_topk(op, f)
     elif klass == "Filter":
       self.run_filter(op, f)
     elif klass == "Project":
@@ -209,5 +224,320 @@ class PushBasedInterpretor(object):
       self.run_subquerysource(op, f)
     else:
       raise Exception("Did not recognize operator: %s" % klass)
-    
+
+
+
+class BatchInterpretor(object):
+  """
+  Vectorized interpretor.  Operators exchange Batch objects that hold up
+  to @batchsize rows stored column by column, and expressions are
+  evaluated over whole columns with ExprBase.eval_batch()
+  """
+  def __init__(self, db, batchsize=4096):
+    self.db = db
+    self.batchsize = batchsize
+
+  def __call__(self, op, **kwargs):
+    # make sure the scan operators have access to the database
+    for scanop in op.collect("Scan"):
+      scanop.set_db(self.db)
+
+    for batch in self.batches(op):
+      for row in batch:
+        yield row
+
+  def eval(self, expr, batch, batch2=None):
+    """
+    Evaluate @expr over every row of @batch and return a column.
+    Expressions that are plain python functions are called one row at a time
+    """
+    if isinstance(expr, ExprBase):
+      return column(expr.eval_batch(batch, batch2), len(batch))
+    if batch2 is None:
+      return to_array([expr(row) for row in batch])
+    return to_array([expr(l, r) for l, r in zip(batch, batch2)])
+
+  def run_print(self, op):
+    for batch in self.batches(op.c):
+      for row in batch:
+        print(row)
+    yield Batch([], [], 0)
+
+  def run_subquerysource(self, op):
+    for batch in self.batches(op.c):
+      if op.alias:
+        batch = batch.alias(op.alias)
+      yield batch
+
+  def run_scan(self, op):
+    if op.tablename not in self.db:
+      raise Exception("Table \"%s\" not found in database" % op.tablename)
+    for batch in self.db[op.tablename].batches(self.batchsize):
+      yield batch.alias(op.alias)
+
+  def run_thetajoin(self, op):
+    # the inner side is materialized once instead of once per outer batch
+    right = Batch.concat(self.batches(op.r))
+    if not len(right):
+      return
+
+    # pair each outer row with every inner row, but keep the number of
+    # candidate pairs evaluated at once close to the batch size
+    step = max(1, self.batchsize // len(right))
+    for lbatch in self.batches(op.l):
+      for start in range(0, len(lbatch), step):
+        left = lbatch.slice(start, start + step)
+        lidx = np.repeat(np.arange(len(left)), len(right))
+        ridx = np.tile(np.arange(len(right)), len(left))
+        lpairs, rpairs = left.take(lidx), right.take(ridx)
+        mask = np.asarray(self.eval(op.cond, lpairs, rpairs), dtype=bool)
+        if mask.any():
+          yield lpairs.take(mask).merge(rpairs.take(mask))
+
+  def key_column(self, expr, batch, d=None):
+    """
+    Evaluate key expression @expr over @batch, using the integer codes
+    of dictionary encoded attributes so that hashing and comparing keys
+    doesn't touch the strings.
+
+    @d  if not None, encode the key with Dictionary @d, e.g., to compare
+        it with the other side's keys in a join
+
+    Returns (column, Dictionary or None)
+    """
+    enc = encoded_batch(expr, batch)
+    if d is None:
+      if enc is not None:
+        return enc
+      return self.eval(expr, batch), None
+    if enc is not None:
+      codes, mine = enc
+      return d.translate(mine)[codes], d
+    return d.encode(self.eval(expr, batch).tolist()), d
+
+  def keys(self, attrs, batch, dicts=None):
+    """
+    Returns the list of key tuples for the rows in @batch, and for each
+    key attribute, the Dictionary it is encoded with or None
+
+    @dicts  the dictionaries returned for the keys that these keys are
+            compared with.  Attributes whose dictionary is None are
+            then decoded.
+    """
+    cols, retdicts = [], []
+    for i, attr in enumerate(attrs):
+      if dicts is not None and dicts[i] is None:
+        col, d = self.eval(attr, batch), None
+      else:
+        col, d = self.key_column(attr, batch, dicts and dicts[i])
+      cols.append(col.tolist())
+      retdicts.append(d)
+    return zip(*cols), retdicts
+
+  def run_hashjoin(self, op):
+    # the index is built on the smaller input, see HashJoin.build_side()
+    if op.build_side(self.db) == "left":
+      build, battrs, probe, pattrs = op.l, op.lattrs, op.r, op.rattrs
+    else:
+      build, battrs, probe, pattrs = op.r, op.rattrs, op.l, op.lattrs
+
+    built = Batch.concat(self.batches(build))
+    if not len(built):
+      return
+    index = defaultdict(list)
+    bkeys, dicts = self.keys(battrs, built)
+    for i, key in enumerate(bkeys):
+      index[key].append(i)
+
+    for pbatch in self.batches(probe):
+      pidx, bidx = [], []
+      for i, key in enumerate(self.keys(pattrs, pbatch, dicts)[0]):
+        matches = index.get(key)
+        if matches:
+          pidx.extend([i] * len(matches))
+          bidx.extend(matches)
+      if not pidx:
+        continue
+      if build is op.l:
+        yield built.take(bidx).merge(pbatch.take(pidx))
+      else:
+        yield pbatch.take(pidx).merge(built.take(bidx))
+
+  def run_sortmergejoin(self, op):
+    # the inputs are in memory, so they are sorted in memory
+    left = Batch.concat(self.batches(op.l))
+    right = Batch.concat(self.batches(op.r))
+    if not len(left) or not len(right):
+      return
+
+    sides = []
+    for batch, (_, attrs, presorted) in zip([left, right], op.sides()):
+      keys = zip(*[self.eval(attr, batch).tolist() for attr in attrs])
+      pairs = [(key, i) for i, key in enumerate(keys)]
+      if not presorted:
+        pairs.sort(key=lambda pair: pair[0])
+      sides.append(pairs)
+
+    lidx, ridx = [], []
+    for i, j in merge_join(*sides):
+      lidx.append(i)
+      ridx.append(j)
+    if lidx:
+      yield left.take(lidx).merge(right.take(ridx))
+
+  def run_limit(self, op):
+    limit = int(op.limit())
+    nyielded = 0
+    if limit <= 0:
+      return
+    for batch in self.batches(op.c):
+      if nyielded + len(batch) >= limit:
+        yield batch.slice(0, limit - nyielded)
+        return
+      nyielded += len(batch)
+      yield batch
+
+  def run_groupby(self, op):
+    child = Batch.concat(self.batches(op.c))
+    if not len(child):
+      return
+
+    # group on the codes of dictionary encoded attributes
+    keys, dicts = self.keys(op.group_exprs, child)
+    hashtable = defaultdict(list)
+    for i, key in enumerate(keys):
+      hashtable[key].append(i)
+
+    # like the other interpretors, the last tuple of each group
+    # represents the group
+    groups = hashtable.items()
+    out = child.take([idxs[-1] for _, idxs in groups])
+    keycol = np.empty(len(groups), dtype=object)
+    groupcol = np.empty(len(groups), dtype=object)
+    for i, (key, idxs) in enumerate(groups):
+      keycol[i] = tuple(v if d is None else d.decoder[v] for v, d in zip(key, dicts))
+      groupcol[i] = child.take(idxs)
+    yield out.extend(GroupBy.GROUP_FIELDS, [keycol, groupcol])
+
+  def run_orderby(self, op):
+    # the batches are already in memory, so they are sorted in memory
+    child = Batch.concat(self.batches(op.c))
+    if not len(child):
+      return
+    cols = [self.eval(e, child).tolist() for e in op.order_exprs]
+    keys = map(op.sort_key(), zip(*cols))
+    order = sorted(range(len(child)), key=keys.__getitem__)
+    yield child.take(order)
+
+  def run_topk(self, op):
+    # like TopKHeap, only keep the k candidate rows (and their sort keys)
+    # that are the smallest so far.  Each input batch is added to the
+    # candidates, which are then cut back to k rows.
+    k = op.k()
+    if not k:
+      return
+    sort_key = op.sort_key()
+    cands, keys = None, []
+    for batch in self.batches(op.c):
+      if not len(batch):
+        continue
+      cols = [self.eval(e, batch).tolist() for e in op.order_exprs]
+      keys.extend(map(sort_key, zip(*cols)))
+      cands = batch if cands is None else Batch.concat([cands, batch])
+      if len(cands) > k:
+        # nsmallest() breaks ties by position, so earlier rows win
+        idx = heapq.nsmallest(k, range(len(cands)), key=keys.__getitem__)
+        cands, keys = cands.take(idx), [keys[i] for i in idx]
+    if cands is not None:
+      order = sorted(range(len(cands)), key=keys.__getitem__)
+      yield cands.take(order)
+
+  def run_project(self, op):
+    # if the query doesn't have a FROM clause (SELECT 1),
+    # then pass up a batch with one empty tuple
+    if op.c is None:
+      child = [Batch([], [], 1)]
+    else:
+      child = self.batches(op.c)
+
+    for batch in child:
+      # like Project.project(), compute the columns of the *s and the
+      # other expressions, then reorder them into the output's layout
+      vals, encs = [], []
+      for exp in op.exprs:
+        if isinstance(exp, Star):
+          # dictionary encoded columns are passed through, and decoded
+          # when the output rows are constructed
+          vals.extend(batch.columns)
+          encs.extend(batch.dicts)
+        else:
+          vals.append(self.eval(exp, batch))
+          encs.append(None)
+      schema, positions = op.layout(batch.fields)
+      yield Batch(schema, [vals[i] for i in positions], len(batch), 
+                  [encs[i] for i in positions])
+
+  def run_filter(self, op):
+    for batch in self.batches(op.c):
+      mask = np.asarray(self.eval(op.cond, batch), dtype=bool)
+      if mask.any():
+        yield batch.take(mask)
+
+  def run_distinct(self, op):
+    # like the row interpretors, keep at most op.budget() keys in memory,
+    # and dedupe the other rows by sorting them (see HashDistinct)
+    rows = HashDistinct(op.budget())
+    schema = None
+    for batch in self.batches(op.c):
+      schema = batch.schema
+      keep = [i for i, row in enumerate(batch) if rows.add(row)]
+      if keep:
+        yield batch.take(keep)
+
+    rest = []
+    for row in rows.rest():
+      rest.append(row)
+      if len(rest) >= self.batchsize:
+        yield Batch.from_tuples(schema, rest)
+        rest = []
+    if rest:
+      yield Batch.from_tuples(schema, rest)
+
+  def batches(self, op):
+    """
+    This function dispatches the current operator to the appropriate handler.
+    Each handler is a generator that yields the operator's output batches
+
+    @op current operator to execute
+    """
+    klass = op.__class__.__name__
+
+    if klass == "Print":
+      return self.run_print(op)
+    elif klass == "Scan":
+      return self.run_scan(op)
+    elif klass == "ThetaJoin":
+      return self.run_thetajoin(op)
+    elif klass == "HashJoin":
+      return self.run_hashjoin(op)
+    elif klass == "SortMergeJoin":
+      return self.run_sortmergejoin(op)
+    elif klass == "Limit":
+      return self.run_limit(op)
+    elif klass == "GroupBy":
+      return self.run_groupby(op)
+    elif klass == "OrderBy":
+      return self.run_orderby(op)
+    elif klass == "TopK":
+      return self.run_topk(op)
+    elif klass == "Filter":
+      return self.run_filter(op)
+    elif klass == "Project":
+      return self.run_project(op)
+    elif klass == "Distinct":
+      return self.run_distinct(op)
+    elif klass == "SubQuerySource":
+      return self.run_subquerysource(op)
+    else:
+      raise Exception("Did not recognize operator: %s" % klass)
 
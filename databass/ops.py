@@ -1,10 +1,13 @@
 import csv
 import math
+import heapq
 import inspect
 import pandas
 import numbers
 import numpy as np
 from collections import defaultdict
+from db import column, to_array, Row, Schema, EMPTY_ROW, concat_rows
+from spill import SpillFile
 
 try:
   # hack to get this code to work on Instabase
@@ -29,6 +32,96 @@ def cond_to_func(expr_or_func):
   raise Exception("Can't interpret as expression: %s" % expr_or_func)
 
 
+def conjuncts(expr):
+  """
+  Split @expr into the list of expressions that are AND-ed together
+  e.g.,  (A.a = B.b) and (B.c < 10)  -->  [A.a = B.b, B.c < 10]
+  """
+  if isinstance(expr, Paren):
+    return conjuncts(expr.c)
+  if isinstance(expr, Expr) and expr.r is not None and expr.op.lower() == "and":
+    return conjuncts(expr.l) + conjuncts(expr.r)
+  return [expr]
+
+def attr_stats(attr, op, db=None):
+  """
+  The db.ColumnStats of the table attribute @attr, if @attr is read from
+  one of the tables that subplan @op scans.  Otherwise None.
+  """
+  if not isinstance(attr, Attr):
+    return None
+  for scan in op.collect(Scan):
+    sdb = db or scan.db
+    if sdb is None or scan.tablename not in sdb:
+      continue
+    if attr.tablename and attr.tablename != scan.alias:
+      continue
+    table = sdb[scan.tablename]
+    if attr.attr in table.fields:
+      return table.stats[attr.attr]
+  return None
+
+def estimate_selectivity(expr, op, db=None):
+  """
+  Estimate the fraction of the rows of subplan @op that satisfy predicate
+  @expr, using the statistics of the scanned tables.  Only comparisons
+  between an attribute and a constant are estimated, e.g., a < 10 or 
+  a BETWEEN 1 AND 5.  Everything else has selectivity 1.
+  """
+  flipped = { "<": ">", "<=": ">=", ">": "<", ">=": "<=" }
+  if isinstance(expr, Paren):
+    return estimate_selectivity(expr.c, op, db)
+  if isinstance(expr, Between):
+    stats = attr_stats(expr.expr, op, db)
+    if (stats is None or not isinstance(expr.lower, Literal) or 
+        not isinstance(expr.upper, Literal)):
+      return 1.0
+    nonnull = float(stats.card - stats.nulls) / max(1, stats.card)
+    return nonnull * stats.hist.selectivity(expr.lower(), expr.upper())
+  if not isinstance(expr, Expr) or expr.r is None:
+    return 1.0
+  if expr.op not in ("=", "==", "!=", "<>", "<", "<=", ">", ">="):
+    return 1.0
+
+  attr, lit, cmp = expr.l, expr.r, expr.op
+  if isinstance(attr, Literal):
+    attr, lit, cmp = expr.r, expr.l, flipped.get(expr.op, expr.op)
+  if not isinstance(lit, Literal):
+    return 1.0
+  stats = attr_stats(attr, op, db)
+  if stats is None:
+    return 1.0
+  try:
+    return stats.selectivity(cmp, lit())
+  except TypeError:
+    # e.g., comparing a string attribute with a number
+    return 1.0
+
+def estimate_card(op, db=None):
+  """
+  Rough estimate of the number of rows the subplan @op produces, based on
+  the statistics of the tables that it scans.  Uses @db, or the database
+  of the Scan operators, and is infinite if neither is available.
+  """
+  if isinstance(op, Scan):
+    db = db or op.db
+    if db is None or op.tablename not in db:
+      return float("inf")
+    return db[op.tablename].stats.card
+  if isinstance(op, Limit):
+    return min(int(op.limit()), estimate_card(op.c, db))
+  if isinstance(op, Filter):
+    card = estimate_card(op.c, db)
+    for e in conjuncts(op.cond):
+      card *= estimate_selectivity(e, op.c, db)
+    return card
+  if isinstance(op, Join):
+    return estimate_card(op.l, db) * estimate_card(op.r, db)
+  if isinstance(op, UnaryOp) and op.c is not None:
+    return estimate_card(op.c, db)
+  return float("inf")
+
+
 ###################################################################
 #
 # These are the base operator classes
@@ -157,6 +250,24 @@ class Op(object):
   def to_python(self):
     return self.to_str()
 
+  def compiled(self, exprs):
+    """
+    @exprs an expression, or a list of expressions
+
+    Returns @exprs compiled into a python function (see compile_expr.py).
+    The function is cached until the operator's expressions are replaced,
+    e.g., by the optimizer.
+    """
+    from compile_expr import compile_expr
+    cache = self.__dict__.setdefault("_compiled", {})
+    # the cache entry references the expressions, so their ids are
+    # not reused while they are cached
+    key = tuple(map(id, exprs)) if isinstance(exprs, list) else id(exprs)
+    if key not in cache:
+      refs = tuple(exprs) if isinstance(exprs, list) else exprs
+      cache[key] = (refs, compile_expr(exprs))
+    return cache[key][1]
+
   def __str__(self):
     lines = []
     def f(op, path):
@@ -241,6 +352,8 @@ class SubQuerySource(Source):
 
   def __iter__(self):
     for row in self.c:
+      if self.alias and isinstance(row, Row):
+        row = row.schema.alias(self.alias).row_class(row)
       yield row
 
   def to_str(self):
@@ -264,8 +377,10 @@ class Scan(Source):
     if self.db == None:
       raise Exception("Scan: Make sure to call Scan.set_db before executing iterator")
 
-    for row in self.db[self.tablename]:
-      yield row
+    table = self.db[self.tablename]
+    row_class = Schema.get(table.fields, self.alias).row_class
+    for vals in table.tuples():
+      yield row_class(vals)
   
   def to_str(self):
     return "Scan(%s AS %s)" % (self.tablename, self.alias)
@@ -304,27 +419,26 @@ class ThetaJoin(Join):
     self.cond = cond_to_func(cond) 
 
   def __iter__(self):
+    cond = self.compiled(self.cond)
     for lrow in self.l:
       for rrow in self.r:
-        if self.cond(lrow, rrow):
-          newtup = dict()
-          newtup.update(lrow)
-          newtup.update(rrow)
-          yield newtup
+        if cond(lrow, rrow):
+          yield concat_rows(lrow, rrow)
 
   def to_str(self):
     return "THETAJOIN(ON %s)" % (str(self.cond))
 
     
-class HashJoin(Join):
+class EquiJoin(Join):
   """
-  Hash Join
+  Base class of the joins whose condition is that the values of the
+  left and right join attributes are the same
   """
   def __init__(self, l, r, join_attrs):
     """
     @l    left table of the join
     @r    right table of the join
-    @join_attrs two attributes to join on, hash join checks if the 
+    @join_attrs two attributes to join on, the join checks if the 
                 attribute values from the left and right tables are
                 the same.  Suppose:
                 
@@ -332,94 +446,417 @@ class HashJoin(Join):
 
                 then we return all pairs of (l, r) where 
                 l.STORE = r.STORE
+
+                For composite keys, pass a list of left attributes and
+                a list of right attributes:
+
+                  join_attrs = [["STORE", "ITEM"], ["s", "i"]]
+    """
+    super(EquiJoin, self).__init__(l, r)
+    lattrs, rattrs = join_attrs
+    if not isinstance(lattrs, (list, tuple)):
+      lattrs, rattrs = [lattrs], [rattrs]
+    if len(lattrs) != len(rattrs):
+      raise Exception("%s: need the same number of left and right join attributes" % 
+                      self.__class__.__name__)
+    self.lattrs = list(map(cond_to_func, lattrs))
+    self.rattrs = list(map(cond_to_func, rattrs))
+
+  @property
+  def cond(self):
     """
-    super(HashJoin, self).__init__(l, r)
-    self.join_attrs = join_attrs
+    The join condition as an expression, e.g., l.a = r.b
+    """
+    conds = [Expr("=", l, r) for l, r in zip(self.lattrs, self.rattrs)]
+    ret = conds[0]
+    for cond in conds[1:]:
+      ret = Expr("and", ret, cond)
+    return ret
 
-  def hash_func(self, val):
+  def key(self, row, attrs):
+    return self.compiled(attrs)(row)
+
+  def join_conds(self):
+    return " and ".join(["%s = %s" % (l, r) 
+                         for l, r in zip(self.lattrs, self.rattrs)])
+
+
+class HashJoin(EquiJoin):
+  """
+  Hash Join
+
+  Builds a hash index on whichever input the table statistics say is
+  smaller, then streams the other input through the index.
+  """
+  def build_side(self, db=None):
     """
-    This function explicitly represents the hash key function for
-    the hash table
+    Returns "left" if the left input is estimated to be smaller than the
+    right input, otherwise "right"
+
+    @db  Database for the estimates, if the Scans don't have one (see
+         estimate_card())
     """
-    return hash(val)
+    if estimate_card(self.l, db) < estimate_card(self.r, db):
+      return "left"
+    return "right"
 
   def __iter__(self):
     """
-    Build an index on the inner (right) source, then probe the index
-    for each row in the outer (left) source.  
+    Build an index on the smaller input, then probe the index
+    for each row of the other input.
     
-    Yields each join result
+    Yields each join result as soon as it is found
     """
-    # Hash join is equality on left_attr and right_attr    
-    left_attr = str(join_attrs[0])
-    right_attr = str(join_attrs[1])
-
-    # XXX: implement code to build the hash index
-
-    # go through the outer source and probe the hashindex
-    # make sure to use hash function to get the appropriate hash key
-    # XXX: implement the join code here.  It should construct each 
-    #      join result and "yield" it
-
-  def build_hash_index(self, child_iter, attr):
+    if self.build_side() == "left":
+      index = self.build_hash_index(self.l, self.lattrs)
+      for rrow in self.r:
+        for lrow in index.get(self.key(rrow, self.rattrs), ()):
+          yield concat_rows(lrow, rrow)
+    else:
+      index = self.build_hash_index(self.r, self.rattrs)
+      for lrow in self.l:
+        for rrow in index.get(self.key(lrow, self.lattrs), ()):
+          yield concat_rows(lrow, rrow)
+
+  def build_hash_index(self, child_iter, attrs):
     """
     @child_iter tuple iterator to construct an index over
-    @attr attribute name to build index on
+    @attrs attribute expressions to build index on
 
-    Loops through a tuple iterator and creates an index based on
-    the attr value
+    Loops through a tuple iterator and creates an index that maps
+    the tuple of attrs values to the list of rows with those values
     """
     # defaultdict will initialize a hash entry to a new list if
     # the entry is not found
     index = defaultdict(list)
     for row in child_iter:
-      # XXX: replace this code to populate the index
-      pass
+      index[self.key(row, attrs)].append(row)
     return index
     
   def to_str(self):
-    return "HASHJOIN(ON %s)" % (str(self.l), str(self.r), str(self.join_attrs))
+    return "HASHJOIN(ON %s)" % self.join_conds()
 
       
 
+class SortMergeJoin(EquiJoin):
+  """
+  Sort-Merge Join
+
+  Sorts each input on its join attributes with an ExternalSorter, unless
+  the input is already sorted, then merges the two sorted inputs.  Left
+  rows are joined with every right row with the same key, so duplicate
+  keys on both sides are fine, and only the right rows with the current
+  key are kept in memory during the merge.  The output is sorted on the
+  join attributes.
+  """
+
+  # default maximum number of rows of each input that are sorted in
+  # memory, or None to sort all of them in memory
+  MAX_ROWS = None
+
+  def __init__(self, l, r, join_attrs, presorted=(False, False), max_rows=None):
+    """
+    @presorted  pair of booleans, True if the left (right) input is
+                already in ascending order of its join attributes
+    @max_rows   maximum number of rows of an input to sort in memory
+                before sorted runs are written to disk.  Defaults to
+                SortMergeJoin.MAX_ROWS.
+    """
+    super(SortMergeJoin, self).__init__(l, r, join_attrs)
+    self.lsorted, self.rsorted = presorted
+    self.max_rows = max_rows
+
+  def budget(self):
+    """
+    Maximum number of rows of an input to sort in memory, or None
+    """
+    if self.max_rows is not None:
+      return self.max_rows
+    return SortMergeJoin.MAX_ROWS
+
+  def sides(self):
+    """
+    Returns [(left child, left attributes, left is sorted),
+             (right child, right attributes, right is sorted)]
+    """
+    return [(self.l, self.lattrs, self.lsorted), (self.r, self.rattrs, self.rsorted)]
+
+  def sorter(self, attrs):
+    return ExternalSorter(self.compiled(attrs), self.budget())
+
+  def __iter__(self):
+    sides = []
+    for child, attrs, presorted in self.sides():
+      if not presorted:
+        rows = self.sorter(attrs)
+        for row in child:
+          rows.add(row)
+        child = rows
+      sides.append(child)
+    for lrow, rrow in self.merge(*sides):
+      yield concat_rows(lrow, rrow)
+
+  def merge(self, lrows, rrows):
+    """
+    @lrows  left rows in ascending order of the left join attributes
+    @rrows  right rows in ascending order of the right join attributes
+
+    Yields the pairs (left row, right row) whose keys are the same
+    """
+    lkey, rkey = self.compiled(self.lattrs), self.compiled(self.rattrs)
+    return merge_join(((lkey(row), row) for row in lrows),
+                      ((rkey(row), row) for row in rrows))
+
+  def to_str(self):
+    return "SORTMERGEJOIN(ON %s)" % self.join_conds()
+
+
+def merge_join(left, right):
+  """
+  @left   iterator of (key, item) pairs in ascending order of key
+  @right  iterator of (key, item) pairs in ascending order of key
+
+  Yields (left item, right item) for every pair of items whose keys are
+  the same, in the order of the left items and then the right items.
+  """
+  right = iter(right)
+  rnext = next(right, None)
+  group, group_key = None, None   # right items with key group_key
+  for key, litem in left:
+    if group is None or key != group_key:
+      while rnext is not None and rnext[0] < key:
+        rnext = next(right, None)
+      group, group_key = [], key
+      while rnext is not None and rnext[0] == key:
+        group.append(rnext[1])
+        rnext = next(right, None)
+      if not group and rnext is None:
+        return
+    for ritem in group:
+      yield litem, ritem
+
+
 class GroupBy(UnaryOp):
-  def __init__(self, c, group_exprs):
+
+  # fields that GroupBy appends to each group's representative row
+  GROUP_FIELDS = ("__key__", "__group__")
+
+  # default maximum number of groups that GroupBy keeps in memory, or
+  # None to keep all of them
+  MAX_GROUPS = None
+
+  def __init__(self, c, group_exprs, max_groups=None):
     """
     @c           child operator
     @group_exprs list of functions that take the tuple as input and
                  outputs a scalar value
+    @max_groups  maximum number of groups to keep in memory before the
+                 rows of the other groups are spilled to disk.
+                 Defaults to GroupBy.MAX_GROUPS.
     """
     super(GroupBy, self).__init__(c)
     self.group_exprs = list(map(cond_to_func, group_exprs))
+    self.max_groups = max_groups
+
+  def budget(self):
+    """
+    Maximum number of groups to keep in memory, or None
+    """
+    if self.max_groups is not None:
+      return self.max_groups
+    return GroupBy.MAX_GROUPS
 
   def __iter__(self):
-    hashtable = defaultdict(lambda: [None, None, []])
+    groups = HashAggregator(self, self.budget())
     for tup in self.c:
-      key = tuple([e(tup) for e in op.group_exprs])
-      hashtable[key][0] = key
-      hashtable[key][1] = tup
-      hashtable[key][2].append(tup)
+      groups.add(tup)
+    for key, tup, group in groups:
+      yield self.group_row(tup, key, group)
 
-    for _, (key, tup, group) in hashtable.items():
-      tup = dict(tup)
-      tup["__key__"] = key
-      tup["__group__"] = group
-      yield tup
+  def aggregates(self):
+    """
+    Returns the aggregate functions that the Filters and the Project
+    above this operator evaluate on its groups.  Returns None if they
+    need the groups' rows, e.g., the Project outputs the __group__ field.
+    """
+    funcs, op, child = [], self.p, self
+    while isinstance(op, (Filter, Project)) and op.c is child:
+      exprs = [op.cond] if isinstance(op, Filter) else op.exprs
+      for e in exprs:
+        if not isinstance(e, ExprBase) or e.collect(Star):
+          return None
+        if any(a.attr == "__group__" for a in e.collect(Attr)):
+          return None
+        for f in e.collect(Func):
+          if f.name in Func.agg_func_lookup:
+            if f.name not in Func.agg_state_lookup:
+              return None
+            funcs.append(f)
+      if isinstance(op, Project):
+        return funcs
+      op, child = op.p, op
+    return None
+
+  def aggregator(self, aggs):
+    """
+    @aggs aggregate functions, see aggregates()
+
+    Returns functions (new, update).  new() returns the AggStates of a
+    new group, and update(states, tup) adds row @tup to the states.
+    """
+    index = dict((id(f), i) for i, f in enumerate(aggs))
+    classes = [Func.agg_state_lookup[f.name] for f in aggs]
+    argfs = [self.compiled(list(f.args)) for f in aggs]
+    def new():
+      return AggStates(index, [klass() for klass in classes])
+    def update(states, tup):
+      for state, argf in zip(states.states, argfs):
+        state.update(*argf(tup))
+    return new, update
+
+  def group_row(self, tup, key, group):
+    """
+    The output row of a group: its last row, plus its key and its rows
+    or AggStates
+    """
+    if isinstance(tup, Row):
+      row_class = tup.schema.extend(self.GROUP_FIELDS).row_class
+      return row_class(tuple.__add__(tup, (key, group)))
+    tup = dict(tup)
+    tup["__key__"] = key
+    tup["__group__"] = group
+    return tup
 
   def to_str(self):
     return "GROUPBY(%s)" % (",".join(map(str, self.group_exprs)))
 
 
+class HashAggregator(object):
+  """
+  Hybrid hash aggregation of the rows of a GroupBy.
+
+  Keeps each group's key, last row, and rows or AggStates (see
+  GroupBy.aggregates()) in a hash table of at most @max_groups groups.
+  Once the table is full, the rows of groups that are not in the table
+  are written to one of @fanout SpillFiles by the hash of their keys.
+  After the input ends, each partition is aggregated the same way, and
+  partitions that still have too many groups are partitioned again
+  with a different hash.
+
+  All of a group's rows are aggregated by one table, in input order, so
+  each group is the same as with an in-memory hash table; only the
+  order of the groups differs.
+  """
+  # partitions deeper than this are aggregated in memory
+  MAX_DEPTH = 8
+
+  def __init__(self, op, max_groups=None, fanout=16, level=0):
+    """
+    @op          the GroupBy
+    @max_groups  maximum number of groups in memory, or None
+    @fanout      number of partitions of the spilled rows
+    @level       recursion depth of the partition
+    """
+    self.op = op
+    self.max_groups = max_groups
+    self.fanout = fanout
+    self.level = level
+    self.keyf = op.compiled(op.group_exprs)
+    aggs = op.aggregates()
+    if aggs is None:
+      self.new, self.update = list, list.append
+    else:
+      # only keep the running states of the aggregates
+      self.new, self.update = op.aggregator(aggs)
+    self.hashtable = {}
+    self.partitions = None
+
+  def add(self, tup):
+    key = self.keyf(tup)
+    entry = self.hashtable.get(key)
+    if entry is None:
+      if self.max_groups is not None and len(self.hashtable) >= self.max_groups:
+        self.spill(key, tup)
+        return
+      entry = self.hashtable[key] = [key, None, self.new()]
+    entry[1] = tup
+    self.update(entry[2], tup)
+
+  def spill(self, key, tup):
+    if self.partitions is None:
+      self.partitions = [SpillFile() for _ in xrange(self.fanout)]
+    self.partitions[hash((self.level, key)) % self.fanout].append(tup)
+
+  def __iter__(self):
+    """
+    Yields [key, last row, rows or AggStates] of each group
+    """
+    for entry in self.hashtable.itervalues():
+      yield entry
+    self.hashtable = {}
+
+    partitions, self.partitions = self.partitions or [], None
+    max_groups = self.max_groups
+    if self.level + 1 >= self.MAX_DEPTH:
+      max_groups = None
+    for part in partitions:
+      groups = HashAggregator(self.op, max_groups, self.fanout, self.level + 1)
+      for tup in part:
+        groups.add(tup)
+      part.close()
+      for entry in groups:
+        yield entry
+
+
+class SortKey(object):
+  """
+  Sort key of a row whose values are sorted in ascending or descending
+  order, e.g., for ORDER BY a DESC, b ASC
+  """
+  __slots__ = ("vals", "desc")
+
+  def __init__(self, vals, desc):
+    """
+    @vals  the row's tuple of sort values
+    @desc  list of booleans, True if the value is sorted in descending order
+    """
+    self.vals = vals
+    self.desc = desc
+
+  def __lt__(self, other):
+    for a, b, desc in zip(self.vals, other.vals, self.desc):
+      if a != b:
+        if desc:
+          return b < a
+        return a < b
+    return False
+
+  def __eq__(self, other):
+    return self.vals == other.vals
+
+  def __ne__(self, other):
+    return self.vals != other.vals
+
+
 class OrderBy(UnaryOp):
-  def __init__(self, c, order_exprs, ascdesc="asc"):
+
+  # default maximum number of rows that OrderBy sorts in memory, or None
+  # to sort all of them in memory
+  MAX_ROWS = None
+
+  def __init__(self, c, order_exprs, ascdesc="asc", max_rows=None):
     """
     @c            child operator
     @order_exprs  ordered list of function that take the tuple as input 
                   and outputs a scalar value
+    @ascdesc      "asc" or "desc", or a list with one for each expression
+    @max_rows     maximum number of rows to sort in memory before sorted
+                  runs are written to disk.  Defaults to OrderBy.MAX_ROWS.
     """
     super(OrderBy, self).__init__(c)
     self.order_exprs = list(map(cond_to_func, order_exprs))
     self.ascdesc = ascdesc
+    self.max_rows = max_rows
     self.normalize_ascdesc()
 
   def normalize_ascdesc(self):
@@ -431,12 +868,47 @@ class OrderBy(UnaryOp):
     elif isinstance(self.ascdesc, str):
       self.ascdesc = [self.ascdesc]
 
+    # the parser uses [] for terms without ASC or DESC
+    self.ascdesc = [d.lower() if isinstance(d, str) and d else "asc"
+                    for d in self.ascdesc]
     for i in range(len(self.order_exprs)):
-      if len(self.ascdesc) < i:
+      if len(self.ascdesc) <= i:
         self.ascdesc.append("asc")
 
+  def budget(self):
+    """
+    Maximum number of rows to sort in memory, or None
+    """
+    if self.max_rows is not None:
+      return self.max_rows
+    return OrderBy.MAX_ROWS
+
+  def descending(self):
+    return [d == "desc" for d in self.ascdesc[:len(self.order_exprs)]]
+
+  def sort_key(self):
+    """
+    Returns a function that maps a tuple of the order_exprs' values to
+    its sort key
+    """
+    desc = self.descending()
+    if not any(desc):
+      return lambda vals: vals
+    return lambda vals: SortKey(vals, desc)
+
+  def row_key(self):
+    """
+    Returns a function that maps a row to its sort key
+    """
+    keyf, sort_key = self.compiled(self.order_exprs), self.sort_key()
+    return lambda row: sort_key(keyf(row))
+
   def __iter__(self):
-    raise Exception("ORDERBY.__iter__ is not implemented")
+    rows = ExternalSorter(self.row_key(), self.budget())
+    for row in self.c:
+      rows.add(row)
+    for row in rows:
+      yield row
 
   def to_str(self):
     s = ", ".join(["%s %s" % (e, d) 
@@ -444,6 +916,129 @@ class OrderBy(UnaryOp):
     return "ORDERBY(%s)" % s
 
 
+class ExternalSorter(object):
+  """
+  External merge sort of rows, e.g., of an OrderBy's rows.
+
+  Rows are buffered until there are @max_rows of them, and the buffer is
+  then sorted and written to a SpillFile as a sorted run.  After the
+  input ends, the runs and the sorted rest of the buffer are merged with
+  heapq.merge().  Python 2's merge() doesn't take a key function, so the
+  merged entries are (sort key, run number, row); rows with the same key
+  are output in input order, like the in-memory sort.
+  """
+  def __init__(self, key, max_rows=None):
+    """
+    @key       function that maps a row to its sort key, see
+               OrderBy.row_key()
+    @max_rows  maximum number of rows in memory, or None
+    """
+    self.key = key
+    self.max_rows = max_rows
+    self.buf = []
+    self.runs = []
+
+  def add(self, row):
+    self.buf.append(row)
+    if self.max_rows is not None and len(self.buf) >= self.max_rows:
+      run = SpillFile()
+      for row in self.sorted_buffer():
+        run.append(row)
+      self.runs.append(run)
+
+  def sorted_buffer(self):
+    buf, self.buf = self.buf, []
+    buf.sort(key=self.key)
+    return buf
+
+  def __iter__(self):
+    """
+    Yields the rows in sorted order
+    """
+    last = self.sorted_buffer()
+    runs, self.runs = self.runs, []
+    if not runs:
+      for row in last:
+        yield row
+      return
+
+    def decorate(i, rows):
+      for row in rows:
+        yield (self.key(row), i, row)
+    runs.append(last)
+    for _, _, row in heapq.merge(*[decorate(i, run) for i, run in enumerate(runs)]):
+      yield row
+    for run in runs[:-1]:
+      run.close()
+
+
+class TopK(OrderBy):
+  """
+  The first @limit rows of an OrderBy, i.e., Limit(OrderBy(...)), found
+  with a bounded heap instead of sorting all of the rows.  The optimizer
+  replaces a Limit over an OrderBy with a TopK.
+  """
+  def __init__(self, c, order_exprs, ascdesc="asc", limit=1):
+    """
+    @limit  number of rows to return
+    """
+    super(TopK, self).__init__(c, order_exprs, ascdesc)
+    self.limit = limit
+    if isinstance(self.limit, int):
+      self.limit = Literal(self.limit)
+
+  def k(self):
+    return max(0, int(self.limit(None)))
+
+  def __iter__(self):
+    rows = TopKHeap(self, self.k())
+    for row in self.c:
+      rows.add(row)
+    for row in rows:
+      yield row
+
+  def to_str(self):
+    s = ", ".join(["%s %s" % (e, d)
+                for e, d in zip(self.order_exprs, self.ascdesc)])
+    return "TOPK(%s, %s)" % (self.limit, s)
+
+
+class TopKHeap(object):
+  """
+  The first @k rows in the sort order of a TopK, using O(k) memory and
+  O(n log k) time.
+
+  Rows are buffered as (sort key, row number, row) entries, and whenever
+  the buffer holds 2k entries, heapq.nsmallest() keeps the k smallest.
+  The largest entry that was kept is a threshold that later rows must
+  beat, so most rows of a large input are dropped after one comparison.
+  The row numbers break ties, so rows with the same key are output in
+  input order, like OrderBy.
+  """
+  def __init__(self, op, k):
+    self.k = k
+    self.key = op.row_key()
+    self.buf = []
+    self.threshold = None
+    self.n = 0
+
+  def add(self, row):
+    if not self.k:
+      return
+    entry = (self.key(row), self.n, row)
+    self.n += 1
+    if self.threshold is not None and not entry < self.threshold:
+      return
+    self.buf.append(entry)
+    if len(self.buf) >= 2 * self.k:
+      self.buf = heapq.nsmallest(self.k, self.buf)
+      self.threshold = self.buf[-1] if self.buf else None
+
+  def __iter__(self):
+    for _, _, row in heapq.nsmallest(self.k, self.buf):
+      yield row
+
+
 class Filter(UnaryOp):
   def __init__(self, c, cond):
     """
@@ -454,8 +1049,9 @@ class Filter(UnaryOp):
     self.cond = cond_to_func(cond)
 
   def __iter__(self):
+    cond = self.compiled(self.cond)
     for row in self.c:
-      if self.cond(row):
+      if cond(row):
         yield row
 
   def to_str(self):
@@ -479,9 +1075,11 @@ class Limit(UnaryOp):
     if isinstance(self.limit, int):
       self.limit = Literal(self.limit)
   
-    l =  int(self.limit(None))
-    if l < 0:
-      raise Exception("LIMIT must not be negative: %d" % l)
+    # the value of a placeholder is only known when the query runs
+    if not self.limit.collect(Param):
+      l =  int(self.limit(None))
+      if l < 0:
+        raise Exception("LIMIT must not be negative: %d" % l)
 
   def __iter__(self):
     # TODO: add code to enforce the offset.  Recall that the offset
@@ -502,19 +1100,113 @@ class Limit(UnaryOp):
     #       But we will check that it prints the offset expression
     return "LIMIT(%s)" % self.limit
 
+def distinct_key(row):
+  """
+  The key that Distinct compares @row on: the tuple of its values, or
+  of its sorted items if it is a dictionary.  Values that can't be
+  hashed (e.g., the rows of a group) are compared by their repr().
+  """
+  if isinstance(row, dict):
+    key = tuple(sorted(row.iteritems()))
+  else:
+    key = tuple(row)
+  try:
+    hash(key)
+  except TypeError:
+    key = tuple(hashable(v) for v in key)
+  return key
+
+def hashable(v):
+  try:
+    hash(v)
+    return v
+  except TypeError:
+    return repr(v)
+
+
 class Distinct(UnaryOp):
 
+  # default maximum number of distinct rows that Distinct keeps in
+  # memory, or None to keep all of them
+  MAX_ROWS = None
+
+  def __init__(self, c, max_rows=None):
+    """
+    @c         child operator
+    @max_rows  maximum number of distinct rows to remember before the
+               rest of the rows are deduplicated by sorting them.
+               Defaults to Distinct.MAX_ROWS.
+    """
+    super(Distinct, self).__init__(c)
+    self.max_rows = max_rows
+
+  def budget(self):
+    """
+    Maximum number of distinct rows to keep in memory, or None
+    """
+    if self.max_rows is not None:
+      return self.max_rows
+    return Distinct.MAX_ROWS
+
   def __iter__(self):
-    seen = set()
+    rows = HashDistinct(self.budget())
     for row in self.c:
-      key = str(row)
-      if key in seen: continue
+      if rows.add(row):
+        yield row
+    for row in rows.rest():
       yield row
-      seen.add(key)
 
   def to_str(self):
     return "DISTINCT()"
 
+class HashDistinct(object):
+  """
+  Removes duplicate rows using a hash set of their distinct_key()s.
+
+  The first row with each key is output as soon as it arrives.  Once the
+  set holds @max_rows keys, rows with other keys are passed to an
+  ExternalSorter that sorts them by key, and they are deduplicated after
+  the input ends by comparing each sorted row with the previous one.
+  """
+  def __init__(self, max_rows=None):
+    """
+    @max_rows  maximum number of keys in memory, or None
+    """
+    self.max_rows = max_rows
+    self.seen = set()
+    self.sorter = None
+
+  def add(self, row):
+    """
+    Returns True if @row should be output now.  Returns False if it is
+    a duplicate, or if it is output by rest().
+    """
+    key = distinct_key(row)
+    if key in self.seen:
+      return False
+    if self.max_rows is not None and len(self.seen) >= self.max_rows:
+      if self.sorter is None:
+        self.sorter = ExternalSorter(distinct_key, self.max_rows)
+      self.sorter.add(row)
+      return False
+    self.seen.add(key)
+    return True
+
+  def rest(self):
+    """
+    Yields the distinct rows that were passed to the sorter
+    """
+    sorter, self.sorter = self.sorter, None
+    if sorter is None:
+      return
+    prev = None
+    for i, row in enumerate(sorter):
+      key = distinct_key(row)
+      if i == 0 or key != prev:
+        yield row
+      prev = key
+
+
 class Project(UnaryOp):
   def __init__(self, c, exprs, aliases=[]):
     """
@@ -528,6 +1220,10 @@ class Project(UnaryOp):
     self.aliases = list(aliases) or []
     self.set_default_aliases()
 
+    # input Schema -> (output Schema, positions), see layout().  positions
+    # is None if the values are already in the output's order
+    self._layouts = {}
+
   def set_default_aliases(self):
     for i, expr in enumerate(self.exprs):
       if i >= len(self.aliases):
@@ -547,16 +1243,59 @@ class Project(UnaryOp):
     # if the query doesn't have a FROM clause (SELECT 1),
     # then pass up an empty tuple
     if self.c == None:
-      child_iter = [dict()]
+      child_iter = [EMPTY_ROW]
 
     for row in child_iter:
-      ret = dict()
-      for exp, alias in zip(self.exprs, self.aliases):
-        if isinstance(exp, Star):
-          ret.update(exp(row))
-        else:
-          ret[alias] = exp(row)
-      yield ret
+      yield self.project(row)
+
+  def layout(self, fields):
+    """
+    @fields the fields of an input row
+
+    Returns (output Schema, positions).  The values computed for a row
+    (the input row's values for each *, and one value per other
+    expression) are reordered by positions to build the output row.
+    A * keeps all of the input's fields, even if some have the same name,
+    but an aliased expression replaces an earlier field with its name.
+    """
+    names, positions, slots = [], [], {}
+    for exp, alias in zip(self.exprs, self.aliases):
+      if isinstance(exp, Star):
+        for f in fields:
+          slots[f] = len(names)
+          names.append(f)
+          positions.append(len(positions))
+        continue
+      pos = len(positions)
+      positions.append(pos)
+      if alias in slots:
+        positions[slots[alias]] = pos
+        positions.pop()
+      else:
+        slots[alias] = len(names)
+        names.append(alias)
+    return Schema.get(names), positions
+
+  def project(self, row):
+    """
+    Compute the output row for input @row
+    """
+    schema = row.schema if isinstance(row, Row) else tuple(row.keys())
+    layout = self._layouts.get(schema)
+    if layout is None:
+      fields = schema.fields if isinstance(row, Row) else schema
+      out, positions = self.layout(fields)
+      nvals = sum(len(fields) if isinstance(e, Star) else 1 for e in self.exprs)
+      if positions == range(nvals):
+        positions = None
+      layout = self._layouts[schema] = (out, positions)
+    out, positions = layout
+
+    # the values of the expressions, with *s expanded
+    vals = self.compiled(self.exprs)(row)
+    if positions is not None:
+      vals = [vals[i] for i in positions]
+    return out.row_class(vals)
 
   def to_str(self):
     args = ", ".join(["%s AS %s" % (e, a) for (e, a) in  zip(self.exprs, self.aliases)])
@@ -610,10 +1349,76 @@ def binary(op, l, r):
   if op == ">=": return l >= r
   return True
 
+def unary_batch(op, v):
+  """
+  vectorized version of unary() that operates on numpy arrays
+  """
+  if op == "+":
+    return v
+  if op == "-":
+    return np.negative(v)
+  if op.lower() == "not":
+    return np.logical_not(v)
+
+def binary_batch(op, l, r):
+  """
+  vectorized version of binary() that operates on numpy arrays
+  """
+  if op == "and": return np.logical_and(l, r)
+  if op == "or": return np.logical_or(l, r)
+  return binary(op, l, r)
+
+def encoded_batch(expr, batch, batch2=None):
+  """
+  If @expr is an attribute that is dictionary encoded in @batch (or
+  @batch2), returns its (codes, db.Dictionary) pair, otherwise None
+  """
+  while isinstance(expr, Paren):
+    expr = expr.c
+  if not isinstance(expr, Attr):
+    return None
+  pos = expr.locate(batch.schema, batch2 and batch2.schema)
+  if pos is None:
+    return None
+  return (batch2 if pos[0] else batch).codes(pos[1])
+
+def equality_batch(op, l, r, batch, batch2=None):
+  """
+  Evaluates l = r (or l <> r) over dictionary encoded attributes by
+  comparing their integer codes instead of decoding the strings.
+  Returns None if neither side is encoded.
+  """
+  lenc = encoded_batch(l, batch, batch2)
+  renc = encoded_batch(r, batch, batch2)
+  if lenc is None and renc is None:
+    return None
+
+  if lenc is None:
+    l, r, lenc, renc = r, l, renc, lenc
+  codes, d = lenc
+  if renc is not None:
+    rcodes, rd = renc
+    eq = (codes == d.translate(rd)[rcodes]) & (codes >= 0)
+  elif isinstance(r, Literal):
+    eq = codes == d.code(r.v)
+  else:
+    return None
+  if op == "=":
+    return eq
+  return np.logical_not(eq)
+
 class ExprBase(Op):
   def __str__(self):
     return self.to_str()
 
+  def eval_batch(self, batch, batch2=None):
+    """
+    Vectorized version of __call__().  Evaluates the expression over
+    every row in @batch (and @batch2) and returns a numpy array, or a
+    scalar if the value is the same for every row.
+    """
+    raise Exception("%s can't be evaluated over a batch" % self.__class__.__name__)
+
 class Expr(ExprBase):
   def __init__(self, op, l, r=None):
     self.op = op
@@ -640,12 +1445,26 @@ class Expr(ExprBase):
     r = self.r(tup, tup2)
     return binary(self.op, l, r)
 
+  def eval_batch(self, batch, batch2=None):
+    if self.op in ("=", "<>", "!=") and self.r is not None:
+      ret = equality_batch(self.op, self.l, self.r, batch, batch2)
+      if ret is not None:
+        return ret
+    l = self.l.eval_batch(batch, batch2)
+    if self.r is None:
+      return unary_batch(self.op, l)
+    r = self.r.eval_batch(batch, batch2)
+    return binary_batch(self.op, l, r)
+
 class Paren(UnaryOp, ExprBase):
   def to_str(self):
     return "(%s)" % self.c
 
   def __call__(self, tup, tup2=None):
-    return self.c(tup)
+    return self.c(tup, tup2)
+
+  def eval_batch(self, batch, batch2=None):
+    return self.c.eval_batch(batch, batch2)
 
 
 class Between(ExprBase):
@@ -671,6 +1490,99 @@ class Between(ExprBase):
     u = self.upper(tup, tup2)
     return e >= l and e <= u
 
+  def eval_batch(self, batch, batch2=None):
+    e = self.expr.eval_batch(batch, batch2)
+    l = self.lower.eval_batch(batch, batch2)
+    u = self.upper.eval_batch(batch, batch2)
+    return np.logical_and(e >= l, e <= u)
+
+class CountState(object):
+  """
+  Running state of count(), updated with the arguments of each row
+  """
+  def __init__(self):
+    self.n = 0
+
+  def update(self, *args):
+    self.n += 1
+
+  def value(self):
+    return self.n
+
+class SumState(object):
+  def __init__(self):
+    self.n = 0
+    self.sum = 0
+
+  def update(self, v):
+    self.n += 1
+    self.sum += v
+
+  def value(self):
+    return self.sum
+
+class AvgState(SumState):
+  def value(self):
+    return self.sum / float(self.n)
+
+class StdState(object):
+  """
+  Population standard deviation from the count, sum and sum of squares.
+  The values are shifted by the first value, so that the sums stay
+  small and the variance doesn't cancel out.
+  """
+  def __init__(self):
+    self.n = 0
+    self.shift = None
+    self.sum = 0.
+    self.sumsq = 0.
+
+  def update(self, v):
+    if self.shift is None:
+      self.shift = v
+    d = v - self.shift
+    self.n += 1
+    self.sum += d
+    self.sumsq += d * d
+
+  def value(self):
+    mean = self.sum / self.n
+    return math.sqrt(max(self.sumsq / self.n - mean * mean, 0.))
+
+class MinState(object):
+  def __init__(self):
+    self.v = None
+
+  def update(self, v):
+    if self.v is None or v < self.v:
+      self.v = v
+
+  def value(self):
+    return self.v
+
+class MaxState(MinState):
+  def update(self, v):
+    if self.v is None or v > self.v:
+      self.v = v
+
+
+class AggStates(object):
+  """
+  Running states of a group's aggregate functions.  GroupBy stores them
+  in the group's __group__ field instead of the group's rows, so that it
+  only keeps O(groups) state, and Func.aggregate() reads them.
+  """
+  def __init__(self, index, states):
+    self.index = index      # id of an aggregate Func -> position of its state
+    self.states = states
+
+  def value(self, func):
+    i = self.index.get(id(func))
+    if i is None:
+      raise Exception("aggregation function %s was not computed for the group" % func)
+    return self.states[i].value()
+
+
 class Func(ExprBase): 
   """
   This object needs to deal with scalar AND aggregation functions.
@@ -680,7 +1592,21 @@ class Func(ExprBase):
     count=len,
     sum=np.sum,
     std=np.std,
-    stddev=np.std
+    stddev=np.std,
+    min=min,
+    max=max
+  )
+
+  # classes of the running states of the aggregation functions, see
+  # GroupBy.aggregates()
+  agg_state_lookup = dict(
+    avg=AvgState,
+    count=CountState,
+    sum=SumState,
+    std=StdState,
+    stddev=StdState,
+    min=MinState,
+    max=MaxState
   )
   scalar_func_lookup = dict(
     lower=lambda s: str(s).lower()
@@ -704,21 +1630,47 @@ class Func(ExprBase):
     f = Func.agg_func_lookup.get(self.name, None)
     if f:
       if "__group__" not in tup:
-        raise Exception("aggregation function %s called but input is not a group!")
-      args = []
-      for gtup in tup["__group__"]:
-        args.append([arg(gtup) for arg in self.args])
-
-      # make the arguments columnar:
-      # [ (a,a,a,a), (b,b,b,b) ]
-      args = zip(*args)
-      return f(*args)
+        raise Exception("aggregation function %s called but input is not a group!" % self.name)
+      return self.aggregate(tup["__group__"])
 
 
-    f = agg_func_lookup.get(self.name, None)
+    f = Func.scalar_func_lookup.get(self.name, None)
     if f:
       args = [arg(tup, tup2) for arg in self.args]
-      return f(args)
+      return f(*args)
+
+    raise Exception("I don't recognize function %s" % self.name)
+
+  def aggregate(self, group):
+    """
+    @group the rows of a group, or its AggStates
+
+    Returns the value of this aggregation function over the group
+    """
+    if isinstance(group, AggStates):
+      return group.value(self)
+    args = self.compiled(list(self.args))
+
+    # make the arguments columnar:
+    # [ (a,a,a,a), (b,b,b,b) ]
+    return Func.agg_func_lookup[self.name](*zip(*[args(gtup) for gtup in group]))
+
+  def eval_batch(self, batch, batch2=None):
+    f = Func.agg_func_lookup.get(self.name, None)
+    if f:
+      if "__group__" not in batch:
+        raise Exception("aggregation function %s called but input is not a group!" % self.name)
+      vals = []
+      for group in batch["__group__"]:
+        args = [column(arg.eval_batch(group), len(group)) for arg in self.args]
+        vals.append(f(*args))
+      return to_array(vals)
+
+    f = Func.scalar_func_lookup.get(self.name, None)
+    if f:
+      n = len(batch)
+      args = [column(arg.eval_batch(batch, batch2), n).tolist() for arg in self.args]
+      return to_array([f(*vals) for vals in zip(*args)])
 
     raise Exception("I don't recognize function %s" % self.name)
 
@@ -729,17 +1681,43 @@ class Literal(ExprBase):
   def __call__(self, tup=None, tup2=None): 
     return self.v
 
+  def eval_batch(self, batch, batch2=None):
+    return self.v
+
   def to_str(self):
     if isinstance(self.v, str):
       return "'%s'" % self.v
     return str(self.v)
 
 
+class Param(Literal):
+  """
+  A ? or :name placeholder, whose value is bound when the query runs.
+  The Params of a query share the @params list, and this Param's value
+  is params[slot].  See prepared.py and plan_cache.py.
+  """
+  def __init__(self, slot, params, name=None):
+    self.slot = slot
+    self.params = params
+    self.name = name
+
+  @property
+  def v(self):
+    return self.params[self.slot]
+
+  def to_str(self):
+    if self.name:
+      return ":%s" % self.name
+    return "?%d" % (self.slot + 1)
+
+
 class Bool(ExprBase):
   def __init__(self, v):
     self.v = v
   def __call__(self, *args, **kwargs):
     return self.v
+  def eval_batch(self, batch, batch2=None):
+    return self.v
   def to_str(self):
     return str(self.v)
 
@@ -748,12 +1726,71 @@ class Attr(ExprBase):
     self.attr = attr
     self.tablename = tablename
 
+    # (Schema, loose) -> position of the attribute, see offset()
+    self._offsets = {}
+
   def __call__(self, tup, tup2=None):
+    pos = self.position(tup, tup2)
+    if pos is not None:
+      return tuple.__getitem__(tup2 if pos[0] else tup, pos[1])
     if self.attr in tup:
       return tup[self.attr]
     if tup2 and self.attr in tup2:
       return tup2[self.attr]
-    raise Exception("couldn't find %s in either tuple" % self.attr)
+    raise Exception("couldn't find %s in either tuple" % self)
+
+  def position(self, tup, tup2=None):
+    """
+    Returns (0, i) if the attribute is at offset i of Row @tup, (1, i) if
+    it is at offset i of Row @tup2, or None if it isn't found or the
+    tuples are dictionaries.
+    """
+    if not isinstance(tup, Row):
+      return None
+    if tup2 is None:
+      return self.locate(tup.schema)
+    if not isinstance(tup2, Row):
+      return None
+    return self.locate(tup.schema, tup2.schema)
+
+  def locate(self, schema, schema2=None):
+    """
+    Like position(), for rows of Schemas @schema and @schema2
+    """
+    idx = self.offset(schema, schema2 is None)
+    if idx is not None:
+      return (0, idx)
+    if schema2 is None:
+      return None
+    idx = self.offset(schema2)
+    if idx is not None:
+      return (1, idx)
+    # the attribute may be qualified with the table of the other tuple
+    idx = schema.index(self.attr)
+    if idx is not None:
+      return (0, idx)
+    return None
+
+  def offset(self, schema, loose=True):
+    """
+    Position of the attribute in rows of @schema, or None.  A qualified
+    attribute (A.a) prefers a field of its table.  If @loose, it falls
+    back to the last field with the attribute's name.
+    """
+    key = (schema, loose)
+    if key in self._offsets:
+      return self._offsets[key]
+    idx = schema.index(self.attr, self.tablename)
+    if idx is None and loose:
+      idx = schema.index(self.attr)
+    self._offsets[key] = idx
+    return idx
+
+  def eval_batch(self, batch, batch2=None):
+    pos = self.locate(batch.schema, batch2 and batch2.schema)
+    if pos is None:
+      raise Exception("couldn't find %s in either batch" % self)
+    return (batch2 if pos[0] else batch).column(pos[1])
 
   def to_str(self):
     if self.tablename:
@@ -1,3 +1,5 @@
+import math
+import timeit
 from ops import *
 from itertools import *
 from collections import *
@@ -10,18 +12,72 @@ def flatten(list_of_lists):
   map(ret.extend, list_of_lists)
   return ret
 
+def and_exprs(exprs):
+  """
+  Combine a non-empty list of expressions into a single AND expression
+  """
+  ret = exprs[0]
+  for e in exprs[1:]:
+    ret = Expr("and", ret, e)
+  return ret
+
+def source_aliases(op):
+  """
+  The aliases of the FROM clause sources that a join subplan reads from
+  """
+  if isinstance(op, Join):
+    return source_aliases(op.l) | source_aliases(op.r)
+  if isinstance(op, Filter):
+    return source_aliases(op.c)
+  return set([getattr(op, "alias", None)])
+
 
 class Optimizer(object):
-  def __init__(self, db):
+  def __init__(self, db, bushy=False, max_dp_tables=12, hash_join_rows=None):
+    """
+    @db             the Database
+    @bushy          consider bushy join plans instead of only left-deep plans
+    @max_dp_tables  FROM clauses with more tables than this are planned
+                    greedily instead of with dynamic programming
+    @hash_join_rows maximum estimated number of rows that a HashJoin may
+                    build its hash table on.  Joins of larger inputs are
+                    sort-merge joins.  None means no limit.
+    """
     self.db = db
+    self.bushy = bushy
+    self.max_dp_tables = max_dp_tables
+    self.hash_join_rows = hash_join_rows
+
+    # join orders considered, and the time spent choosing them, by the
+    # last call, summed over its FROM clauses
+    self.plans_tested = 0
+    self.opt_time = 0.0
 
   def __call__(self, op):
     if not op: return None
+    self.plans_tested = 0
+    self.opt_time = 0.0
 
     # If there's a From operator in the tree, 
     # then replace with join tree
     while op.collectone("From"):
       op = self.expand_from_op(op)
+    return self.fuse_topk(op)
+
+  def fuse_topk(self, op):
+    """
+    Replace each Limit over an OrderBy with a TopK, which only keeps the
+    rows that can still be in the result
+    """
+    for limit in op.collect(Limit):
+      orderby = limit.c
+      if not orderby or orderby.__class__ is not OrderBy:
+        continue
+      topk = TopK(orderby.c, orderby.order_exprs, orderby.ascdesc, limit.limit)
+      if limit is op:
+        op = topk
+      else:
+        limit.replace(topk)
     return op
 
   def expand_from_op(self, op):
@@ -35,6 +91,7 @@ class Optimizer(object):
     2. Keep the equality join predicates that only reference tables in
        the operator F
     3. Pick a join order 
+    4. Pick physical join operators, see physical_plan()
     """
 
     # pick the first From clause to replace with join operators
@@ -42,33 +99,214 @@ class Optimizer(object):
     sources = fromop.cs
     sourcealiases = [s.alias for s in sources]
 
-    # get all equi-join predicates 
-    filters = op.collect("Filter")
+    # get all equi-join predicates.  Only top-level conjuncts can be
+    # join predicates: an equality inside an OR or NOT doesn't have to hold
+    filters = self.ancestor_filters(fromop)
     preds = []
     for f in filters:
-      if fromop.is_ancestor(f):
-        for e in f.collect(Expr):
-          if self.valid_join_expr(e, sources):
-            preds.append(e)
-
-    join_tree = None
-    for source in sources:
-      if join_tree is None:
-        join_tree = source
-      else:
-        join_tree = ThetaJoin(join_tree, source, Bool(True))
-    
-    
-    # XXX: Uncomment the following two lines of code and run this file to
-    #      try out our naive Selinger implementation.  Note that the current
-    #      implementation does NOT generate good plans because you need to implement
-    #      cost and cardinality estimates first!
-    # opt = SelingerOpt(self.db)
-    # join_tree = opt(preds, sources)
+      for e in conjuncts(f.cond):
+        if e.is_type(Expr) and self.valid_join_expr(e, sources):
+          preds.append(e)
 
+    opt = SelingerOpt(self.db, self.bushy, self.max_dp_tables, self.equi_join_cost)
+    join_tree = opt(preds, sources)
+    self.plans_tested += opt.plans_tested
+    self.opt_time += opt.opt_time
+
+    join_tree = self.physical_plan(join_tree, filters)
     fromop.replace(join_tree)
+
+    # drop WHERE clauses whose predicates were all moved into the joins
+    for f in filters:
+      if f.cond is None:
+        if f is op:
+          op = f.c
+          op.p = None
+        else:
+          f.replace(f.c)
     return op
 
+  def ancestor_filters(self, op):
+    """
+    The Filter operators above @op that belong to the same (sub)query
+    """
+    filters = []
+    n = op.p
+    while n is not None and not n.is_type(SubQuerySource):
+      if n.is_type(Filter):
+        filters.append(n)
+      n = n.p
+    return filters
+
+  def physical_plan(self, join_tree, filters):
+    """
+    @join_tree  logical join tree over the FROM clause sources
+    @filters    Filter operators above the FROM clause
+
+    Choose a physical operator for every join in the tree.  The
+    conjuncts of the filters that only reference tables on both sides
+    of a join are moved into it (the logical joins' conds are ignored,
+    they only hold conjuncts of the filters):
+
+    * equality predicates between the two sides (A.x = B.y) become the
+      keys of a HashJoin or a SortMergeJoin (see equi_join()), and any
+      other predicates are kept as a residual Filter above the join
+    * joins without equality predicates remain ThetaJoins that
+      evaluate the remaining predicates (or True for cross products)
+
+    Consumed conjuncts are removed from the filters.  A filter whose
+    conjuncts were all consumed has its cond set to None.
+    """
+    pool = []
+    for f in filters:
+      for e in conjuncts(f.cond):
+        pool.append([f, e, False])
+    # cardinality estimates of the join inputs
+    self.estimator = SelingerOpt(self.db, self.bushy, self.max_dp_tables)
+
+    join_tree = self.plan_joins(join_tree, pool)
+
+    for f in filters:
+      remaining = [e for (g, e, used) in pool if g is f and not used]
+      f.cond = and_exprs(remaining) if remaining else None
+    return join_tree
+
+  def plan_joins(self, op, pool):
+    if not op.is_type(Join):
+      return op
+
+    l = self.plan_joins(op.l, pool)
+    r = self.plan_joins(op.r, pool)
+    laliases, raliases = source_aliases(l), source_aliases(r)
+
+    # predicates from the filters that span both sides.  The logical
+    # join's cond is ignored: its predicates are conjuncts in the pool
+    cands = []
+    for entry in pool:
+      f, e, used = entry
+      if used: continue
+      if self.join_expr_spans(e, laliases, raliases):
+        entry[2] = True
+        cands.append(e)
+
+    lattrs, rattrs, rest = [], [], []
+    for e in cands:
+      attrs = self.equi_join_attrs(e, laliases, raliases)
+      if attrs:
+        lattrs.append(attrs[0])
+        rattrs.append(attrs[1])
+      else:
+        rest.append(e)
+
+    if lattrs:
+      join = self.equi_join(l, r, lattrs, rattrs)
+      if rest:
+        join = Filter(join, and_exprs(rest))
+      return join
+    if rest:
+      return ThetaJoin(l, r, and_exprs(rest))
+    return ThetaJoin(l, r, Bool(True))
+
+  def equi_join(self, l, r, lattrs, rattrs):
+    """
+    Returns a HashJoin or a SortMergeJoin of @l and @r on the attributes
+    @lattrs = @rattrs, whichever is estimated to be cheaper, counting
+    the rows that each join reads, inserts or sorts:
+
+    * HashJoin reads both inputs and inserts the smaller one into a hash
+      table, which can't have more than hash_join_rows rows
+    * SortMergeJoin reads both inputs, and sorts the inputs that are not
+      already sorted on their join attributes, see sorted_on()
+    """
+    lcard, rcard = self.estimator.card(l), self.estimator.card(r)
+    hash_cost, merge_cost = self.equi_join_costs(l, r, lattrs, rattrs, lcard, rcard)
+    if merge_cost < hash_cost:
+      presorted = (self.sorted_on(l, lattrs), self.sorted_on(r, rattrs))
+      return SortMergeJoin(l, r, [lattrs, rattrs], presorted)
+    return HashJoin(l, r, [lattrs, rattrs])
+
+  def equi_join_costs(self, l, r, lattrs, rattrs, lcard, rcard):
+    """
+    @l, @r          the join inputs, or None if they are not known yet
+                    (e.g., subsets of the sources during join ordering)
+    @lcard, @rcard  their estimated cardinalities
+
+    Returns the estimated (HashJoin cost, SortMergeJoin cost) of the
+    join, see equi_join()
+    """
+    lsorted = l is not None and self.sorted_on(l, lattrs)
+    rsorted = r is not None and self.sorted_on(r, rattrs)
+
+    build = min(lcard, rcard)
+    hash_cost = lcard + rcard + build
+    if self.hash_join_rows is not None and build > self.hash_join_rows:
+      hash_cost = float("inf")
+    merge_cost = (lcard + rcard + 
+                  self.sort_cost(lcard, lsorted) + self.sort_cost(rcard, rsorted))
+    return hash_cost, merge_cost
+
+  def equi_join_cost(self, l, r, lattrs, rattrs, lcard, rcard):
+    """
+    Cost of the cheaper of the two equi-join operators.  The join
+    enumerator (SelingerOpt) costs its candidates with this function.
+    """
+    return min(self.equi_join_costs(l, r, lattrs, rattrs, lcard, rcard))
+
+  def sort_cost(self, card, presorted):
+    if presorted:
+      return 0
+    return card * math.log(max(card, 2), 2)
+
+  def sorted_on(self, op, attrs):
+    """
+    Checks that the rows of @op are in ascending order of @attrs: @op
+    is a table whose statistics say that the (single) attribute is
+    sorted, a Filter over such a table, or a SortMergeJoin on @attrs.
+    """
+    if op.is_type(Filter):
+      return self.sorted_on(op.c, attrs)
+    if op.is_type(SortMergeJoin):
+      keys = map(str, attrs)
+      return keys == map(str, op.lattrs) or keys == map(str, op.rattrs)
+    if op.is_type(Scan) and len(attrs) == 1:
+      attr = attrs[0]
+      table = self.db[op.tablename]
+      if table is None or attr.tablename not in (None, op.alias):
+        return False
+      if attr.attr not in table.fields:
+        return False
+      return table.stats[attr.attr].sorted
+    return False
+
+  def join_expr_spans(self, expr, laliases, raliases):
+    """
+    Checks that every attribute in @expr references a table in one of
+    the two sides of a join, and that both sides are referenced
+    """
+    refs = set()
+    for attr in expr.collect(Attr):
+      if not attr.tablename:
+        return False
+      refs.add(attr.tablename)
+    return (refs.issubset(laliases | raliases) and 
+            bool(refs & laliases) and bool(refs & raliases))
+
+  def equi_join_attrs(self, expr, laliases, raliases):
+    """
+    If @expr is an equality between an attribute on the left side and
+    an attribute on the right side of a join, returns the pair
+    (left attribute, right attribute).  Otherwise returns None
+    """
+    if not expr.is_type(Expr) or expr.op not in ("=", "=="):
+      return None
+    if not (isinstance(expr.l, Attr) and isinstance(expr.r, Attr)):
+      return None
+    if expr.l.tablename in laliases and expr.r.tablename in raliases:
+      return (expr.l, expr.r)
+    if expr.r.tablename in laliases and expr.l.tablename in raliases:
+      return (expr.r, expr.l)
+    return None
+
   def valid_join_expr(self, expr, sources):
     """
     @expr     candidate join expression
@@ -110,26 +348,40 @@ class Optimizer(object):
 
 
 class SelingerOpt(object):
-  def __init__(self, db):
+  def __init__(self, db, bushy=False, max_dp_tables=12, equi_join_cost=None):
+    """
+    @db             the Database
+    @bushy          consider bushy join plans instead of only left-deep plans
+    @max_dp_tables  above this many tables, fall back to the greedy best_plan()
+    @equi_join_cost function (l, r, lattrs, rattrs, lcard, rcard) that
+                    estimates the cost of joining two inputs on equality
+                    predicates, see Optimizer.equi_join_cost().  Joins
+                    are costed as nested loops if it is None.
+    """
     self.db = db
+    self.bushy = bushy
+    self.max_dp_tables = max_dp_tables
+    self.equi_join_cost = equi_join_cost
     self.costs = dict()
     self.cards = dict()
 
     self.DEFAULT_SELECTIVITY = 0.05
 
+    # cardinality used for sources without table statistics
+    self.DEFAULT_CARD = 1000.0
+
   def __call__(self, preds, sources):
     self.sources = sources
     self.preds = preds
     self.pred_index = self.build_predicate_index(preds)
     self.plans_tested = 0
 
-    # This is an exhaustive algorithm that uses recursion
-    # You will implement a faster bottom-up algorithm based on Selinger
-    plan = self.best_plan_exhaustive(sources)
-    
-    # XXX: Uncomment the following once you have implemented best_plan()
-    # plan = self.best_plan(sources)
-
+    start = timeit.default_timer()
+    if len(sources) > self.max_dp_tables:
+      plan = self.best_plan(sources)
+    else:
+      plan = self.best_plan_dp(sources)
+    self.opt_time = timeit.default_timer() - start
 
     # print "# plans tested: ", self.plans_tested
     return plan
@@ -175,6 +427,111 @@ class SelingerOpt(object):
         return self.pred_index[key]
     return Bool(True)
 
+  def best_plan_dp(self, sources):
+    """
+    @sources list of tables that we will build a join plan for
+    @return the cheapest left-deep (or bushy if self.bushy) ThetaJoin plan
+
+    Bottom-up Selinger optimization.  Each subset of the sources is a
+    bitset, where bit i is set if sources[i] is in the subset.  The
+    memo table maps each subset to the cost and cardinality of its
+    cheapest plan, and how that plan splits the subset into a left and
+    right input.  Subsets are planned in order of increasing size, so
+    the best plans of their inputs are already in the memo.
+    """
+    n = len(sources)
+    if n == 1:
+      return sources[0]
+
+    # the bits of the two tables referenced by each join predicate
+    bit = dict((s.alias, 1 << i) for i, s in enumerate(sources))
+    pred_bits = [(bit[p.l.tablename], bit[p.r.tablename], p) for p in self.preds]
+
+    # memo[bits] = (cost, card, left bits, right bits)
+    memo = {}
+    for i, source in enumerate(sources):
+      memo[1 << i] = (self.cost(source), self.card(source), None, None)
+
+    for size in range(2, n + 1):
+      for subset in combinations(range(n), size):
+        bits = sum(1 << i for i in subset)
+        best = None
+        for lbits, rbits in self.splits(bits, subset):
+          if lbits not in memo or rbits not in memo:
+            continue
+          self.plans_tested += 1
+          lcost, lcard, _, _ = memo[lbits]
+          rcost, rcard, _, _ = memo[rbits]
+          preds = [p for (b1, b2, p) in pred_bits
+                   if (b1 & lbits and b2 & rbits) or (b1 & rbits and b2 & lbits)]
+          l, r = self.dp_source(sources, lbits), self.dp_source(sources, rbits)
+          sel = self.pred_selectivity(l, r, preds)
+          card = lcard * rcard * sel
+          laliases = set(s.alias for i, s in enumerate(sources) if lbits & (1 << i))
+          cost = self.candidate_cost(l, r, self.equi_attrs(preds, laliases),
+                                     lcost, lcard, rcost, rcard, card)
+          if best is None or cost < best[0]:
+            best = (cost, card, lbits, rbits)
+        if best is not None:
+          memo[bits] = best
+
+    return self.build_dp_plan(sources, memo, pred_bits, (1 << n) - 1)
+
+  def splits(self, bits, subset):
+    """
+    @bits    bitset of a subset of the sources
+    @subset  the source indexes in the bitset
+
+    Yields each (left bits, right bits) partition of the subset to
+    consider.  Left-deep plans only allow a single table on the right.
+    Ties keep the FROM clause order, since later tables are tried as the
+    right input first.
+    """
+    if not self.bushy:
+      for i in reversed(subset):
+        yield (bits & ~(1 << i), 1 << i)
+      return
+
+    # enumerate every non-empty proper subset of bits as the left input
+    lbits = (bits - 1) & bits
+    while lbits:
+      yield (lbits, bits & ~lbits)
+      lbits = (lbits - 1) & bits
+
+  def dp_source(self, sources, bits):
+    """
+    Returns the source if @bits is a single table, otherwise None
+    """
+    if bits & (bits - 1):
+      return None
+    return sources[bits.bit_length() - 1]
+
+  def build_dp_plan(self, sources, memo, pred_bits, bits):
+    """
+    Construct the ThetaJoin plan for @bits from the memo table.  Each join
+    gets the AND of the predicates between its left and right inputs.
+    """
+    source = self.dp_source(sources, bits)
+    if source is not None:
+      return source
+    _, _, lbits, rbits = memo[bits]
+    l = self.build_dp_plan(sources, memo, pred_bits, lbits)
+    r = self.build_dp_plan(sources, memo, pred_bits, rbits)
+    preds = [p for (b1, b2, p) in pred_bits
+             if (b1 & lbits and b2 & rbits) or (b1 & rbits and b2 & lbits)]
+    cond = and_exprs(preds) if preds else Bool(True)
+    return ThetaJoin(l, r, cond)
+
+  def set_parents(self, plan):
+    """
+    Candidate plans share subplans, so constructing a candidate changes
+    the parent pointers of its inputs.  Point them back at the final plan.
+    """
+    for child in plan.children():
+      child.p = plan
+      self.set_parents(child)
+    return plan
+
 
   def best_plan(self, sources):
     """
@@ -196,8 +553,8 @@ class SelingerOpt(object):
       return sources[0]
 
     best_plan = self.best_initial_join(sources)
-    sources.remove(best_plan.l)
-    sources.remove(best_plan.r)
+    self.remove_source(sources, best_plan.l)
+    self.remove_source(sources, best_plan.r)
 
     # each iteration of this while loop adds the best table to join
     # with current best plan
@@ -207,18 +564,23 @@ class SelingerOpt(object):
       for r in sources:
         self.plans_tested += 1
         pred = self.get_join_pred(best_plan, r)
-
-        
-        # XXX: Write code to construct a candidate plan with r as the
-        # inner table, and compute its cost using self.cost()
-        #
-        # Keep the lowest cost candidate plan in best_cand
-        pass
+        cand = ThetaJoin(best_plan, r, pred)
+        cost = self.cost(cand)
+        if cost < best_cost:
+          best_cand = cand
+          best_cost = cost
 
       best_plan = best_cand
-      sources.remove(best_plan.r)
+      self.remove_source(sources, best_plan.r)
 
-    return best_plan
+    return self.set_parents(best_plan)
+
+  def remove_source(self, sources, source):
+    # Op.__eq__ compares operators by their string, so remove by identity
+    for i, s in enumerate(sources):
+      if s is source:
+        del sources[i]
+        return
 
 
   def best_initial_join(self, sources):
@@ -232,11 +594,14 @@ class SelingerOpt(object):
     best_cost = float("inf")
 
     for (l, r) in product(sources, sources):
-      if l == r: continue
+      if l is r: continue
       self.plans_tested += 1
       pred = self.get_join_pred(l, r)
-
-      # XXX: Write your code here
+      plan = ThetaJoin(l, r, pred)
+      cost = self.cost(plan)
+      if cost < best_cost:
+        best_plan = plan
+        best_cost = cost
 
     return best_plan
 
@@ -288,27 +653,73 @@ class SelingerOpt(object):
     if join in self.costs:
       return self.costs[join]
 
-    # the input is actually a Scan operator
-    if join.is_type(Scan):
-      # XXX: Implement the cost to scan this Scan operator
-      # Take a look at db.py:Stats, which provides some database statistics.
-      # To use its functionality, you may need to implement parts of db.py
-      cost = 0
+    # the input is actually a Scan operator (or another FROM clause source)
+    if not join.is_type(Join):
+      # scanning the table reads each of its rows once
+      cost = self.card(join)
     else:
-      # XXX: Compute the cost of the tuple-based nested loops join operation
-      # in terms of the cost to compute the outer (left) subplan and the number
-      # of tuples we need to examine from the inner (right) table.
-      #
-      # Hint: You may want to compute the cost recursively.
-      cost = 0
-
-      # We penalize high cardinality joins a little bit
-      cost += 0.1 * self.card(join)
+      preds = [] if join.cond.is_type(Bool) else conjuncts(join.cond)
+      attrs = self.equi_attrs(preds, source_aliases(join.l))
+      cost = self.candidate_cost(join.l, join.r, attrs,
+                                 self.cost(join.l), self.card(join.l),
+                                 self.cost(join.r), self.card(join.r),
+                                 self.card(join))
 
     # save estimate in the cache
     self.costs[join] = cost
     return cost
 
+  def candidate_cost(self, l, r, attrs, lcost, lcard, rcost, rcard, card):
+    """
+    @l, @r   the left and right inputs, or None for subsets of the
+             sources that don't have a plan yet
+    @attrs   (left attributes, right attributes) of the equality
+             predicates between the inputs, see equi_attrs()
+
+    The cost of a join candidate: an equi-join if there are equality
+    predicates and an equi_join_cost function, otherwise nested loops
+    """
+    lattrs, rattrs = attrs
+    if not lattrs or self.equi_join_cost is None:
+      return self.join_cost(lcost, lcard, rcost, card)
+    cost = lcost + rcost + self.equi_join_cost(l, r, lattrs, rattrs, lcard, rcard)
+    return cost + 0.1 * card
+
+  def equi_attrs(self, preds, laliases):
+    """
+    Splits the attributes of the equality predicates in @preds into
+    the attributes of the left input, whose aliases are @laliases, and
+    those of the right input
+    """
+    lattrs, rattrs = [], []
+    for pred in preds:
+      if not (pred.is_type(Expr) and pred.op in ("=", "==") and
+              isinstance(pred.l, Attr) and isinstance(pred.r, Attr)):
+        continue
+      if pred.l.tablename in laliases:
+        lattrs.append(pred.l)
+        rattrs.append(pred.r)
+      else:
+        lattrs.append(pred.r)
+        rattrs.append(pred.l)
+    return lattrs, rattrs
+
+  def join_cost(self, lcost, lcard, rcost, card):
+    """
+    @lcost  cost of the outer (left) subplan
+    @lcard  cardinality of the outer subplan
+    @rcost  cost of the inner (right) subplan
+    @card   cardinality of the join
+
+    The cost of a tuple-based nested loops join: compute the outer
+    subplan once, and the inner subplan once per outer tuple
+    """
+    cost = lcost + lcard * rcost
+
+    # We penalize high cardinality joins a little bit
+    cost += 0.1 * card
+    return cost
+
   def card(self, join):
     """
     @join join subplan 
@@ -321,13 +732,15 @@ class SelingerOpt(object):
       return self.cards[join]
 
     if join.is_type(Scan):
-      # XXX: Compute the cardinality of the join if it is a Scan operator
-      # Similar to self.cost() above, take a look at db.py:Stats.
-      card = 1
+      card = float(self.db[join.tablename].stats.card)
+    elif not join.is_type(Join):
+      # e.g., a subquery in the FROM clause
+      card = estimate_card(join, self.db)
+      if card == float("inf"):
+        card = self.DEFAULT_CARD
+      card = float(card)
     else:
-      # XXX: Compute the cardinality of the join subplan as described in lecture.
-      # Hint: You may want to compute the cardinality recursively
-      card = 1
+      card = self.card(join.l) * self.card(join.r) * self.selectivity(join)
 
     # Save estimate in the cache
     self.cards[join] = card
@@ -348,19 +761,38 @@ class SelingerOpt(object):
     # is 1 if True (cross-product), or 0 if False
     if join.cond.is_type(Bool):
       return join.cond() * 1.0
-    
-    
-    if join.l.is_type(Scan):
-      lsel = self.selectivity_attr(join.l, join.cond.l.attr if join.cond.l.tablename == join.l.alias else join.cond.r.attr)
-    else:
-      lsel = 1.0
 
-    if join.r.is_type(Scan):
-      rsel = self.selectivity_attr(join.r,join.cond.l.attr if join.cond.l.tablename == join.r.alias else join.cond.r.attr)
-    else:
-      rsel = 1.0
- 
-    return min(lsel, rsel)
+    l = join.l if join.l.is_type(Scan) else None
+    r = join.r if join.r.is_type(Scan) else None
+    return self.pred_selectivity(l, r, conjuncts(join.cond))
+
+  def pred_selectivity(self, l, r, preds):
+    """
+    @l      left Scan operator of the join, or None if it is a subplan
+    @r      right Scan operator of the join, or None if it is a subplan
+    @preds  list of join predicates between the left and right inputs
+
+    Selectivity of the AND of the predicates, assuming they are independent
+    """
+    sel = 1.0
+    for pred in preds:
+      if not (pred.is_type(Expr) and pred.op in ("=", "==") and
+              isinstance(pred.l, Attr) and isinstance(pred.r, Attr)):
+        sel *= self.DEFAULT_SELECTIVITY
+        continue
+
+      if l is not None:
+        lsel = self.selectivity_attr(l, pred.l.attr if pred.l.tablename == l.alias else pred.r.attr)
+      else:
+        lsel = 1.0
+
+      if r is not None:
+        rsel = self.selectivity_attr(r, pred.l.attr if pred.l.tablename == r.alias else pred.r.attr)
+      else:
+        rsel = 1.0
+
+      sel *= min(lsel, rsel)
+    return sel
 
   def selectivity_attr(self, source, attr):
     """
@@ -381,13 +813,12 @@ class SelingerOpt(object):
 
     table = self.db[source.tablename]
     stat = table.stats[attr]
+    if stat.ndistinct == 0:
+      return 0.0
     if table.type(attr) == "num":
-      # XXX: Write code to estimate the selectivity of the numeric attribute.
-      # You can add 1 to the denominator to avoid divide by 0 errors
-      sel = 1.0
+      sel = 1.0 / (stat.max - stat.min + 1)
     else:
-      # XXX: Write code to estimaote the selectivity of the non-numeric attribute
-      sel = 1.0
+      sel = 1.0 / stat.ndistinct
     return sel
 
 
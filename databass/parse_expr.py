@@ -2,6 +2,7 @@ import re
 import math
 import numpy as np
 from ops import *
+from astcache import ASTCache
 
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
@@ -126,5 +127,14 @@ class Visitor(NodeVisitor):
     return children
 
 def parse(s):
+  """
+  Returns a copy of the tree if @s was parsed recently, see astcache.py
+  """
+  return cache(s)
+
+def parse_uncached(s):
   return Visitor().parse(s)
 
+# recently parsed expressions
+cache = ASTCache(parse_uncached)
+
@@ -11,6 +11,8 @@ import re
 import math
 import numpy as np
 from ops import *
+import sqlparser
+from astcache import ASTCache
 
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
@@ -63,12 +65,14 @@ grammar = Grammar(
                function /
                col_ref /
                string /
+               param /
                attr
     parenval = "(" ws expr ws ")"
     function = fname "(" ws arg_list? ws ")"
     arg_list = expr (ws "," ws expr)*
     number   = ~"\d*\.?\d+"i
     string   = ~"([\"\'])(\\\\?.)*?\\1"i
+    param    = ~"\?|:[a-zA-Z_]\w*"i
     attr     = ~"\w[\w\d]*"i
     fname    = ~"\w[\w\d]*"i
     boolean  = "true" / "false"
@@ -95,7 +99,7 @@ grammar = Grammar(
     BY = wsp ("BY" / "by")
     CAST = wsp ("CAST" / "cast")
     COLUMN = wsp ("COLUMN" / "column")
-    DESC = wsp ("DESC" / "distinct")
+    DESC = wsp ("DESC" / "desc")
     DISTINCT = wsp ("DISTINCT" / "distinct")
     E = "E"
 	ESCAPE  = wsp ("ESCAPE" / "escape")
@@ -184,6 +188,13 @@ class Visitor(NodeVisitor):
   """
   grammar = grammar
 
+  def __init__(self):
+    super(Visitor, self).__init__()
+    # the values of the query's placeholders.  The Params of the parsed
+    # query share this list, and its values are bound before running it
+    self.params = []
+    self.param_names = {}   # name -> slot
+
   def visit_query(self, node, children):
     ret = None
     for node in (filter(bool, children)):
@@ -360,6 +371,22 @@ class Visitor(NodeVisitor):
   def visit_string(self, node, children):
     return Literal(node.text)
 
+  def visit_param(self, node, children):
+    """
+    ? placeholders get the next slot, and :name placeholders with the
+    same name share a slot
+    """
+    name = node.text[1:] or None
+    if self.params and (name is None) != (not self.param_names):
+      raise Exception("Can't mix ? and :name placeholders in a query")
+    if name is not None and name in self.param_names:
+      return Param(self.param_names[name], self.params, name)
+    slot = len(self.params)
+    self.params.append(None)
+    if name is not None:
+      self.param_names[name] = slot
+    return Param(slot, self.params, name)
+
   def visit_parenval(self, node, children):
     return Paren(children[2])
 
@@ -380,7 +407,28 @@ class Visitor(NodeVisitor):
       return children[0]
     return children
 
-def parse(s):
-  return Visitor().parse(s)
+# parser that parse() uses: "fast" (see sqlparser.py) or "parsimonious"
+PARSER = "fast"
 
+def parse(s, parser=None):
+  """
+  Parse query @s into a tree of operators.  Returns a copy of the tree
+  if @s was parsed recently, see astcache.py.
+  """
+  return cache(s, parser or PARSER)
+
+def parse_uncached(s, parser="fast"):
+  """
+  The fast parser falls back to parsimonious for queries that it
+  doesn't accept, so that the grammar decides which queries are valid
+  and reports the errors.
+  """
+  if parser == "fast":
+    try:
+      return sqlparser.parse(s)
+    except Exception:
+      pass
+  return Visitor().parse(s)
 
+# recently parsed queries
+cache = ASTCache(parse_uncached)
@@ -3,6 +3,7 @@ from ops import *
 from db import *
 from interpretor import *
 from optimizer import Optimizer
+from query_compiler import QueryCompiler
     
 # Check that the join actually is faster by running on a larger dataset
 
@@ -97,13 +98,27 @@ qs = [q1, q2, q3]
 db = Database()
 db.register_table("data", Table.from_rows(db["data"].rows * 5))
 optimizer = Optimizer(db)
-interpretor = PushBasedInterpretor(db)
+interpretors = [
+  ("pull", PullBasedInterpretor(db)),
+  ("push", PushBasedInterpretor(db)),
+  ("batch", BatchInterpretor(db)),
+  ("compiled", QueryCompiler(db))
+]
 
-def return_time(o):
+def return_time(interpretor, o):
   start_time = timeit.default_timer()
-  interpretor(Print(o))
+  # the push-based interpretor runs the query when it is called,
+  # the others return an iterator over the results
+  rows = interpretor(o)
+  if rows is not None:
+    for row in rows:
+      pass
   elapsed = timeit.default_timer() - start_time
   return elapsed
+
+def print_times(ast):
+  for name, interpretor in interpretors:
+    print("%s\t%s" % (name, return_time(interpretor, ast)))
  
 
 
@@ -111,7 +126,7 @@ def return_time(o):
 for ast in asts:
   print()
   print(ast)
-  print(return_time(ast))
+  print_times(ast)
 
 for q in qs:
   print()
@@ -119,4 +134,4 @@ for q in qs:
   ast = parse(q)
   ast = optimizer(ast)
   print(ast)
-  print(return_time(ast))
\ No newline at end of file
+  print_times(ast)
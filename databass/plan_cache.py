@@ -0,0 +1,174 @@
+"""
+Cache of optimized and compiled query plans, keyed by normalized SQL.
+
+Queries that only differ in their literal values, e.g.,
+
+        SELECT a FROM data WHERE b < 10
+        SELECT a FROM data   WHERE b < 20
+
+normalize to the same key
+
+        SELECT a FROM data WHERE b < ?
+
+The first query's key is parsed, optimized and compiled (see
+query_compiler.py) as usual, and each ? becomes an ops.Param.  Later
+queries with the same key reuse the compiled plan, and only bind their
+own literal values to the Params.  The optimizer picks the cached plan
+using the first query's literals.
+
+The cache keeps the most recently used plans, and a plan is dropped when
+the statistics of a table that it reads change (see
+Table.clear_stats()), or the table is replaced.
+"""
+import re
+from collections import OrderedDict
+from ops import *
+from optimizer import Optimizer
+from parse_sql import parse
+from query_compiler import QueryCompiler
+
+
+TOKEN = re.compile(r"""
+    (?P<name>`[^`]*`|\[[^\]]*\])                      |
+    (?P<string>(?P<quote>["'])(?:\\?.)*?(?P=quote))  |
+    (?P<word>[A-Za-z_]\w*)                            |
+    (?P<number>\d*\.?\d+)                             |
+    (?P<space>\s+)                                    |
+    (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+# placeholders of a normalized query, which only contains ` and [] quotes
+PLACEHOLDER = re.compile(r"`[^`]*`|\[[^\]]*\]|(\?|:[A-Za-z_])")
+
+
+def normalize(sql):
+  """
+  Returns (key, values), where key is @sql with its whitespace collapsed
+  and every number and string literal replaced with ?, and values is
+  the list of the literals' values, as the SQL parser would read them
+  """
+  parts, values = [], []
+  for m in TOKEN.finditer(sql):
+    kind, text = m.lastgroup, m.group(0)
+    if kind == "space":
+      if parts and parts[-1] != " ":
+        parts.append(" ")
+    elif kind == "number":
+      parts.append("?")
+      values.append(float(text))
+    elif kind == "string":
+      parts.append("?")
+      values.append(text)
+    else:
+      parts.append(text)
+  return "".join(parts).strip(), values
+
+
+class CachedPlan(object):
+  """
+  An optimized plan, its compiled query function, and the Params that
+  the function reads.  Also remembers the statistics versions of the
+  tables that the plan reads.
+  """
+  def __init__(self, key, plan, query, params, tables):
+    self.key = key
+    self.plan = plan
+    self.query = query
+    self.params = params
+    self.tables = tables   # tablename -> (table, stats_version)
+
+  def bind(self, values):
+    self.params[:] = values
+
+  def is_valid(self, db):
+    for tablename, (table, version) in self.tables.items():
+      if db[tablename] is not table or table.stats_version != version:
+        return False
+    return True
+
+  def __call__(self, db):
+    """
+    Run the plan with the values that are currently bound.  Binding
+    other values while the rows are read changes the rest of the rows.
+    """
+    return self.query(db)
+
+
+class PlanCache(object):
+  """
+  LRU cache of the compiled plans of a Database's queries
+  """
+  def __init__(self, db, capacity=128, optimizer=None):
+    """
+    @db         the Database
+    @capacity   maximum number of cached plans
+    @optimizer  Optimizer used to plan queries on a miss
+    """
+    self.db = db
+    self.capacity = capacity
+    self.optimizer = optimizer or Optimizer(db)
+    self.compiler = QueryCompiler(db)
+    self.plans = OrderedDict()   # key -> CachedPlan, least recent first
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  def __call__(self, sql):
+    """
+    Run query @sql and return an iterator over its rows
+    """
+    return self.lookup(sql)(self.db)
+
+  def lookup(self, sql):
+    """
+    Returns the CachedPlan of @sql, with @sql's literals bound
+    """
+    key, values = normalize(sql)
+    if len(values) != len(filter(None, PLACEHOLDER.findall(key))):
+      raise Exception("Use prepare() to run queries with placeholders: %s" % sql)
+    entry = self.plans.pop(key, None)
+    if entry is not None and not entry.is_valid(self.db):
+      self.invalidations += 1
+      entry = None
+    if entry is not None:
+      self.hits += 1
+    else:
+      self.misses += 1
+      entry = self.build(key, values)
+
+    self.plans[key] = entry
+    while len(self.plans) > self.capacity:
+      self.plans.popitem(last=False)
+      self.evictions += 1
+    entry.bind(values)
+    return entry
+
+  def build(self, key, values):
+    """
+    Parse, optimize and compile the normalized query @key, whose ?
+    placeholders are bound to @values
+    """
+    plan = parse(key)
+    params = plan.collect(Param)
+    params = params[0].params if params else []
+    params[:] = values
+    plan = self.optimizer(plan)
+    tables = {}
+    for scan in plan.collect(Scan):
+      table = self.db[scan.tablename]
+      if table is not None:
+        tables[scan.tablename] = (table, table.stats_version)
+    return CachedPlan(key, plan, self.compiler.compile(plan), params, tables)
+
+  def invalidate(self, tablename=None):
+    """
+    Drop the cached plans that read @tablename, or all plans
+    """
+    for key, entry in self.plans.items():
+      if tablename is None or tablename in entry.tables:
+        del self.plans[key]
+        self.invalidations += 1
+
+  def __len__(self):
+    return len(self.plans)
@@ -0,0 +1,126 @@
+"""
+Prepared statements.
+
+A query with ? or :name placeholders in place of values, e.g.,
+
+        SELECT a, b FROM data WHERE a < ? AND e = ?
+        SELECT a, b FROM data WHERE a BETWEEN :lo AND :hi LIMIT :n
+
+is parsed and optimized once by prepare(), and the statement is then run
+many times with different values bound to its placeholders:
+
+        stmt = prepare(db, "SELECT a FROM data WHERE a < ?")
+        stmt(5)
+        stmt.bind(10).run(PushBasedInterpretor(db))
+
+Each placeholder is an ops.Param in the plan, and the plan's Params read
+the statement's list of bound values when they are evaluated, so binding
+new values does not change the plan.  The optimizer plans the query
+without knowing the values.
+"""
+from ops import *
+from optimizer import Optimizer
+from parse_sql import parse
+from interpretor import PullBasedInterpretor, PushBasedInterpretor
+
+
+class PreparedStatement(object):
+  """
+  An optimized plan and the values bound to its placeholders.  Strings
+  are bound with their quotes, like the string literals of a query.
+  """
+  def __init__(self, db, sql, plan, interpretor=None):
+    """
+    @db           the Database
+    @sql          the query
+    @plan         the optimized plan of @sql
+    @interpretor  interpretor that run() uses by default
+    """
+    self.db = db
+    self.sql = sql
+    self.plan = plan
+    self.interpretor = interpretor or PullBasedInterpretor(db)
+
+    params = plan.collect(Param)
+    self.params = params[0].params if params else []
+    self.names = {}   # name -> slot
+    for p in params:
+      if p.name:
+        self.names[p.name] = p.slot
+    self.nparams = len(self.params)
+    self.bound = False
+
+    # the compiled query functions of the QueryCompilers that ran the
+    # statement
+    self.compiled = {}
+
+  def bind(self, *args, **kwargs):
+    """
+    Bind the values of ? placeholders in order, or of :name placeholders
+    by name.  Returns the statement.
+    """
+    if args and kwargs:
+      raise Exception("Bind placeholder values by position or by name, not both")
+    if self.names:
+      if args:
+        raise Exception("Statement has named placeholders: %s" % ", ".join(sorted(self.names)))
+      if set(kwargs) != set(self.names):
+        raise Exception("Expected values for %s, got %s" % (
+          ", ".join(sorted(self.names)), ", ".join(sorted(kwargs))))
+      values = [None] * self.nparams
+      for name, v in kwargs.items():
+        values[self.names[name]] = v
+    else:
+      if kwargs:
+        raise Exception("Statement has no named placeholders")
+      if len(args) != self.nparams:
+        raise Exception("Expected %d values, got %d" % (self.nparams, len(args)))
+      values = list(args)
+
+    self.params[:] = values
+    self.bound = True
+    return self
+
+  def run(self, interpretor=None):
+    """
+    Run the statement with the values that are bound, and return the
+    list of result rows.
+
+    @interpretor  a Pull, Push or Batch interpretor, or a QueryCompiler.
+                  Defaults to the statement's interpretor.
+    """
+    if self.nparams and not self.bound:
+      raise Exception("Bind the placeholder values before running the statement")
+    interpretor = interpretor or self.interpretor
+    if isinstance(interpretor, PushBasedInterpretor):
+      rows = []
+      interpretor(self.plan, rows.append)
+      return rows
+
+    if interpretor.__class__.__name__ == "QueryCompiler":
+      # the compiled code reads the bound values when it runs
+      if interpretor not in self.compiled:
+        self.compiled[interpretor] = interpretor.compile(self.plan)
+      return list(self.compiled[interpretor](self.db))
+    return list(interpretor(self.plan))
+
+  def __call__(self, *args, **kwargs):
+    """
+    Bind the arguments and run the statement with its interpretor
+    """
+    return self.bind(*args, **kwargs).run()
+
+  def __str__(self):
+    return str(self.plan)
+
+
+def prepare(db, sql, interpretor=None, optimizer=None):
+  """
+  Parse and optimize @sql, which may contain ? or :name placeholders.
+  Returns a PreparedStatement.
+
+  @interpretor  default interpretor of the statement
+  @optimizer    defaults to Optimizer(db)
+  """
+  plan = (optimizer or Optimizer(db))(parse(sql))
+  return PreparedStatement(db, sql, plan, interpretor)
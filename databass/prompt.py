@@ -1,3 +1,4 @@
+import sys
 import traceback
 import readline
 import click
@@ -13,15 +14,27 @@ List of commands
 PARSE [query or expression str]   parse and print AST for expression or query
 TRACE                             print stack trace of last error
 SHOW TABLES                       print list of database tables
+SHOW MEMORY                       print estimated memory used by each table
 SHOW <tablename>                  print schema for <tablename>
+MODE [pull|push|batch|compiled]   print or set how queries are executed
+COMPILE [query]                   print the python code the query compiles to
+SHOW CACHE                        print the compiled mode's plan cache counters
 """
 
+MODES = ["pull", "push", "batch", "compiled"]
+
+# settings that last across commands
+settings = dict(mode="pull")
+
 
 
 if __name__ == "__main__":
 
   @click.command()
-  def main():
+  @click.option("--mode", type=click.Choice(MODES), default="pull",
+                help="how queries are executed")
+  def main(mode):
+    settings["mode"] = mode
     print(WELCOMETEXT)
     service_inputs()
 
@@ -34,15 +47,23 @@ if __name__ == "__main__":
     import db
     import parse_expr
     import parse_sql
-    from interpretor import PullBasedInterpretor, PushBasedInterpretor
+    import query_compiler
+    import plan_cache
+    from interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+    from query_compiler import QueryCompiler
     from optimizer import Optimizer
     from ops import Print
     from db import Database
     from parse_expr import parse as _parse_expr
     from parse_sql import parse as _parse_sql
+    from plan_cache import PlanCache
 
 
-    _db = Database()
+    # the database and the compiled plans are kept until the next reload
+    if "db" not in settings:
+      settings["db"] = Database()
+      settings["plans"] = PlanCache(settings["db"])
+    _db = settings["db"]
 
     if cmd == "q":
       return
@@ -60,13 +81,33 @@ if __name__ == "__main__":
       reload(parse_sql)
       reload(optimizer)
       reload(interpretor)
+      reload(query_compiler)
+      reload(plan_cache)
+      settings.pop("db", None)
+      settings.pop("plans", None)
       from parse_expr import parse as _parse_expr
       from db import Database
       from ops import Print
       from parse_sql import parse as _parse_sql
       from optimizer import Optimizer
-      from interpretor import PullBasedInterpretor, PushBasedInterpretor
+      from interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+      from query_compiler import QueryCompiler
+
 
+    elif cmd.upper().startswith("MODE"):
+      mode = cmd[len("MODE"):].strip().lower()
+      if mode in MODES:
+        settings["mode"] = mode
+      elif mode:
+        print("ERROR: mode must be one of %s" % ", ".join(MODES))
+      print("mode: %s" % settings["mode"])
+
+    elif cmd.upper().startswith("COMPILE"):
+      try:
+        plan = Optimizer(_db)(_parse_sql(cmd[len("COMPILE"):]))
+        print(QueryCompiler(_db).compile_to_code(plan))
+      except Exception as err:
+        print("ERROR:", err)
 
     elif cmd.upper().startswith("TRACE"):
       traceback.print_exc()
@@ -90,14 +131,25 @@ if __name__ == "__main__":
       for tablename in _db.tablenames:
         print tablename
       
+    elif cmd.upper().startswith("SHOW CACHE"):
+      plans = settings["plans"]
+      print "%d plans, %d hits, %d misses, %d evictions, %d invalidations" % (
+          len(plans), plans.hits, plans.misses, plans.evictions, plans.invalidations)
+
+    elif cmd.upper().startswith("SHOW MEMORY"):
+      for tablename, nbytes in sorted(_db.memory_usage().items()):
+        print "%s\t%d bytes" % (tablename, nbytes)
+
     elif cmd.upper().startswith("SHOW "):
       tname = cmd[len("SHOW "):].strip()
       if tname in _db:
         print "Schema for %s" % tname
         t = _db[tname]
+        # only read the first row, the table may not fit in memory
+        first = next(iter(t), None)
         for field in t.fields:
-          if t.rows:
-            typ = type(t.rows[0][field])
+          if first:
+            typ = type(first[field])
           else:
             typ = "?"
           print field, "\t", typ
@@ -106,15 +158,28 @@ if __name__ == "__main__":
 
     else:
       try:
-        plan = _parse_sql(cmd)
-        opt = Optimizer(_db)
-        interp = PullBasedInterpretor(_db)
-        #interp = PushBasedInterpretor(_db)
-
-        plan = opt(plan)
-        print(plan)
-        for row in interp(plan):
-          print row
+        mode = settings["mode"]
+        if mode == "compiled":
+          # queries that only differ in their literals share a compiled plan
+          entry = settings["plans"].lookup(cmd)
+          print(entry.plan)
+          for row in entry(_db):
+            print row
+        else:
+          plan = _parse_sql(cmd)
+          opt = Optimizer(_db)
+          plan = opt(plan)
+          print(plan)
+
+          if mode == "push":
+            PushBasedInterpretor(_db)(plan, lambda row: sys.stdout.write("%s\n" % (row,)))
+          else:
+            if mode == "batch":
+              interp = BatchInterpretor(_db)
+            else:
+              interp = PullBasedInterpretor(_db)
+            for row in interp(plan):
+              print row
       except Exception as err:
         print("ERROR:", err)
 
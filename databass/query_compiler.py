@@ -0,0 +1,545 @@
+"""
+Compiles an optimized query plan into a single python generator function,
+using the produce/consume model (Neumann, "Efficiently Compiling
+Efficient Query Plans for Modern Hardware").
+
+Instead of passing rows from operator to operator, the operators of a
+pipeline are fused into one loop nest.  Each operator's produce method
+generates the code that produces its rows (e.g., Scan's for loop over the
+table), and calls a consume callback with the variables that hold the
+current row's values.  The callback generates the code of the parent
+operators for that row, e.g., Filter adds an if statement.  This is the
+push-based interpretor's structure, but run once at compile time.
+
+Pipeline breakers (GroupBy, OrderBy, the build side of HashJoin and the
+inner side of ThetaJoin) generate a loop that materializes their input
+first (GroupBy only keeps running aggregate states when it can), and
+then a loop over the materialized rows that feeds their parent.
+
+Python limits the number of nested loops in a function (20), and long
+pipelines, such as a chain of many joins, nest deeper than that.  When
+an operator's rows are consumed too deeply, the operator's code is moved
+into a nested generator function that yields its rows, and the parent
+loops over the generator instead (see QueryCompiler.produce).
+
+        SELECT a, b + 1 AS x FROM data WHERE a < 10
+
+compiles to
+
+        def query(db):
+          for (a_1, b_2, ...) in db['data'].tuples():
+            if (a_1 < _c3):
+              x_8 = (b_2 + _c4)
+              yield _c5((a_1, x_8, ))
+
+where the _c variables are constants, such as the Row class of the
+output rows.  Only the final output rows are built as Row objects.
+"""
+import re
+from ops import *
+from db import Schema, EMPTY_ROW
+from compile_expr import CodeGen
+
+
+class Output(object):
+  """
+  The rows that an operator passes to its parent's consume callback:
+  their Schema and the names of the variables that hold the values
+  """
+  def __init__(self, schema, variables):
+    self.schema = schema
+    self.vars = list(variables)
+
+  def concat(self, other):
+    return Output(self.schema.concat(other.schema), self.vars + other.vars)
+
+  def alias(self, tablename):
+    return Output(self.schema.alias(tablename), self.vars)
+
+
+class Context(object):
+  """
+  The generated code, and the constants that it references
+  """
+  def __init__(self):
+    self.lines = []
+    self.env = {}
+    self.nvars = 0
+
+    # variable holding a group's list of rows -> Schema of the rows, or
+    # None if the variable holds the group's AggStates
+    self.groups = {}
+
+  def var(self, name="v"):
+    """
+    A new variable name.  @name (e.g., a field name) makes the code
+    easier to read.
+    """
+    self.nvars += 1
+    return "%s_%d" % (re.sub(r"\W", "_", str(name)), self.nvars)
+
+  def const(self, v):
+    name = "_c%d" % len(self.env)
+    self.env[name] = v
+    return name
+
+  def emit(self, level, line):
+    self.lines.append("  " * level + line)
+
+  def tuple(self, variables):
+    return "(%s)" % "".join(v + ", " for v in variables)
+
+  def unpack(self, out):
+    """
+    Assignment target that unpacks a tuple of @out's values into its
+    variables
+    """
+    if not out.vars:
+      return self.var("_")
+    return self.tuple(out.vars)
+
+  def row(self, out):
+    """
+    Code that builds a Row of @out's values
+    """
+    return "%s(%s)" % (self.const(out.schema.row_class), self.tuple(out.vars))
+
+  def code(self):
+    return "\n".join(self.lines) + "\n"
+
+
+class ExprGen(CodeGen):
+  """
+  Generates expressions whose attributes are read from the variables of
+  one (or, for join conditions, two) Outputs
+  """
+  def __init__(self, ctx, out, out2=None):
+    super(ExprGen, self).__init__(None, None, ctx.env)
+    self.ctx = ctx
+    self.out = out
+    self.out2 = out2
+
+  def const(self, v):
+    return self.ctx.const(v)
+
+  def call(self, e):
+    rows = [self.ctx.row(self.out)]
+    if self.out2 is not None:
+      rows.append(self.ctx.row(self.out2))
+    return "%s(%s)" % (self.const(e), ", ".join(rows))
+
+  def row(self):
+    return self.ctx.row(self.out)
+
+  def star(self):
+    return self.ctx.tuple(self.out.vars)
+
+  def attr(self, e):
+    pos = e.locate(self.out.schema, self.out2 and self.out2.schema)
+    if pos is None:
+      return self.call(e)
+    return (self.out2 if pos[0] else self.out).vars[pos[1]]
+
+  def func(self, e):
+    f = Func.agg_func_lookup.get(e.name)
+    if not f:
+      return super(ExprGen, self).func(e)
+
+    pos = Attr("__group__").locate(self.out.schema)
+    group = pos and self.out.vars[pos[1]]
+    if group not in self.ctx.groups:
+      # raises the missing group error
+      return self.call(e)
+    if self.ctx.groups[group] is None:
+      # the group's AggStates
+      return "%s(%s)" % (self.const(e.aggregate), group)
+    # list comprehension variables leak in python 2, so the group's rows
+    # are unpacked into new variables
+    schema = self.ctx.groups[group]
+    gout = Output(schema, [self.ctx.var(field) for field in schema.fields])
+    args = ExprGen(self.ctx, gout).tuple_of(e.args)
+    return "%s(*_zip(*[%s for %s in %s]))" % (
+        self.const(f), args, self.ctx.unpack(gout), group)
+
+
+class QueryCompiler(object):
+  """
+  Compiles query plans into python generator functions that take the
+  Database as input and yield the same rows as the PullBasedInterpretor.
+  The plan should be optimized first (see optimizer.py).
+  """
+
+  # indentation level from which an operator's rows are yielded by a
+  # nested generator function.  Each level holds at most one loop or try
+  # block, so this stays below python's limit of 20 nested blocks, and
+  # leaves room for the levels that the parent operators add.
+  MAX_LEVEL = 12
+
+  def __init__(self, db):
+    self.db = db
+
+  def __call__(self, op, **kwargs):
+    return self.compile(op)(self.db)
+
+  def compile(self, op):
+    """
+    Returns the generator function of the plan rooted at @op
+    """
+    ctx = self.generate(op)
+    code = compile(ctx.code(), "<query>", "exec", 0, True)
+    exec code in ctx.env
+    return ctx.env["query"]
+
+  def compile_to_code(self, op):
+    """
+    Returns the source code of the generator function
+    """
+    return self.generate(op).code()
+
+  def generate(self, op):
+    ctx = Context()
+    ctx.emit(0, "def query(db):")
+    def yield_row(out, level):
+      ctx.emit(level, "yield %s" % ctx.row(out))
+    self.produce(ctx, op, 1, yield_row)
+    return ctx
+
+  def expr(self, ctx, e, out, out2=None):
+    return ExprGen(ctx, out, out2)(e)
+
+  def exprs(self, ctx, exprs, out):
+    """
+    Code for the tuple of the values of @exprs
+    """
+    return ExprGen(ctx, out).tuple_of(exprs)
+
+  def produce(self, ctx, op, level, consume):
+    """
+    @ctx      Context
+    @op       operator to generate code for
+    @level    indentation level of the generated code
+    @consume  callback that takes an Output and an indentation level,
+              and generates the code that consumes each of @op's rows
+
+    This function dispatches the current operator to the appropriate
+    produce_* handler.
+    """
+    klass = op.__class__.__name__.lower()
+    handler = getattr(self, "produce_%s" % klass, None)
+    if handler is None:
+      if klass == "from":
+        raise Exception("QueryCompiler: optimize the plan before compiling it")
+      raise Exception("QueryCompiler: %s is not supported" % op.__class__.__name__)
+
+    # if the first row is consumed below MAX_LEVEL, yield the rows
+    # instead, and move the operator's code into a nested generator
+    start, outs = len(ctx.lines), []
+    def consume_or_yield(out, lvl):
+      if not outs:
+        outs.append((out, lvl > self.MAX_LEVEL))
+      if not outs[0][1]:
+        return consume(out, lvl)
+      ctx.emit(lvl, "yield %s" % ctx.tuple(out.vars))
+    handler(ctx, op, level, consume_or_yield)
+    if not outs or not outs[0][1]:
+      return
+
+    func = ctx.var(klass)
+    ctx.lines[start:] = ["  " * level + "def %s():" % func] + [
+        "  " + line for line in ctx.lines[start:]]
+    out = outs[0][0]
+    ctx.emit(level, "for %s in %s():" % (ctx.unpack(out), func))
+    consume(out, level + 1)
+
+  def produce_print(self, ctx, op, level, consume):
+    def print_row(out, level):
+      ctx.emit(level, "print %s" % ctx.row(out))
+    self.produce(ctx, op.c, level, print_row)
+    ctx.emit(level, "yield None")
+
+  def produce_scan(self, ctx, op, level, consume):
+    if op.tablename not in self.db:
+      raise Exception("Table \"%s\" not found in database" % op.tablename)
+    table = self.db[op.tablename]
+    out = Output(Schema.get(table.fields, op.alias), map(ctx.var, table.fields))
+    ctx.emit(level, "for %s in db[%r].tuples():" % (ctx.unpack(out), op.tablename))
+    consume(out, level + 1)
+
+  def produce_subquerysource(self, ctx, op, level, consume):
+    def alias(out, level):
+      if op.alias:
+        out = out.alias(op.alias)
+      consume(out, level)
+    self.produce(ctx, op.c, level, alias)
+
+  def produce_filter(self, ctx, op, level, consume):
+    def filter_row(out, level):
+      ctx.emit(level, "if %s:" % self.expr(ctx, op.cond, out))
+      consume(out, level + 1)
+    self.produce(ctx, op.c, level, filter_row)
+
+  def produce_project(self, ctx, op, level, consume):
+    def project_row(out, level):
+      vals = []
+      for e, alias in zip(op.exprs, op.aliases):
+        if isinstance(e, Star):
+          vals.extend(out.vars)
+          continue
+        code = self.expr(ctx, e, out)
+        if code not in out.vars:
+          var = ctx.var(alias)
+          ctx.emit(level, "%s = %s" % (var, code))
+          code = var
+        vals.append(code)
+      schema, positions = op.layout(out.schema.fields)
+      consume(Output(schema, [vals[i] for i in positions]), level)
+
+    # if the query doesn't have a FROM clause (SELECT 1),
+    # then project an empty tuple
+    if op.c is None:
+      project_row(Output(EMPTY_ROW.schema, []), level)
+    else:
+      self.produce(ctx, op.c, level, project_row)
+
+  def produce_thetajoin(self, ctx, op, level, consume):
+    # materialize the inner side once
+    rows, inner = ctx.var("inner"), []
+    ctx.emit(level, "%s = []" % rows)
+    def add_row(out, level):
+      inner.append(out)
+      ctx.emit(level, "%s.append(%s)" % (rows, ctx.tuple(out.vars)))
+    self.produce(ctx, op.r, level, add_row)
+
+    def join_row(out, level):
+      rout = inner[0]
+      ctx.emit(level, "for %s in %s:" % (ctx.unpack(rout), rows))
+      if isinstance(op.cond, Bool) and op.cond.v is True:
+        # cross product
+        consume(out.concat(rout), level + 1)
+        return
+      ctx.emit(level + 1, "if %s:" % self.expr(ctx, op.cond, out, rout))
+      consume(out.concat(rout), level + 2)
+    self.produce(ctx, op.l, level, join_row)
+
+  def produce_hashjoin(self, ctx, op, level, consume):
+    if op.build_side(self.db) == "left":
+      build, battrs, probe, pattrs = op.l, op.lattrs, op.r, op.rattrs
+    else:
+      build, battrs, probe, pattrs = op.r, op.rattrs, op.l, op.lattrs
+
+    index, built = ctx.var("index"), []
+    ctx.emit(level, "%s = {}" % index)
+    def add_row(out, level):
+      built.append(out)
+      ctx.emit(level, "%s.setdefault(%s, []).append(%s)" % (
+          index, self.exprs(ctx, battrs, out), ctx.tuple(out.vars)))
+    self.produce(ctx, build, level, add_row)
+
+    def probe_row(out, level):
+      bout = built[0]
+      ctx.emit(level, "for %s in %s.get(%s, ()):" % (
+          ctx.unpack(bout), index, self.exprs(ctx, pattrs, out)))
+      if build is op.l:
+        consume(bout.concat(out), level + 1)
+      else:
+        consume(out.concat(bout), level + 1)
+    self.produce(ctx, probe, level, probe_row)
+
+  def produce_sortmergejoin(self, ctx, op, level, consume):
+    # both inputs are pipeline breakers: their rows are collected (and
+    # sorted, unless they are already in order), then merged
+    sides = []
+    for child, attrs, presorted in op.sides():
+      rows, outs = ctx.var("rows"), []
+      if presorted:
+        ctx.emit(level, "%s = []" % rows)
+        add = "append"
+      else:
+        ctx.emit(level, "%s = %s(%s)" % (rows, ctx.const(op.sorter), ctx.const(attrs)))
+        add = "add"
+      def add_row(out, level, rows=rows, add=add, outs=outs):
+        outs.append(out)
+        ctx.emit(level, "%s.%s(%s)" % (rows, add, ctx.row(out)))
+      self.produce(ctx, child, level, add_row)
+      sides.append((rows, outs[0]))
+
+    (lrows, lout), (rrows, rout) = sides
+    ctx.emit(level, "for %s, %s in %s(%s, %s):" % (
+        ctx.unpack(lout), ctx.unpack(rout), ctx.const(op.merge), lrows, rrows))
+    consume(lout.concat(rout), level + 1)
+
+  def produce_groupby(self, ctx, op, level, consume):
+    aggs = op.aggregates()
+    if op.budget() is not None:
+      return self.produce_groupby_spill(ctx, op, aggs, level, consume)
+    if aggs is not None:
+      return self.produce_groupby_aggs(ctx, op, aggs, level, consume)
+
+    groups, child = ctx.var("groups"), []
+    ctx.emit(level, "%s = {}" % groups)
+    def add_row(out, level):
+      child.append(out)
+      ctx.emit(level, "%s.setdefault(%s, []).append(%s)" % (
+          groups, self.exprs(ctx, op.group_exprs, out), ctx.row(out)))
+    self.produce(ctx, op.c, level, add_row)
+
+    # like the interpretors, the last row of each group represents the
+    # group, followed by the group's key and rows
+    out = child[0]
+    key, group = ctx.var("key"), ctx.var("group")
+    ctx.emit(level, "for %s, %s in %s.iteritems():" % (key, group, groups))
+    ctx.emit(level + 1, "%s = %s[-1]" % (ctx.unpack(out), group))
+    ctx.groups[group] = out.schema
+    schema = out.schema.extend(GroupBy.GROUP_FIELDS)
+    consume(Output(schema, out.vars + [key, group]), level + 1)
+
+  def produce_groupby_aggs(self, ctx, op, aggs, level, consume):
+    """
+    Like GroupBy, only keep each group's last row and the running states
+    of its aggregates (see GroupBy.aggregates())
+    """
+    groups, child = ctx.var("groups"), []
+    new = "%s(%s, [%s])" % (
+        ctx.const(AggStates), ctx.const(dict((id(f), i) for i, f in enumerate(aggs))),
+        ", ".join("%s()" % ctx.const(Func.agg_state_lookup[f.name]) for f in aggs))
+    ctx.emit(level, "%s = {}" % groups)
+    def add_row(out, level):
+      child.append(out)
+      key, entry = ctx.var("key"), ctx.var("entry")
+      ctx.emit(level, "%s = %s" % (key, self.exprs(ctx, op.group_exprs, out)))
+      ctx.emit(level, "%s = %s.get(%s)" % (entry, groups, key))
+      ctx.emit(level, "if %s is None:" % entry)
+      ctx.emit(level + 1, "%s = %s[%s] = [None, %s]" % (entry, groups, key, new))
+      ctx.emit(level, "%s[0] = %s" % (entry, ctx.tuple(out.vars)))
+      for i, f in enumerate(aggs):
+        ctx.emit(level, "%s[1].states[%d].update(*%s)" % (
+            entry, i, self.exprs(ctx, list(f.args), out)))
+    self.produce(ctx, op.c, level, add_row)
+
+    out = child[0]
+    key, tup, states = ctx.var("key"), ctx.var("tup"), ctx.var("group")
+    ctx.emit(level, "for %s, (%s, %s) in %s.iteritems():" % (key, tup, states, groups))
+    ctx.emit(level + 1, "%s = %s" % (ctx.unpack(out), tup))
+    ctx.groups[states] = None
+    schema = out.schema.extend(GroupBy.GROUP_FIELDS)
+    consume(Output(schema, out.vars + [key, states]), level + 1)
+
+  def produce_groupby_spill(self, ctx, op, aggs, level, consume):
+    """
+    Groups that may not fit in memory are aggregated by a HashAggregator,
+    which spills rows to disk
+    """
+    groups, child = ctx.var("groups"), []
+    ctx.emit(level, "%s = %s(%s, %s)" % (
+        groups, ctx.const(HashAggregator), ctx.const(op), op.budget()))
+    def add_row(out, level):
+      child.append(out)
+      ctx.emit(level, "%s.add(%s)" % (groups, ctx.row(out)))
+    self.produce(ctx, op.c, level, add_row)
+
+    out = child[0]
+    key, tup, group = ctx.var("key"), ctx.var("tup"), ctx.var("group")
+    ctx.emit(level, "for %s, %s, %s in %s:" % (key, tup, group, groups))
+    ctx.emit(level + 1, "%s = %s" % (ctx.unpack(out), tup))
+    ctx.groups[group] = None if aggs is not None else out.schema
+    schema = out.schema.extend(GroupBy.GROUP_FIELDS)
+    consume(Output(schema, out.vars + [key, group]), level + 1)
+
+  def produce_orderby(self, ctx, op, level, consume):
+    if op.budget() is not None:
+      return self.produce_orderby_spill(ctx, op, level, consume)
+
+    rows, child = ctx.var("rows"), []
+    ctx.emit(level, "%s = []" % rows)
+    def add_row(out, level):
+      child.append(out)
+      ctx.emit(level, "%s.append((%s, %s))" % (
+          rows, self.exprs(ctx, op.order_exprs, out), ctx.tuple(out.vars)))
+    self.produce(ctx, op.c, level, add_row)
+
+    # python's sort is stable, so sort by the last key first
+    for i, desc in reversed(list(enumerate(op.descending()))):
+      ctx.emit(level, "%s.sort(key=lambda r: r[0][%d], reverse=%s)" % (rows, i, desc))
+    out = child[0]
+    ctx.emit(level, "for %s, %s in %s:" % (ctx.var("_"), ctx.unpack(out), rows))
+    consume(out, level + 1)
+
+  def produce_orderby_spill(self, ctx, op, level, consume):
+    """
+    Rows that may not fit in memory are sorted by an ExternalSorter
+    """
+    rows, child = ctx.var("rows"), []
+    ctx.emit(level, "%s = %s(%s, %s)" % (
+        rows, ctx.const(ExternalSorter), ctx.const(op.row_key()), op.budget()))
+    def add_row(out, level):
+      child.append(out)
+      ctx.emit(level, "%s.add(%s)" % (rows, ctx.row(out)))
+    self.produce(ctx, op.c, level, add_row)
+
+    out = child[0]
+    ctx.emit(level, "for %s in %s:" % (ctx.unpack(out), rows))
+    consume(out, level + 1)
+
+  def produce_topk(self, ctx, op, level, consume):
+    rows, child = ctx.var("rows"), []
+    ctx.emit(level, "%s = %s(%s, max(0, int(%s)))" % (
+        rows, ctx.const(TopKHeap), ctx.const(op),
+        self.expr(ctx, op.limit, Output(EMPTY_ROW.schema, []))))
+    def add_row(out, level):
+      child.append(out)
+      ctx.emit(level, "%s.add(%s)" % (rows, ctx.row(out)))
+    self.produce(ctx, op.c, level, add_row)
+
+    out = child[0]
+    ctx.emit(level, "for %s in %s:" % (ctx.unpack(out), rows))
+    consume(out, level + 1)
+
+  def produce_limit(self, ctx, op, level, consume):
+    # raised to stop the loops that feed the Limit
+    stop = ctx.const(type("StopLimit", (Exception,), {}))
+    limit, n = ctx.var("limit"), ctx.var("n")
+    ctx.emit(level, "%s = int(%s)" % (limit, self.expr(ctx, op.limit, Output(EMPTY_ROW.schema, []))))
+    ctx.emit(level, "%s = 0" % n)
+    ctx.emit(level, "try:")
+    def limit_row(out, level):
+      ctx.emit(level, "if %s >= %s: raise %s()" % (n, limit, stop))
+      ctx.emit(level, "%s += 1" % n)
+      consume(out, level)
+    self.produce(ctx, op.c, level + 1, limit_row)
+    ctx.emit(level, "except %s:" % stop)
+    ctx.emit(level + 1, "pass")
+
+  def produce_distinct(self, ctx, op, level, consume):
+    if op.budget() is not None:
+      return self.produce_distinct_spill(ctx, op, level, consume)
+
+    seen = ctx.var("seen")
+    ctx.emit(level, "%s = set()" % seen)
+    def distinct_row(out, level):
+      # like HashDistinct, unhashable values (e.g., a group's rows) are
+      # compared by their repr(), see distinct_key()
+      key = ctx.var("key")
+      ctx.emit(level, "%s = %s(%s)" % (key, ctx.const(distinct_key), ctx.tuple(out.vars)))
+      ctx.emit(level, "if %s not in %s:" % (key, seen))
+      ctx.emit(level + 1, "%s.add(%s)" % (seen, key))
+      consume(out, level + 1)
+    self.produce(ctx, op.c, level, distinct_row)
+
+  def produce_distinct_spill(self, ctx, op, level, consume):
+    """
+    Like Distinct, remember at most op.budget() rows and dedupe the rest
+    of the rows by sorting them.  The parent's code is generated twice:
+    for the rows that are output right away, and for the sorted rest.
+    """
+    rows = ctx.var("rows")
+    ctx.emit(level, "%s = %s(%s)" % (rows, ctx.const(HashDistinct), op.budget()))
+    child = []
+    def distinct_row(out, level):
+      child.append(out)
+      ctx.emit(level, "if %s.add(%s):" % (rows, ctx.row(out)))
+      consume(out, level + 1)
+    self.produce(ctx, op.c, level, distinct_row)
+
+    out = child[0]
+    ctx.emit(level, "for %s in %s.rest():" % (ctx.unpack(out), rows))
+    consume(out, level + 1)
@@ -0,0 +1,122 @@
+"""
+Small-memory summaries of a stream of values, used by db.Stats to
+estimate statistics of large tables without keeping all of their values.
+
+* HyperLogLog estimates the number of distinct values
+* Reservoir keeps a fixed size uniform random sample of the values
+"""
+import math
+import random
+
+
+MASK64 = (1 << 64) - 1
+
+def hash64(v):
+  """
+  64 bit hash of @v.  Python's hash() is the identity for small integers,
+  so its bits are mixed with the splitmix64 finalizer.
+  """
+  x = hash(v) & MASK64
+  x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+  x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+  return x ^ (x >> 31)
+
+
+class HyperLogLog(object):
+  """
+  HyperLogLog distinct count sketch (Flajolet et al.).  Uses 2^precision
+  one byte registers, and has a standard error of about
+  1.04 / sqrt(2^precision).
+  """
+
+  DEFAULT_PRECISION = 12
+
+  def __init__(self, precision=DEFAULT_PRECISION):
+    if not 4 <= precision <= 18:
+      raise Exception("HyperLogLog precision must be between 4 and 18, got %s" % precision)
+    self.p = precision
+    self.m = 1 << precision
+    self.registers = bytearray(self.m)
+
+  @staticmethod
+  def precision_for(error):
+    """
+    The smallest precision whose standard error is at most @error
+    """
+    p = int(math.ceil(math.log((1.04 / error) ** 2, 2)))
+    return min(max(p, 4), 18)
+
+  @property
+  def error(self):
+    return 1.04 / math.sqrt(self.m)
+
+  @property
+  def nbytes(self):
+    return self.m
+
+  def add(self, v):
+    x = hash64(v)
+    idx = x >> (64 - self.p)
+    rest = x & ((1 << (64 - self.p)) - 1)
+    # position of the leftmost 1 bit in the remaining 64-p bits
+    rank = (64 - self.p) - rest.bit_length() + 1
+    if rank > self.registers[idx]:
+      self.registers[idx] = rank
+
+  def merge(self, other):
+    if self.p != other.p:
+      raise Exception("Can't merge HyperLogLogs with different precisions")
+    for i, r in enumerate(other.registers):
+      if r > self.registers[i]:
+        self.registers[i] = r
+
+  def estimate(self):
+    m = float(self.m)
+    if self.m == 16:
+      alpha = 0.673
+    elif self.m == 32:
+      alpha = 0.697
+    elif self.m == 64:
+      alpha = 0.709
+    else:
+      alpha = 0.7213 / (1 + 1.079 / m)
+
+    est = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+    zeros = self.m - sum(1 for r in self.registers if r)
+    if est <= 2.5 * m and zeros:
+      # small range correction: linear counting
+      est = m * math.log(m / zeros)
+    return est
+
+  def __len__(self):
+    return int(round(self.estimate()))
+
+
+class Reservoir(object):
+  """
+  Uniform random sample of at most @size values of a stream
+  (Vitter's Algorithm R)
+  """
+
+  DEFAULT_SIZE = 1024
+
+  def __init__(self, size=DEFAULT_SIZE, seed=0):
+    self.size = size
+    self.n = 0
+    self.sample = []
+    self.rand = random.Random(seed)
+
+  def add(self, v):
+    self.n += 1
+    if len(self.sample) < self.size:
+      self.sample.append(v)
+    else:
+      i = self.rand.randint(0, self.n - 1)
+      if i < self.size:
+        self.sample[i] = v
+
+  def __len__(self):
+    return len(self.sample)
+
+  def __iter__(self):
+    return iter(self.sample)
@@ -0,0 +1,56 @@
+"""
+Temporary files for operators whose state does not fit in memory.
+
+A SpillFile is an append-only list of rows that lives in an anonymous
+temporary file.  Rows are pickled in chunks, so that the schema of the
+rows in a chunk (see Row.__reduce__) is only written once per chunk.
+The file is deleted when it is closed or garbage collected.
+"""
+import tempfile
+import cPickle
+
+
+class SpillFile(object):
+  def __init__(self, chunksize=1024, dir=None):
+    """
+    @chunksize  number of rows that are buffered before they are written
+    @dir        directory of the temporary file, defaults to the
+                tempfile module's default
+    """
+    self.chunksize = chunksize
+    self.f = tempfile.TemporaryFile(dir=dir)
+    self.buf = []
+    self.n = 0
+
+  def append(self, row):
+    self.buf.append(row)
+    self.n += 1
+    if len(self.buf) >= self.chunksize:
+      self.flush()
+
+  def flush(self):
+    if self.buf:
+      cPickle.dump(self.buf, self.f, cPickle.HIGHEST_PROTOCOL)
+      self.buf = []
+
+  def __iter__(self):
+    """
+    Iterate over the rows in the order they were appended.  Rows must
+    not be appended while the file is read.
+    """
+    self.flush()
+    self.f.seek(0)
+    while True:
+      try:
+        chunk = cPickle.load(self.f)
+      except EOFError:
+        break
+      for row in chunk:
+        yield row
+
+  def close(self):
+    self.buf = []
+    self.f.close()
+
+  def __len__(self):
+    return self.n
@@ -0,0 +1,458 @@
+"""
+Hand-written parser for the SQL grammar in parse_sql.py.
+
+parse_sql.Visitor builds a parsimonious parse tree by PEG backtracking,
+and then visits every node of the tree, which takes longer than running
+many of the queries.  This module splits the query into tokens with one
+regular expression, and parses the tokens by recursive descent, with a
+Pratt parser for expressions.  It builds the same operator trees as
+parse_sql.Visitor, including the grammar's quirks, e.g., all binary
+operators have the same precedence and are right associative,
+
+        a * b + c   -->   a * (b + c)
+
+Queries that this parser does not accept, including some that the
+grammar does (e.g., HAVING, and words that start with "not" or "true"),
+raise an Exception, and parse_sql.parse() then parses them with
+parsimonious.
+
+    python sqlparser.py
+
+checks that both parsers build the same trees for a corpus of queries,
+and compares their speed.
+"""
+import re
+from collections import namedtuple
+from ops import *
+
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+)                                                  |
+    (?P<name>`[a-zA-Z][\w\.\-\_\:\*]*`|\[[a-zA-Z][\w\.\-\_\:\*]*\]) |
+    (?P<string>(?P<quote>["'])(?:\\?.)*?(?P=quote))                 |
+    (?P<number>\d*\.?\d+)                                           |
+    (?P<param>\?|:[a-zA-Z_]\w*)                                     |
+    (?P<word>\w+)                                                   |
+    (?P<op>==|<>|!=|<=|>=|[-+*/=<>(),.])                            |
+    (?P<other>.)
+""", re.VERBOSE)
+
+NAME = re.compile(r"[a-zA-Z]\w*$")
+
+# @space is True if the token follows whitespace
+Token = namedtuple("Token", ["kind", "text", "space"])
+
+END = Token("end", "", True)
+
+BINARY_OPS = set(["+", "-", "*", "/", "==", "=", "<>", "!=", "<=", ">", "<",
+                  "like", "LIKE"])
+UNARY_OPS = set(["+", "-"])
+
+# every binary operator, and BETWEEN, bind equally tightly
+BINDING_POWER = 10
+
+
+def tokenize(sql):
+  """
+  Returns the list of Tokens of @sql, followed by END
+  """
+  tokens, space = [], False
+  for m in TOKEN.finditer(sql):
+    kind = m.lastgroup
+    if kind == "space":
+      space = True
+      continue
+    if kind == "quote":
+      kind = "string"
+    tokens.append(Token(kind, m.group(0), space))
+    space = False
+  tokens.append(END)
+  return tokens
+
+
+class Parser(object):
+  """
+  Parses one query.  Each method parses the grammar rule with the same
+  name in parse_sql.py, and returns what parse_sql.Visitor returns for it.
+  """
+  def __init__(self, sql):
+    self.sql = sql
+    self.tokens = tokenize(sql)
+    self.i = 0
+
+    # see parse_sql.Visitor
+    self.params = []
+    self.param_names = {}
+
+  def parse(self):
+    op = self.query()
+    if self.peek() is not END:
+      self.error()
+    return op
+
+  def error(self, msg=None):
+    raise Exception(msg or "Can't parse %r at token %r" % (self.sql, self.peek().text))
+
+  #
+  # tokens
+  #
+
+  def peek(self, n=0):
+    return self.tokens[min(self.i + n, len(self.tokens) - 1)]
+
+  def next(self):
+    tok = self.peek()
+    self.i += 1
+    return tok
+
+  def at(self, text, n=0):
+    tok = self.peek(n)
+    return tok.kind == "op" and tok.text == text
+
+  def expect(self, text):
+    if not self.at(text):
+      self.error()
+    return self.next()
+
+  def keyword_at(self, n, *words, **kwargs):
+    """
+    Is the n'th next token one of @words?  Keywords must follow
+    whitespace unless @space is False.
+    """
+    tok = self.peek(n)
+    return (tok.kind == "word" and tok.text in words and
+            (tok.space or not kwargs.get("space", True)))
+
+  def keyword(self, *words, **kwargs):
+    """
+    Consume the next token if it is one of the keywords @words.  If
+    @wsp, whitespace must follow the keyword.
+    """
+    if not self.keyword_at(0, *words):
+      return False
+    self.next()
+    if kwargs.get("wsp") and not self.peek().space:
+      self.error()
+    return True
+
+  def is_name(self, n=0):
+    tok = self.peek(n)
+    return tok.kind == "name" or (tok.kind == "word" and NAME.match(tok.text))
+
+  def name(self):
+    if not self.is_name():
+      self.error()
+    text = self.next().text
+    if text[0] == text[-1] == "`":
+      text = text[1:-1]
+    return text
+
+  def alias(self):
+    if self.keyword("AS", "as", wsp=True):
+      return self.name()
+    return None
+
+  #
+  # SELECT
+  #
+
+  def query(self):
+    ret = self.select_core()
+    for clause in (self.orderby, self.limit):
+      op = clause()
+      if op is not None:
+        op.c = ret
+        ret = op
+    return ret
+
+  def select_core(self):
+    if not self.keyword_at(0, "SELECT", "select", space=False):
+      self.error()
+    self.next()
+    if not self.peek().space:
+      self.error()
+    selectc = self.select_results()
+    nodes = [self.from_clause(), self.where_clause(), self.gb_clause(), selectc]
+    ret = None
+    for n in filter(bool, nodes):
+      if ret is not None:
+        n.c = ret
+      ret = n
+    return ret
+
+  def select_results(self):
+    results = [self.select_result()]
+    while self.at(","):
+      self.next()
+      results.append(self.select_result())
+    exprs, aliases = zip(*results)
+    return Project(None, exprs, aliases)
+
+  def select_result(self):
+    if self.at("*"):
+      self.next()
+      return (Star(), None)
+    if (self.is_name() and self.at(".", 1) and self.at("*", 2) and
+        not self.peek(1).space and not self.peek(2).space):
+      name = self.name()
+      self.i += 2
+      return (Star(name), None)
+    return (self.expression(), self.alias())
+
+  #
+  # FROM
+  #
+
+  def from_clause(self):
+    if not self.keyword("FROM", "from"):
+      return None
+    sources = [self.single_source()]
+    while self.at(","):
+      self.next()
+      sources.append(self.single_source())
+    return From(sources)
+
+  def single_source(self):
+    if self.peek().kind == "word" and self.at("(", 1) and not self.peek(1).space:
+      f = self.function()
+      return TableFunctionSource(f, self.alias() or [])
+    if self.at("("):
+      self.next()
+      subq = self.query()
+      self.expect(")")
+      return SubQuerySource(subq, self.alias() or [])
+    tname = self.name()
+    return Scan(tname, self.alias() or tname)
+
+  #
+  # Other clauses
+  #
+
+  def where_clause(self):
+    if not self.keyword("WHERE", "where", wsp=True):
+      return None
+    exprs = [self.expression()]
+    while self.keyword("AND", "and", wsp=True):
+      exprs.append(self.expression())
+    ret = exprs[0]
+    for e in exprs[1:]:
+      ret = Expr("and", e, ret)
+    return Filter(None, ret)
+
+  def gb_clause(self):
+    if not self.keyword("GROUP", "group"):
+      return None
+    if not self.keyword("BY", "by"):
+      self.error()
+    groups = [self.expression()]
+    while self.at(","):
+      self.next()
+      groups.append(self.expression())
+    if self.keyword_at(0, "HAVING", "having"):
+      self.error("HAVING is parsed by parse_sql.Visitor")
+    return GroupBy(None, groups)
+
+  def orderby(self):
+    if not self.keyword("ORDER", "order"):
+      return None
+    if not self.keyword("BY", "by"):
+      self.error()
+    terms = [self.ordering_term()]
+    while self.at(","):
+      self.next()
+      terms.append(self.ordering_term())
+    exprs, ascdesc = zip(*terms)
+    return OrderBy(None, exprs, ascdesc)
+
+  def ordering_term(self):
+    expr = self.expression()
+    if self.keyword("ASC", "asc"):
+      return (expr, "asc")
+    if self.keyword("DESC", "desc"):
+      return (expr, "desc")
+    return (expr, [])
+
+  def limit(self):
+    if not self.keyword("LIMIT", "limit", wsp=True):
+      return None
+    return Limit(None, self.expression())
+
+  #
+  # Expressions
+  #
+
+  def binding_power(self, tok):
+    if tok.kind == "op" and tok.text in BINARY_OPS:
+      return BINDING_POWER
+    if tok.kind == "word" and (tok.text in BINARY_OPS or
+        (tok.text in ("BETWEEN", "between") and tok.space)):
+      return BINDING_POWER
+    return 0
+
+  def expression(self, rbp=0):
+    """
+    Pratt parser.  Operators are right associative, so their right
+    operand is parsed with a binding power just below their own, and
+    takes the rest of the expression.  The left operand of BETWEEN is
+    the value before it, and BETWEEN ends the expression, e.g.,
+
+        a + b BETWEEN c AND d + e
+
+    is an error.
+    """
+    left = self.nud()
+    if self.binding_power(self.peek()) <= rbp:
+      return left
+    tok = self.next()
+    if tok.text in ("BETWEEN", "between"):
+      return self.between(left)
+    return Expr(tok.text, left, self.expression(BINDING_POWER - 1))
+
+  def nud(self):
+    tok = self.peek()
+    if tok.kind == "op" and tok.text in UNARY_OPS:
+      self.next()
+      if self.peek().space:
+        self.error()
+      return Expr(tok.text, self.expression())
+    if tok.kind == "word" and tok.text[:3] in ("not", "NOT"):
+      # the grammar parses words that start with not as the not operator
+      self.error("not is parsed by parse_sql.Visitor")
+    return self.value()
+
+  def between(self, expr):
+    if not self.peek().space:
+      self.error()
+    lower = self.value()
+    if not self.keyword("AND", "and", wsp=True):
+      self.error()
+    upper = self.value()
+    # parse_sql.Visitor passes the operands in this order
+    return Between(lower, expr, upper)
+
+  def value(self):
+    tok = self.peek()
+    if tok.kind == "op" and tok.text == "(":
+      self.next()
+      expr = self.expression()
+      self.expect(")")
+      return expr
+    if tok.kind == "number":
+      self.next()
+      return Literal(float(tok.text))
+    if tok.kind == "string":
+      self.next()
+      return Literal(tok.text)
+    if tok.kind == "param":
+      self.next()
+      return self.param(tok.text)
+    if tok.kind == "word":
+      if tok.text in ("true", "false"):
+        self.next()
+        return Literal(tok.text == "true")
+      if tok.text.startswith(("true", "false")):
+        self.error("%s is parsed by parse_sql.Visitor" % tok.text)
+      if self.at("(", 1) and not self.peek(1).space:
+        return self.function()
+    if self.is_name():
+      return self.col_ref()
+    if tok.kind == "word":
+      self.next()
+      return Attr(tok.text)
+    self.error()
+
+  def col_ref(self):
+    name = self.name()
+    if (self.at(".") and not self.peek().space and
+        self.is_name(1) and not self.peek(1).space):
+      self.next()
+      return Attr(self.name(), name)
+    return Attr(name, [])
+
+  def function(self):
+    fname = self.next().text
+    self.expect("(")
+    args = []
+    if not self.at(")"):
+      args.append(self.expression())
+      while self.at(","):
+        self.next()
+        args.append(self.expression())
+    self.expect(")")
+    return Func(fname, args)
+
+  def param(self, text):
+    """
+    See parse_sql.Visitor.visit_param()
+    """
+    name = text[1:] or None
+    if self.params and (name is None) != (not self.param_names):
+      raise Exception("Can't mix ? and :name placeholders in a query")
+    if name is not None and name in self.param_names:
+      return Param(self.param_names[name], self.params, name)
+    slot = len(self.params)
+    self.params.append(None)
+    if name is not None:
+      self.param_names[name] = slot
+    return Param(slot, self.params, name)
+
+
+def parse(sql):
+  """
+  Parse @sql into a tree of operators.  Raises an Exception if the query
+  can't be parsed by this parser.
+  """
+  return Parser(sql).parse()
+
+
+def same_tree(a, b):
+  """
+  Are @a and @b trees of the same operators with the same attributes?
+  Ignores parent pointers and private (_ prefixed) attributes.
+  """
+  if isinstance(a, Op) or isinstance(b, Op):
+    if a.__class__ is not b.__class__:
+      return False
+    keys = set(k for k in a.__dict__ if k != "p" and not k.startswith("_"))
+    if keys != set(k for k in b.__dict__ if k != "p" and not k.startswith("_")):
+      return False
+    return all(same_tree(a.__dict__[k], b.__dict__[k]) for k in keys)
+  if isinstance(a, (list, tuple)) or isinstance(b, (list, tuple)):
+    return (a.__class__ is b.__class__ and len(a) == len(b) and
+            all(same_tree(x, y) for x, y in zip(a, b)))
+  return a.__class__ is b.__class__ and a == b
+
+
+if __name__ == "__main__":
+  import timeit
+  import parse_sql
+
+  queries = [
+    "SELECT a FROM data",
+    "SELECT * FROM data WHERE a > 15 AND b < 18",
+    "SELECT a * 2 AS x, lower(e) AS l FROM data WHERE a BETWEEN 3 AND 6",
+    "SELECT data.a, d2.m FROM data, data2 AS d2 WHERE data.a = d2.m LIMIT 10",
+    "SELECT a, count(1) AS c, sum(b) AS s FROM data GROUP BY a ORDER BY c DESC, a",
+    "SELECT x FROM (SELECT a AS x, b FROM data WHERE b < 10) AS t WHERE x = 3",
+    "SELECT a, b, c, d, e FROM data WHERE a = 1 AND b = 2 AND c = 3 AND d = 4 AND e = 'x'",
+    "SELECT (a + 1) * (b - 2) / -c AS v FROM data WHERE e = 'it is' ORDER BY v ASC LIMIT ?",
+    "SELECT a FROM data WHERE a < :hi AND a > :lo AND b <> :hi",
+  ]
+  n = 200
+
+  print "per-query parse time in microseconds (%d runs)" % n
+  print "%-60s %12s %10s %8s" % ("query", "parsimonious", "sqlparser", "speedup")
+  total = [0, 0]
+  for q in queries:
+    if not same_tree(parse_sql.Visitor().parse(q), parse(q)):
+      print "DIFFERENT TREES: %s" % q
+    times = []
+    for f in (parse_sql.Visitor().parse, parse):
+      start = timeit.default_timer()
+      for i in xrange(n):
+        f(q)
+      times.append((timeit.default_timer() - start) / n * 1e6)
+    total[0] += times[0]
+    total[1] += times[1]
+    print "%-60s %12.1f %10.1f %7.1fx" % (q[:60], times[0], times[1], times[0] / times[1])
+  print "%-60s %12.1f %10.1f %7.1fx" % ("total", total[0], total[1], total[0] / total[1])
@@ -0,0 +1,57 @@
+"""
+Binary cache of the tables that Database.setup() loads from CSV files.
+
+Parsing a CSV file with pandas is slow, so the first time a CSV file is
+loaded, its columns are written to a cache file next to it:
+
+    data/data.csv  -->  data/data.csv.dbcache
+
+The cache file uses the native columnar format in colfile.py, and its
+header records the path, size and modification time of the CSV file it
+was built from.  Numeric columns are memory mapped when the cache is
+read.  The cache is ignored (and rebuilt) if the CSV file changes.
+"""
+import os
+import colfile
+
+EXTENSION = ".dbcache"
+
+
+def cache_path(csvpath):
+  return csvpath + EXTENSION
+
+def cache_key(csvpath):
+  """
+  Identifies the version of the CSV file that a cache was built from
+  """
+  st = os.stat(csvpath)
+  return dict(path=os.path.abspath(csvpath), size=st.st_size, mtime=st.st_mtime)
+
+
+def write_cache(csvpath, fields, columns, dicts=None):
+  """
+  @csvpath  path of the CSV file that the columns were read from
+  @fields   ordered list of field names
+  @columns  dictionary that maps each field name to a numpy array
+  @dicts    dictionary encoded fields, see colfile.write_columns()
+  """
+  colfile.write_columns(cache_path(csvpath), fields, columns, 
+                        dict(key=cache_key(csvpath)), dicts)
+
+
+def read_cache(csvpath):
+  """
+  @csvpath  path of a CSV file
+
+  Returns the (fields, columns, dicts) that were written by write_cache(),
+  or None if there is no cache file or it is out of date.  Numeric columns
+  and the codes of dictionary encoded columns are read-only numpy.memmap
+  arrays.
+  """
+  path = cache_path(csvpath)
+  if not os.path.exists(path):
+    return None
+  header = colfile.read_header(path)
+  if header is None or header["meta"].get("key") != cache_key(csvpath):
+    return None
+  return colfile.read_columns(path, header, decode=False)
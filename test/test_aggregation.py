@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+
+
+class TestAggregation(unittest.TestCase):
+
+  def test_states(self):
+    vals = [1e9 + v for v in [4, 7, 13, 16, 2.5]]
+    for name, truth in [("count", len(vals)), ("sum", np.sum(vals)),
+                        ("avg", np.mean(vals)), ("std", np.std(vals)),
+                        ("min", min(vals)), ("max", max(vals))]:
+      state = Func.agg_state_lookup[name]()
+      for v in vals:
+        state.update(v)
+      self.assertAlmostEqual(state.value(), truth, places=5)
+
+  def test_streaming(self):
+    q = """SELECT a, count(1) AS c, avg(b) AS x, sum(b * 2) AS s, std(c) AS d,
+                  min(c) AS mn, max(c) AS mx FROM data GROUP BY a"""
+    plan = Optimizer(db)(parse(q))
+    for scan in plan.collect("Scan"):
+      scan.set_db(db)
+    gb = plan.collectone("GroupBy")
+    self.assertEqual(len(gb.aggregates()), 6)
+    self.assertTrue(all(isinstance(row["__group__"], AggStates) for row in gb))
+
+    truth = list(PullBasedInterpretor(db)(plan))
+    push = []
+    PushBasedInterpretor(db)(plan, push.append)
+    self.assertEqual(truth, push)
+    self.assertEqual(truth, list(QueryCompiler(db)(plan)))
+
+    # the groups' rows are still kept when an operator reads them
+    scan = Scan("data")
+    scan.set_db(db)
+    rows = list(GroupBy(scan, ["a"]))
+    self.assertTrue(all(isinstance(row["__group__"], list) for row in rows))
+    self.assertIsNone(Project(GroupBy(Scan("data"), ["a"]), [Star()]).c.aggregates())
+
+
+if __name__ == '__main__':
+  unittest.main()
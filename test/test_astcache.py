@@ -0,0 +1,46 @@
+import unittest
+
+from databass.astcache import ASTCache, copy_tree
+from databass.db import Database
+from databass.ops import Param
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse, parse_uncached
+from databass.parse_expr import parse as parse_expr
+from databass.sqlparser import same_tree
+
+db = Database()
+
+
+class TestASTCache(unittest.TestCase):
+
+  def test_copies(self):
+    q = "SELECT a, m FROM data, data2 WHERE a = m AND b < ? ORDER BY a LIMIT ?"
+    plan = Optimizer(db)(parse(q))
+    plan.collect(Param)[0].params[:] = [1, 2]
+    again = parse(q)
+    self.assertIsNot(again, plan)
+    self.assertTrue(same_tree(again, parse_uncached(q)))
+
+    params = again.collect(Param)
+    self.assertEqual(params[0].params, [None, None])
+    self.assertEqual(len(set(id(p.params) for p in params)), 1)
+    self.assertTrue(all(op.c.p is op for op in again.collect("Limit")))
+
+    e = parse_expr("(a + 1) < b")
+    e.l = None
+    self.assertIsNotNone(parse_expr("(a + 1) < b").l)
+
+  def test_lru(self):
+    cache = ASTCache(parse_uncached, capacity=2)
+    for q in ["SELECT a FROM data", "SELECT b FROM data", "SELECT a FROM data",
+              "SELECT c FROM data", "SELECT b FROM data"]:
+      tree = cache(q)
+      self.assertTrue(same_tree(tree, copy_tree(tree)))
+    self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 4, 2))
+    self.assertEqual(len(cache), 2)
+    self.assertRaises(Exception, cache, "SELECT a FROM data ORDER")
+    self.assertEqual(len(cache), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
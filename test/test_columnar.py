@@ -0,0 +1,243 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import pandas
+
+from databass import colfile, tablecache
+from databass.db import Database, Table, InMemoryTable, ColumnarTable, LazyTable
+from databass.db import StreamingCSVTable, ColumnFileTable
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import Scan, Limit
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+
+db = Database()
+
+
+class TestColumnar(unittest.TestCase):
+  """Columnar table storage"""
+
+  def setUp(self):
+    self.df = pandas.read_csv("databass/data/iowa-liquor-sample.csv")
+    self.rowtable = Table.from_dataframe(self.df)
+    self.coltable = Table.from_dataframe(self.df, columnar=True)
+
+  def test_registered_columnar(self):
+    self.assertTrue(isinstance(db["data"], ColumnarTable))
+    self.assertTrue(isinstance(self.rowtable, InMemoryTable))
+
+  def test_same_rows(self):
+    key = lambda row: sorted(row.items())
+    self.assertEqual(len(self.coltable), len(self.rowtable))
+    self.assertEqual(sorted(map(key, self.coltable)),
+                     sorted(map(key, self.rowtable)))
+
+  def test_contract(self):
+    self.assertEqual(list(self.coltable.fields), list(self.rowtable.fields))
+    for field in self.coltable.fields:
+      self.assertEqual(self.coltable.type(field), self.rowtable.type(field))
+      self.assertEqual(sorted(self.coltable.col_values(field)),
+                       sorted(self.rowtable.col_values(field)))
+
+  def test_memory(self):
+    self.assertTrue(self.coltable.nbytes < self.rowtable.nbytes)
+    for name in db.tablenames:
+      len(db[name])
+    usage = db.memory_usage()
+    self.assertEqual(set(usage.keys()), set(db.tablenames))
+    self.assertTrue(all(nbytes > 0 for nbytes in usage.values()))
+
+
+class TestTableCache(unittest.TestCase):
+  """Binary cache of CSV files"""
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    shutil.copy("databass/data/iowa-liquor-sample.csv", self.dir)
+    os.chdir(self.dir)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  def test_cache(self):
+    first = Database(lazy=False)
+    self.assertEqual(first.load_times["iowa-liquor-sample"][1], "csv")
+    self.assertTrue(os.path.exists("./iowa-liquor-sample.csv.dbcache"))
+
+    second = Database(lazy=False)
+    self.assertEqual(second.load_times["iowa-liquor-sample"][1], "cache")
+    a, b = first["iowa-liquor-sample"], second["iowa-liquor-sample"]
+    self.assertEqual(b.fields, a.fields)
+    self.assertEqual(list(b), list(a))
+    self.assertTrue(any(isinstance(col, np.memmap) for col in b.columns.values()))
+
+  def test_stale(self):
+    Database(lazy=False)
+    lines = open("iowa-liquor-sample.csv").read().splitlines()
+    with open("iowa-liquor-sample.csv", "w") as f:
+      f.write("\n".join(lines + lines[1:2]))
+    db = Database(lazy=False)
+    self.assertEqual(db.load_times["iowa-liquor-sample"][1], "csv")
+    self.assertEqual(len(db["iowa-liquor-sample"]), 1700)
+    self.assertEqual(len(Database()["iowa-liquor-sample"]), 1700)
+
+  def test_disabled(self):
+    db = Database(use_cache=False, lazy=False)
+    self.assertEqual(db.load_times["iowa-liquor-sample"][1], "csv")
+    self.assertFalse(os.path.exists("iowa-liquor-sample.csv.dbcache"))
+
+
+class TestLazy(unittest.TestCase):
+  """Tables are loaded when they are first used"""
+
+  def test_load_on_scan(self):
+    mydb = Database()
+    table = mydb["iowa-liquor-sample"]
+    self.assertTrue(isinstance(table, LazyTable))
+    self.assertFalse(table.is_loaded)
+    self.assertEqual(table.fields, db["iowa-liquor-sample"].fields)
+    self.assertEqual(mydb.load_times, {})
+
+    scan = Scan("iowa-liquor-sample")
+    scan.set_db(mydb)
+    self.assertEqual(len(list(Limit(scan, 5))), 5)
+    self.assertTrue(table.is_loaded)
+    self.assertEqual(mydb.load_times.keys(), ["iowa-liquor-sample"])
+
+  def test_load_on_stats(self):
+    mydb = Database()
+    self.assertEqual(mydb["data"].stats.card, 20)
+    self.assertTrue(mydb["data"].is_loaded)
+
+  def test_budget(self):
+    mydb = Database(memory_budget=db["data"].nbytes * 2)
+    names = ["data", "data2", "data3"]
+    for name in names:
+      list(mydb[name])
+    loaded = [name for name in names if mydb[name].is_loaded]
+    self.assertEqual(loaded, ["data2", "data3"])
+    self.assertEqual(mydb.budget.nevictions, 1)
+
+    # touching data2 makes data3 the least recently used table
+    list(mydb["data2"])
+    list(mydb["data"])
+    loaded = [name for name in names if mydb[name].is_loaded]
+    self.assertEqual(loaded, ["data", "data2"])
+
+    # evicted tables are reloaded and keep their statistics
+    stats = mydb["data3"].stats
+    self.assertEqual(len(list(mydb["data3"])), 20)
+    self.assertTrue(mydb["data3"].stats is stats)
+
+
+class TestStreaming(unittest.TestCase):
+  """CSV files that are scanned in chunks"""
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+    with open("big.csv", "w") as f:
+      f.write("a,b,c\n")
+      for i in range(20000):
+        f.write("%d,%d,s%d\n" % (i, i % 7, i % 100))
+    with open("small.csv", "w") as f:
+      f.write("x\n1\n")
+    self.db = Database(stream_threshold=1000)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  def test_registered(self):
+    big = self.db["big"]
+    self.assertTrue(isinstance(big, StreamingCSVTable))
+    self.assertTrue(isinstance(self.db["small"], LazyTable))
+    self.assertEqual(big.fields, ["a", "b", "c"])
+    self.assertEqual(big.type("a"), "num")
+    self.assertEqual(big.type("c"), "str")
+    self.assertEqual(big.nbytes, 0)
+    self.assertEqual(len(big), 20000)
+    self.assertFalse(os.path.exists("big.csv.dbcache"))
+
+  def test_pipeline(self):
+    q = Optimizer(self.db)(parse(
+      "SELECT a, c FROM big WHERE b = 3 AND a > 100 LIMIT 1000"))
+    truth = [dict(a=i, c="s%d" % (i % 100)) for i in range(101, 20000) if i % 7 == 3][:1000]
+    self.assertEqual(list(PullBasedInterpretor(self.db)(q)), truth)
+    rows = []
+    PushBasedInterpretor(self.db)(q, rows.append)
+    self.assertEqual(rows, truth)
+    self.assertEqual(list(BatchInterpretor(self.db, 1000)(q)), truth)
+
+  def test_batches(self):
+    big = self.db["big"]
+    sizes = [len(batch) for batch in big.batches(3000)]
+    self.assertEqual(sizes, [3000] * 6 + [2000])
+
+  def test_stats(self):
+    stats = self.db["big"].stats
+    self.assertEqual(stats.card, 20000)
+    self.assertEqual(stats["a"].domain, [0, 19999])
+    self.assertEqual(stats["b"].ndistinct, 7)
+
+
+class TestColumnFile(unittest.TestCase):
+  """Native .dbass columnar files"""
+
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    os.chdir(self.dir)
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir)
+
+  def test_roundtrip(self):
+    rows = [dict(a=i, b=i / 2.0, c=["x", "y", None][i % 3]) for i in range(10)]
+    mydb = Database()
+    mydb.register_table("t", Table.from_rows(rows))
+    mydb.save_table("t", "t.dbass")
+
+    table = ColumnFileTable("t.dbass")
+    self.assertEqual(sorted(table.fields), ["a", "b", "c"])
+    self.assertEqual(len(table), 10)
+    self.assertFalse(table.is_loaded)
+    self.assertTrue(isinstance(table.columns["a"], np.memmap))
+    for row, expected in zip(table, rows):
+      self.assertEqual(row["a"], expected["a"])
+      self.assertEqual(row["b"], expected["b"])
+      if expected["c"] is None:
+        self.assertTrue(row["c"] != row["c"])   # NaN
+      else:
+        self.assertEqual(row["c"], expected["c"])
+
+    fields, columns, dicts = colfile.read_columns("t.dbass", decode=False)
+    codes = columns["c"]
+    self.assertEqual(dicts["c"], ["x", "y"])
+    self.assertEqual(codes.dtype, np.int8)
+    self.assertEqual(codes.tolist(), [0, 1, -1] * 3 + [0])
+
+  def test_setup(self):
+    shutil.copy(os.path.join(self.cwd, "databass/data/iowa-liquor-sample.csv"), ".")
+    mydb = Database()
+    mydb.save_table("iowa-liquor-sample", "iowa-liquor-sample.dbass")
+    truth = list(mydb["iowa-liquor-sample"])
+
+    mydb = Database()
+    table = mydb["iowa-liquor-sample"]
+    self.assertTrue(isinstance(table, ColumnFileTable))
+    self.assertEqual(list(table), truth)
+    scan = Scan("iowa-liquor-sample")
+    scan.set_db(mydb)
+    self.assertEqual(len(list(Limit(scan, 10))), 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
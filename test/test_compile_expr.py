@@ -0,0 +1,53 @@
+import unittest
+
+from databass.db import Schema
+from databass.compile_expr import compile_expr
+from databass.ops import *
+from databass.parse_expr import parse
+
+T = Schema.get(["a", "b", "e"], "T").row_class
+U = Schema.get(["a", "c"], "U").row_class
+rows = [T((i, i % 3, "s%d" % (i % 2))) for i in range(10)]
+
+
+class TestCompileExpr(unittest.TestCase):
+
+  def test_same_values(self):
+    exprs = map(parse, ["a", "T.b", "(a + 1) * (b - 2)", "a / (b + 1)",
+                        "(a > 2) and (b = 1)", "(a < 2) or (e = e)", "lower(e)", "1"])
+    exprs += [Expr("-", Attr("a")), Expr("not", parse("a < 3")),
+              Between(Attr("a"), Literal(2), Literal(5))]
+    for e in exprs:
+      f = compile_expr(e)
+      for row in rows:
+        self.assertEqual(f(row), e(row), str(e))
+        self.assertEqual(f(row.asdict()), e(row.asdict()), str(e))
+
+  def test_two_rows(self):
+    e = parse("(T.a = U.a) and (U.c > b)")
+    f = compile_expr(e)
+    for row in rows:
+      for row2 in (U((row[0], 1)), U((row[0] + 1, 0))):
+        self.assertEqual(f(row, row2), e(row, row2))
+    self.assertEqual(compile_expr(Attr("a", "U"))(rows[1], U((7, 0))), 7)
+
+  def test_list(self):
+    f = compile_expr([Attr("b"), Star(), parse("a + 1")])
+    self.assertEqual(f(rows[4]), (1, 4, 1, "s0", 5))
+    self.assertEqual(compile_expr([])(rows[0]), ())
+
+  def test_aggregate(self):
+    group = GroupBy(Scan("t"), ["b"]).group_row(rows[0], (0,), rows)
+    for s in ["count(1)", "sum(a)", "avg(a * 2)"]:
+      self.assertEqual(compile_expr(parse(s))(group), parse(s)(group))
+    self.assertRaises(Exception, compile_expr(parse("sum(a)")), rows[0])
+
+  def test_replaced_cond(self):
+    f = Filter(None, "a < 3")
+    self.assertEqual(len(filter(f.compiled(f.cond), rows)), 3)
+    f.cond = parse("a < 5")
+    self.assertEqual(len(filter(f.compiled(f.cond), rows)), 5)
+
+
+if __name__ == '__main__':
+  unittest.main()
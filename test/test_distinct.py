@@ -0,0 +1,85 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import *
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+
+
+class TestDistinct(unittest.TestCase):
+
+  def run_all(self, plan):
+    rows = list(PullBasedInterpretor(db)(plan))
+    push = []
+    PushBasedInterpretor(db)(plan, push.append)
+    self.assertEqual(rows, push)
+    self.assertEqual(rows, list(BatchInterpretor(db, batchsize=7)(plan)))
+    self.assertEqual(rows, list(QueryCompiler(db)(plan)))
+    return rows
+
+  def test_keys(self):
+    self.assertEqual(distinct_key({"a": 1, "b": 2}), distinct_key({"b": 2, "a": 1}))
+    self.assertEqual(distinct_key([1, [2]]), (1, repr([2])))
+
+  def test_distinct(self):
+    for attrs in [["b"], ["a", "b"], ["c", "e"]]:
+      rows = self.run_all(Distinct(Project(Scan("data"), attrs)))
+      scan = Scan("data")
+      scan.set_db(db)
+      truth = []
+      for row in scan:
+        vals = tuple(row[a] for a in attrs)
+        if vals not in truth:
+          truth.append(vals)
+      self.assertEqual([tuple(row) for row in rows], truth)
+
+  def test_unhashable(self):
+    # the group column holds the group's rows, in a list (or a Batch in
+    # the batch interpretor), which can't be hashed
+    def values(rows):
+      return [tuple(row)[:-1] + (map(tuple, row["__group__"]),) for row in rows]
+
+    plan = Distinct(GroupBy(Scan("data", "A"), [Attr("a", "A")]))
+    for max_rows in [None, 3]:
+      plan.max_rows = max_rows
+      rows = list(PullBasedInterpretor(db)(plan))
+      self.assertEqual(len(rows), len(db["data"]))
+      push = []
+      PushBasedInterpretor(db)(plan, push.append)
+      self.assertEqual(push, rows)
+      self.assertEqual(values(BatchInterpretor(db, batchsize=7)(plan)), values(rows))
+      self.assertEqual(list(QueryCompiler(db)(plan)), rows)
+
+  def test_sort_fallback(self):
+    plan = Distinct(Project(Scan("data"), ["b", "c"]))
+    truth = self.run_all(plan)
+    for max_rows in [1, 2, 5]:
+      plan.max_rows = max_rows
+      rows = list(PullBasedInterpretor(db)(plan))
+      # the rows that fit in memory are output first, in input order
+      self.assertEqual(rows[:max_rows], truth[:max_rows])
+      self.assertEqual(sorted(rows), sorted(truth))
+      push = []
+      PushBasedInterpretor(db)(plan, push.append)
+      self.assertEqual(push, rows)
+      self.assertEqual(list(BatchInterpretor(db, batchsize=3)(plan)), rows)
+      self.assertEqual(list(QueryCompiler(db)(plan)), rows)
+      plan2 = Limit(plan, 3)
+      self.assertEqual(list(QueryCompiler(db)(plan2)), rows[:3])
+
+  def test_push_stops(self):
+    # blocking operators stop passing rows on once f returns False
+    plans = [Distinct(Project(Scan("data"), ["b", "c"]), max_rows=1),
+             OrderBy(Scan("data"), ["b"]),
+             TopK(Scan("data"), ["b"], ["asc"], 5),
+             GroupBy(Scan("data"), ["a"])]
+    for plan in plans:
+      rows = []
+      PushBasedInterpretor(db)(plan, lambda row: rows.append(row) or False)
+      self.assertEqual(len(rows), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
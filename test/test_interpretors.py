@@ -0,0 +1,109 @@
+import unittest
+
+import pandas
+
+from databass.db import Database, Table
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+
+db = Database()
+opt = Optimizer(db)
+
+
+class TestInterpretors(unittest.TestCase):
+  """The interpretors should return the same rows for the same plan"""
+
+  def run_pull(self, q):
+    return list(PullBasedInterpretor(db)(opt(parse(q))))
+
+  def run_push(self, q):
+    rows = []
+    PushBasedInterpretor(db)(opt(parse(q)), rows.append)
+    return rows
+
+  def run_batch(self, q, batchsize=4096):
+    return list(BatchInterpretor(db, batchsize)(opt(parse(q))))
+
+  def check(self, q):
+    truth = self.run_pull(q)
+    self.assertEqual(truth, self.run_push(q))
+    self.assertEqual(truth, self.run_batch(q))
+    self.assertEqual(truth, self.run_batch(q, batchsize=3))
+    return truth
+
+  def test_filter_project(self):
+    rows = self.check("SELECT a * 2 AS x, lower(e) AS l FROM data WHERE a BETWEEN 3 AND 6")
+    self.assertEqual(len(rows), 4)
+    self.check("SELECT * FROM data WHERE a > 15 AND b < 18")
+
+  def test_no_from(self):
+    self.assertEqual(self.check("SELECT 1"), [{'attr0': 1.0}])
+
+  def test_limit(self):
+    self.assertEqual(len(self.check("SELECT * FROM data LIMIT 7")), 7)
+
+  def test_groupby(self):
+    self.check("SELECT a, count(1) AS c, avg(b) AS x, sum(b) AS s FROM data GROUP BY a")
+    self.check("SELECT STORE, count(1) AS n FROM `iowa-liquor-sample` GROUP BY STORE")
+
+  def test_join(self):
+    self.check("SELECT a, m FROM data, data2 WHERE a = m")
+    self.check("""SELECT x, avg(b) AS avg, count(1) AS count
+                  FROM data AS t, (SELECT a AS x, b AS y, c AS z FROM data) AS s
+                  WHERE c = z GROUP BY x""")
+
+  def test_self_join(self):
+    # the rows keep both tables' columns, even with the same names
+    rows = self.check("SELECT A.a, B.a AS ba FROM data AS A, data AS B WHERE A.b = B.c")
+    self.assertTrue(any(row["a"] != row["ba"] for row in rows))
+    rows = self.check("SELECT * FROM data AS A, data AS B WHERE A.a = B.b")
+    self.assertEqual(rows[0].keys(), db["data"].fields * 2)
+
+
+class TestDictionaryEncoding(unittest.TestCase):
+  """String columns are dictionary encoded, and compared on their codes"""
+
+  def run_both(self, plan):
+    # groups are not output in a particular order
+    key = lambda row: sorted(row.items())
+    truth = sorted(PullBasedInterpretor(db)(plan), key=key)
+    self.assertEqual(sorted(BatchInterpretor(db, 100)(plan), key=key), truth)
+    return truth
+
+  def test_encoded(self):
+    table = db["iowa-liquor-sample"]
+    self.assertTrue("CITY" in table.dicts)
+    self.assertFalse("STORE" in table.dicts)
+    self.assertTrue(table.columns["CITY"].dtype.kind == "i")
+    self.assertEqual(table.type("CITY"), "str")
+    rows = list(table)
+    self.assertTrue(all(isinstance(row["CITY"], str) for row in rows))
+
+  def test_filter(self):
+    scan = Scan("iowa-liquor-sample")
+    rows = self.run_both(Filter(scan, Expr("=", Attr("CITY"), Literal("WATERLOO"))))
+    self.assertTrue(len(rows) > 0)
+    self.assertTrue(all(row["CITY"] == "WATERLOO" for row in rows))
+    self.run_both(Filter(Scan("iowa-liquor-sample"), 
+                         Expr("<>", Attr("CITY"), Literal("WATERLOO"))))
+    self.assertEqual(self.run_both(Filter(Scan("iowa-liquor-sample"), 
+                         Expr("=", Attr("CITY"), Literal("NOWHERE")))), [])
+
+  def test_groupby_join(self):
+    self.run_both(opt(parse("""SELECT CITY, COUNTY, count(1) AS n 
+                               FROM `iowa-liquor-sample` GROUP BY CITY, COUNTY""")))
+    # join two tables with different dictionaries for the key
+    cities = Table.from_dataframe(pandas.DataFrame(dict(
+      CITY=["WATERLOO", "CARROLL", "NOWHERE"] * 3, ID=range(9))), columnar=True)
+    db.register_table("cities", cities)
+    self.assertTrue("CITY" in cities.dicts)
+    plan = HashJoin(Scan("cities"), Scan("iowa-liquor-sample"), ["CITY", "CITY"])
+    self.assertTrue(len(self.run_both(plan)) > 0)
+    plan = HashJoin(Scan("iowa-liquor-sample"), Scan("cities"), ["CITY", "CITY"])
+    self.assertTrue(len(self.run_both(plan)) > 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+
+from databass.db import Database, Table
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+db.register_table("small", Table.from_rows([dict(s=i % 3, t=i) for i in range(6)]))
+db.register_table("small2", Table.from_rows([dict(u=i % 3, v=i) for i in range(9)]))
+
+
+class Counter(UnaryOp):
+  """Passes its child's rows through and counts them"""
+  def __init__(self, c):
+    super(Counter, self).__init__(c)
+    self.count = 0
+
+  def __iter__(self):
+    for row in self.c:
+      self.count += 1
+      yield row
+
+
+def run(plan):
+  return list(PullBasedInterpretor(db)(plan))
+
+def key(row):
+  return sorted(row.items())
+
+
+class TestHashJoin(unittest.TestCase):
+  """Pull-based hash join"""
+
+  def test_same_as_thetajoin(self):
+    truth = run(ThetaJoin(Scan("data"), Scan("data2"), "a = m"))
+    results = run(HashJoin(Scan("data"), Scan("data2"), ["a", "m"]))
+    self.assertEqual(sorted(map(key, results)), sorted(map(key, truth)))
+
+  def test_composite_keys(self):
+    truth = run(ThetaJoin(Scan("data"), Scan("data2"), "(a = m) and (b = n)"))
+    join = HashJoin(Scan("data"), Scan("data2"), [["a", "b"], ["m", "n"]])
+    results = run(join)
+    self.assertTrue(len(results) > 0)
+    self.assertEqual(sorted(map(key, results)), sorted(map(key, truth)))
+
+    rows = []
+    PushBasedInterpretor(db)(join, rows.append)
+    self.assertEqual(sorted(map(key, rows)), sorted(map(key, truth)))
+    rows = list(BatchInterpretor(db)(join))
+    self.assertEqual(sorted(map(key, rows)), sorted(map(key, truth)))
+
+  def test_build_side(self):
+    join = HashJoin(Scan("data"), Scan("small"), ["a", "s"])
+    run(join)
+    self.assertEqual(join.build_side(), "right")
+    join = HashJoin(Scan("small"), Scan("data"), ["s", "a"])
+    run(join)
+    self.assertEqual(join.build_side(), "left")
+    self.assertEqual(len(run(join)), 6)
+    # the compiler's Scans don't have a database
+    join = HashJoin(Scan("small"), Scan("data"), ["s", "a"])
+    self.assertEqual(join.build_side(db), "left")
+
+    # every engine builds on the left, and keeps the left columns first
+    truth = run(join)
+    rows = []
+    PushBasedInterpretor(db)(join, rows.append)
+    self.assertEqual(sorted(rows), sorted(truth))
+    self.assertEqual(sorted(BatchInterpretor(db, 4)(join)), sorted(truth))
+    self.assertEqual(sorted(QueryCompiler(db)(join)), sorted(truth))
+    self.assertEqual(truth[0].keys()[:2], ["s", "t"])
+
+  def test_limit_stops_early(self):
+    probe = Counter(Scan("data"))
+    run(Limit(HashJoin(probe, Scan("small"), ["a", "s"]), 2))
+    self.assertTrue(probe.count < len(db["data"]))
+
+  def test_to_str(self):
+    join = HashJoin(Scan("data"), Scan("data2"), [["a", "c"], ["m", "o"]])
+    self.assertEqual(join.to_str(), "HASHJOIN(ON a = m and c = o)")
+
+
+
+class TestSortMergeJoin(unittest.TestCase):
+
+  def run_all(self, join):
+    """
+    Runs @join with every interpretor, and returns the rows after
+    checking that they are the same and in the same order
+    """
+    rows = run(join)
+    push = []
+    PushBasedInterpretor(db)(join, push.append)
+    self.assertEqual(push, rows)
+    self.assertEqual(list(BatchInterpretor(db, batchsize=7)(join)), rows)
+    self.assertEqual(list(QueryCompiler(db)(join)), rows)
+    return rows
+
+  def test_same_as_thetajoin(self):
+    for attrs, cond in [(["a", "m"], "a = m"), (["b", "n"], "b = n"),
+                        ([["a", "b"], ["m", "n"]], "(a = m) and (b = n)")]:
+      truth = run(ThetaJoin(Scan("data"), Scan("data2"), cond))
+      for max_rows in [None, 1, 3]:
+        join = SortMergeJoin(Scan("data"), Scan("data2"), attrs, max_rows=max_rows)
+        rows = self.run_all(join)
+        self.assertEqual(sorted(map(key, rows)), sorted(map(key, truth)))
+
+  def test_duplicates(self):
+    # each key appears twice on the left and three times on the right
+    rows = self.run_all(SortMergeJoin(Scan("small"), Scan("small2"), ["s", "u"]))
+    self.assertEqual(len(rows), 18)
+    self.assertEqual([r["s"] for r in rows], sorted(r["u"] for r in rows))
+
+  def test_presorted(self):
+    truth = run(SortMergeJoin(Scan("data"), Scan("data2"), ["a", "m"]))
+    join = SortMergeJoin(Scan("data"), Scan("data2"), ["a", "m"], (True, True))
+    self.assertEqual(self.run_all(join), truth)
+    self.assertEqual(join.to_str(), "SORTMERGEJOIN(ON a = m)")
+
+  def test_merge(self):
+    left = [(1, "a"), (2, "b"), (2, "c"), (4, "d")]
+    right = [(0, "w"), (2, "x"), (2, "y"), (3, "z"), (4, "v")]
+    self.assertEqual(list(merge_join(left, right)),
+        [("b", "x"), ("b", "y"), ("c", "x"), ("c", "y"), ("d", "v")])
+    self.assertEqual(list(merge_join(left, [])), [])
+
+  def test_planning(self):
+    q = "SELECT a, n FROM data AS A, data2 AS B WHERE A.b = B.n"
+    truth = sorted(map(key, run(Optimizer(db)(parse(q)))))
+    # the inputs aren't sorted on b and n, and are small enough to hash
+    self.assertEqual(len(Optimizer(db)(parse(q)).collect(HashJoin)), 1)
+    plan = Optimizer(db, hash_join_rows=5)(parse(q))
+    join = plan.collectone(SortMergeJoin)
+    self.assertEqual((join.lsorted, join.rsorted), (False, False))
+    self.assertEqual(sorted(map(key, run(plan))), truth)
+
+    opt = Optimizer(db)
+    self.assertTrue(opt.sorted_on(Scan("data", "A"), [Attr("a", tablename="A")]))
+    self.assertFalse(opt.sorted_on(Scan("data", "A"), [Attr("b", tablename="A")]))
+    self.assertFalse(opt.sorted_on(Scan("data", "A"), [Attr("a", tablename="B")]))
+
+
+class TestJoinPlanning(unittest.TestCase):
+  """The optimizer turns equi-joins into hash or sort-merge joins"""
+
+  def plan(self, q):
+    return Optimizer(db)(parse(q))
+
+  def test_equijoin(self):
+    plan = self.plan("SELECT a, n FROM data AS A, data2 AS B WHERE A.a = B.m")
+    # data.a and data2.m are already sorted
+    self.assertEqual(len(plan.collect(SortMergeJoin)), 1)
+    self.assertEqual(len(plan.collect(ThetaJoin)), 0)
+    self.assertEqual(len(plan.collect(Filter)), 0)
+    truth = run(ThetaJoin(Scan("data"), Scan("data2"), "a = m"))
+    results = run(plan)
+    self.assertEqual(sorted(map(key, results)), 
+                     sorted([[("a", r["a"]), ("n", r["n"])] for r in truth]))
+
+  def test_residual(self):
+    plan = self.plan("""SELECT a, n FROM data AS A, data2 AS B 
+                         WHERE A.a = B.m AND A.b < B.o AND A.c = 1""")
+    join = plan.collectone(EquiJoin)
+    self.assertEqual(join.to_str(), "SORTMERGEJOIN(ON A.a = B.m)")
+    self.assertEqual(join.p.to_str(), "WHERE(A.b < B.o)")
+    self.assertEqual(join.p.p.to_str(), "WHERE(A.c = 1.0)")
+    truth = ThetaJoin(Scan("data"), Scan("data2"), "(a = m) and (b < o)")
+    truth = run(Filter(truth, "c = 1"))
+    self.assertEqual(len(run(plan)), len(truth))
+
+  def test_theta(self):
+    plan = self.plan("SELECT a, n FROM data AS A, data2 AS B WHERE A.a < B.m")
+    self.assertEqual(len(plan.collect(EquiJoin)), 0)
+    self.assertEqual(plan.collectone(ThetaJoin).to_str(), "THETAJOIN(ON A.a < B.m)")
+    self.assertEqual(len(run(plan)), 190)
+
+  def test_multiway(self):
+    plan = self.plan("""SELECT a, n, t FROM data AS A, data2 AS B, data3 AS C
+                         WHERE A.a = B.m AND B.n = C.t AND A.b = C.u""")
+    joins = plan.collect(EquiJoin)
+    self.assertEqual(len(joins), 2)
+    self.assertEqual(len(plan.collect(ThetaJoin)), 0)
+    self.assertEqual(sum(len(j.lattrs) for j in joins), 3)
+    self.assertEqual(len(run(plan)), 20)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer, SelingerOpt
+
+db = Database()
+
+
+def chain(n):
+  """n self-joins of data, connected by a chain of equality predicates"""
+  sources = [Scan("data", "T%d" % i) for i in range(n)]
+  preds = [cond_to_func("T%d.a = T%d.a" % (i, i+1)) for i in range(n-1)]
+  return sources, preds
+
+
+class TestSelinger(unittest.TestCase):
+
+  def test_single_table(self):
+    sources, preds = chain(1)
+    opt = SelingerOpt(db)
+    self.assertTrue(opt(preds, sources) is sources[0])
+    self.assertEqual(opt.plans_tested, 0)
+
+  def test_left_deep(self):
+    sources, preds = chain(5)
+    opt = SelingerOpt(db)
+    plan = opt(preds, sources)
+    self.assertEqual(len(plan.collect(Scan)), 5)
+    for join in plan.collect(ThetaJoin):
+      self.assertTrue(join.r.is_type(Scan))
+      self.assertFalse(join.cond.is_type(Bool))
+      self.assertTrue(join.l.p is join and join.r.p is join)
+    # 5 choices of inner table for each of the 2^5 - 5 - 1 multi-table subsets
+    self.assertEqual(opt.plans_tested, 10*2 + 10*3 + 5*4 + 1*5)
+    self.assertTrue(opt.opt_time >= 0)
+
+  def test_bushy(self):
+    sources, preds = chain(5)
+    opt = SelingerOpt(db, bushy=True)
+    plan = opt(preds, sources)
+    self.assertEqual(len(plan.collect(Scan)), 5)
+    # every ordered split of every multi-table subset: 3^5 - 2^6 + 1
+    self.assertEqual(opt.plans_tested, 180)
+
+    left = SelingerOpt(db)
+    self.assertTrue(opt.cost(plan) <= left.cost(left(*chain(5)[::-1])))
+
+  def test_greedy_fallback(self):
+    sources, preds = chain(14)
+    opt = SelingerOpt(db, max_dp_tables=12)
+    plan = opt(preds, sources)
+    self.assertEqual(len(plan.collect(Scan)), 14)
+    self.assertTrue(opt.plans_tested < 14**3)
+    for join in plan.collect(ThetaJoin):
+      self.assertTrue(join.l.p is join and join.r.p is join)
+
+  def test_optimizer_stats(self):
+    opt = Optimizer(db)
+    q = Filter(From([Scan("data", "A"), Scan("data2", "B"), Scan("data3", "C")]),
+               cond_to_func("(A.a = B.m) and (B.n = C.t)"))
+    opt(q)
+    # 3 two-table subsets with 2 splits each, and 3 splits of all three
+    self.assertEqual(opt.plans_tested, 9)
+    self.assertTrue(opt.opt_time >= 0)
+    opt(Scan("data"))
+    self.assertEqual(opt.plans_tested, 0)
+
+  def test_equi_join_cost(self):
+    # candidates are costed like the joins that physical_plan() picks
+    join = ThetaJoin(Scan("data", "A"), Scan("data", "B"), cond_to_func("A.a = B.a"))
+    nested = SelingerOpt(db)
+    equi = SelingerOpt(db, equi_join_cost=Optimizer(db).equi_join_cost)
+    self.assertTrue(equi.cost(join) < nested.cost(join))
+    cross = ThetaJoin(Scan("data", "A"), Scan("data", "B"), Bool(True))
+    self.assertEqual(equi.cost(cross), nested.cost(cross))
+
+  def test_equality_under_or(self):
+    # an equality inside an OR is not a join predicate
+    for bushy in (False, True):
+      q = Filter(From([Scan("data", "A"), Scan("data", "B")]),
+                 cond_to_func("(A.a = B.b) or (A.a = 1)"))
+      plan = Optimizer(db, bushy=bushy)(q)
+      self.assertEqual(plan.collect(HashJoin) + plan.collect(SortMergeJoin), [])
+      truth = Filter(ThetaJoin(Scan("data", "A"), Scan("data", "B")),
+                     cond_to_func("(A.a = B.b) or (A.a = 1)"))
+      # the plan may join the tables in either order
+      attrs = [Attr(f, t) for t in "AB" for f in db["data"].fields]
+      key = lambda row: tuple(attr(row) for attr in attrs)
+      self.assertEqual(sorted(map(key, PullBasedInterpretor(db)(plan))),
+                       sorted(map(key, PullBasedInterpretor(db)(truth))))
+
+  def test_same_results(self):
+    results = []
+    for bushy in (False, True):
+      q = Filter(From([Scan("data", "A"), Scan("data2", "B"), Scan("data3", "C")]),
+                 cond_to_func("(A.a = B.m) and (B.n = C.t)"))
+      plan = Optimizer(db, bushy=bushy)(q)
+      # the plans order the tables' columns differently, and the tables
+      # don't share column names, so compare the rows as dicts
+      results.append(sorted(map(str, map(dict, PullBasedInterpretor(db)(plan)))))
+    self.assertEqual(results[0], results[1])
+    self.assertEqual(len(results[0]), 20)
+
+if __name__ == '__main__':
+  unittest.main()
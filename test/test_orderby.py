@@ -0,0 +1,53 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+
+
+class TestOrderBy(unittest.TestCase):
+
+  def run_all(self, plan):
+    """
+    Returns the rows of @plan, after checking that all the interpretors
+    return the same rows in the same order
+    """
+    plan = Optimizer(db)(plan)
+    rows = list(PullBasedInterpretor(db)(plan))
+    push = []
+    PushBasedInterpretor(db)(plan, push.append)
+    self.assertEqual(rows, push)
+    self.assertEqual(rows, list(BatchInterpretor(db, batchsize=7)(plan)))
+    self.assertEqual(rows, list(QueryCompiler(db)(plan)))
+    return rows
+
+  def test_ascdesc(self):
+    self.assertEqual(OrderBy(None, ["a", "b"]).ascdesc, ["asc", "asc"])
+    self.assertEqual(OrderBy(None, ["a", "b"], ([], "DESC")).ascdesc, ["asc", "desc"])
+    self.assertEqual(parse("SELECT a FROM data ORDER BY a, b desc").collectone("OrderBy").ascdesc,
+                     ["asc", "desc"])
+
+    rows = self.run_all(parse("SELECT a, b, c FROM data ORDER BY b DESC, a, c * 2 DESC"))
+    keys = [(-row["b"], row["a"], -row["c"]) for row in rows]
+    self.assertEqual(keys, sorted(keys))
+    self.assertEqual(len(rows), len(db["data"]))
+
+    rows = self.run_all(parse("SELECT a, e FROM data ORDER BY e"))
+    self.assertEqual(rows, sorted(rows, key=lambda row: row["e"]))
+
+  def test_external(self):
+    plan = parse("SELECT a, b, d FROM data ORDER BY b DESC, a")
+    truth = self.run_all(plan)
+    for max_rows in [1, 2, 7, 1000]:
+      plan.collectone("OrderBy").max_rows = max_rows
+      # rows with the same key stay in input order
+      self.assertEqual(self.run_all(plan), truth)
+
+
+if __name__ == '__main__':
+  unittest.main()
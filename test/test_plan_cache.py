@@ -0,0 +1,67 @@
+import unittest
+
+from databass.db import Database, Table
+from databass.interpretor import PullBasedInterpretor
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.plan_cache import PlanCache, normalize
+
+db = Database()
+
+
+class TestPlanCache(unittest.TestCase):
+
+  def run_pull(self, q):
+    return list(PullBasedInterpretor(db)(Optimizer(db)(parse(q))))
+
+  def test_normalize(self):
+    key, values = normalize("SELECT a,  t1.b FROM `data-2` AS t1\n WHERE b < 10.5 AND e = 'x 1'")
+    self.assertEqual(key, "SELECT a, t1.b FROM `data-2` AS t1 WHERE b < ? AND e = ?")
+    self.assertEqual(values, [10.5, "'x 1'"])
+    self.assertEqual(normalize("SELECT a FROM data WHERE b < 3")[0],
+                     normalize("SELECT a FROM data WHERE b < 4")[0])
+
+  def test_hits(self):
+    cache = PlanCache(db)
+    qs = ["SELECT a, m FROM data, data2 WHERE a = m AND b < %d LIMIT %d" % (b, l)
+          for b, l in [(4, 10), (7, 3), (19, 20)]]
+    for q in qs:
+      self.assertEqual(list(cache(q)), self.run_pull(q))
+    self.assertEqual((cache.hits, cache.misses, len(cache)), (2, 1, 1))
+
+  def test_new_literals(self):
+    # a hit runs the cached plan with the new query's literals
+    cache = PlanCache(db)
+    results = []
+    for q in ["SELECT a, b FROM data WHERE a < 3 AND b > 0",
+              "SELECT a, b FROM data WHERE a < 9 AND b > 2"]:
+      results.append(list(cache(q)))
+      self.assertEqual(results[-1], self.run_pull(q))
+    self.assertTrue(results[0] and results[1])
+    self.assertNotEqual(results[0], results[1])
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+  def test_lru(self):
+    cache = PlanCache(db, capacity=2)
+    for q in ["SELECT a FROM data", "SELECT b FROM data", "SELECT a FROM data",
+              "SELECT c FROM data", "SELECT b FROM data"]:
+      list(cache(q))
+    self.assertEqual(cache.evictions, 2)
+    self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+  def test_invalidate(self):
+    db2 = Database()
+    cache = PlanCache(db2)
+    q = "SELECT a FROM data WHERE a < 5"
+    list(cache(q))
+    db2["data"].clear_stats()
+    self.assertEqual(len(list(cache(q))), 5)
+    self.assertEqual((cache.invalidations, cache.misses), (1, 2))
+
+    db2.register_table("data", Table.from_rows(db2["data"].rows[:3]))
+    self.assertEqual(len(list(cache(q))), 3)
+    self.assertEqual(cache.invalidations, 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
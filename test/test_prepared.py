@@ -0,0 +1,50 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import Param
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+
+
+class TestPrepared(unittest.TestCase):
+
+  def run_pull(self, q):
+    return list(PullBasedInterpretor(db)(Optimizer(db)(parse(q))))
+
+  def test_parse_placeholders(self):
+    plan = parse("SELECT a FROM data WHERE a < :x AND b > :y AND c < :x")
+    params = plan.collect(Param)
+    self.assertEqual(sorted((p.name, p.slot) for p in params),
+                     [("x", 0), ("x", 0), ("y", 1)])
+    self.assertEqual(len(set(id(p.params) for p in params)), 1)
+
+    plan = parse("SELECT a + ? FROM data WHERE a < ? LIMIT ?")
+    self.assertEqual(sorted(p.slot for p in plan.collect(Param)), [0, 1, 2])
+    self.assertRaises(Exception, parse, "SELECT a FROM data WHERE a < ? AND b < :x")
+
+  def test_interpretors(self):
+    stmt = db.prepare("SELECT a, m FROM data, data2 WHERE a = m AND b < ? LIMIT ?")
+    interps = [PullBasedInterpretor(db), PushBasedInterpretor(db),
+               BatchInterpretor(db), QueryCompiler(db)]
+    for b, n in [(5, 10), (12, 3), (20, 0)]:
+      truth = self.run_pull(
+          "SELECT a, m FROM data, data2 WHERE a = m AND b < %d LIMIT %d" % (b, n))
+      stmt.bind(b, n)
+      for interp in interps:
+        self.assertEqual(stmt.run(interp), truth)
+
+  def test_named(self):
+    stmt = db.prepare("SELECT a FROM data WHERE a < :hi AND a > :lo")
+    self.assertEqual(stmt(lo=2, hi=6), self.run_pull(
+        "SELECT a FROM data WHERE a < 6 AND a > 2"))
+    self.assertRaises(Exception, stmt, 2, 6)
+    self.assertRaises(Exception, stmt, lo=2)
+    self.assertRaises(Exception, db.prepare("SELECT a FROM data WHERE a < ?").run)
+
+
+if __name__ == '__main__':
+  unittest.main()
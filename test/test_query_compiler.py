@@ -0,0 +1,69 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+opt = Optimizer(db)
+
+
+class TestQueryCompiler(unittest.TestCase):
+  """Compiled plans should return the same rows as the pull interpretor"""
+
+  def check(self, plan):
+    truth = list(PullBasedInterpretor(db)(plan))
+    self.assertEqual(list(QueryCompiler(db)(plan)), truth)
+    return truth
+
+  def check_sql(self, q):
+    return self.check(opt(parse(q)))
+
+  def test_queries(self):
+    self.check_sql("SELECT a * 2 AS x, lower(e) AS l FROM data WHERE a BETWEEN 3 AND 6")
+    self.check_sql("SELECT * FROM data WHERE a > 15 AND b < 18")
+    self.assertEqual(self.check_sql("SELECT 1"), [{'attr0': 1.0}])
+    self.check_sql("SELECT a, count(1) AS c, avg(b) AS x, sum(b) AS s FROM data GROUP BY a")
+    self.check_sql("""SELECT x, avg(b) AS avg, count(1) AS count
+                      FROM data AS t, (SELECT a AS x, b AS y, c AS z FROM data) AS s
+                      WHERE c = z GROUP BY x""")
+
+  def test_joins(self):
+    rows = self.check(HashJoin(Scan("data", "A"), Scan("data", "B"), ["a", "b"]))
+    self.assertTrue(len(rows) > 0)
+    self.check(HashJoin(Scan("iowa-liquor-sample"), Scan("data"), ["STORE", "a"]))
+    self.check(ThetaJoin(Scan("data", "A"), Scan("data", "B"), "(A.a = B.b) and (B.c = 0)"))
+
+  def test_limit_distinct(self):
+    self.assertEqual(len(self.check_sql("SELECT * FROM data LIMIT 7")), 7)
+    self.assertEqual(len(self.check(Limit(Scan("data"), 0))), 0)
+    # the limit stops all of the join's loops
+    plan = Limit(ThetaJoin(Scan("data", "A"), Scan("data2", "B")), 3)
+    self.assertEqual(len(self.check(plan)), 3)
+    self.check(Distinct(Project(Scan("data"), ["b"])))
+
+  def test_orderby(self):
+    plan = OrderBy(Scan("data"), ["b", "a"], ["desc", "asc"])
+    rows = list(QueryCompiler(db)(plan))
+    keys = [(-row["b"], row["a"]) for row in rows]
+    self.assertEqual(keys, sorted(keys))
+    self.assertEqual(len(rows), len(db["data"]))
+
+  def test_deep_pipeline(self):
+    # more nested loops than python allows in one function
+    plan = Scan("data", "T0")
+    for i in range(1, 22):
+      plan = HashJoin(plan, Scan("data", "T%d" % i), ["T0.a", "T%d.a" % i])
+    plan = Project(Filter(plan, "T0.a < 3"), ["T0.a", "T21.b"])
+    self.assertTrue(len(self.check(plan)) > 0)
+    self.assertTrue("def " in QueryCompiler(db).compile_to_code(plan).split("\n", 1)[1])
+
+  def test_unoptimized(self):
+    self.assertRaises(Exception, QueryCompiler(db).compile, parse("SELECT a FROM data"))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+import pickle
+import unittest
+
+from databass.db import Database, Schema, Row
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_expr import parse as parse_expr
+from databass.parse_sql import parse as parse_sql
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+
+
+class TestRows(unittest.TestCase):
+
+  def test_row(self):
+    row = Schema.get(["a", "b"], "T").row_class((1, "x"))
+    self.assertEqual(row["a"], 1)
+    self.assertEqual(row[1], "x")
+    self.assertEqual(row, {"a": 1, "b": "x"})
+    self.assertEqual(row.get("c"), None)
+    self.assertTrue("b" in row and "c" not in row)
+    self.assertEqual(dict(row), {"a": 1, "b": "x"})
+    self.assertEqual(pickle.loads(pickle.dumps(row, 2)), row)
+    self.assertTrue(type(row) is Schema.get(("a", "b"), ("T", "T")).row_class)
+
+  def test_row_equality(self):
+    ab = Schema.get(["a", "b"], "T")
+    row = ab.row_class((1, 2))
+    # rows are equal if their fields and values are, whatever the tables
+    self.assertEqual(row, Schema.get(["a", "b"], "S").row_class((1, 2)))
+    self.assertEqual(hash(row), hash(Schema.get(["a", "b"]).row_class((1, 2))))
+    self.assertNotEqual(row, ab.row_class((1, 3)))
+    self.assertNotEqual(row, Schema.get(["b", "a"], "T").row_class((1, 2)))
+    self.assertNotEqual(row, (1, 2))
+    self.assertFalse(row != {"a": 1, "b": 2})
+
+    # columns with the same name are compared by position
+    aa = Schema.get(["a", "a"], ["A", "B"])
+    self.assertEqual(aa.row_class((1, 2)), aa.row_class((1, 2)))
+    self.assertNotEqual(aa.row_class((1, 2)), aa.row_class((2, 1)))
+    self.assertNotEqual(aa.row_class((1, 2)), Schema.get(["a"]).row_class((2,)))
+
+  def test_duplicate_name_join(self):
+    plan = Optimizer(db)(parse_sql("SELECT * FROM data AS A, data AS B WHERE A.a = B.b"))
+    n = len(db["data"].fields)
+    truth = list(PullBasedInterpretor(db)(plan))
+    push = []
+    PushBasedInterpretor(db)(plan, push.append)
+    for rows in (truth, push, list(BatchInterpretor(db, 7)(plan)), list(QueryCompiler(db)(plan))):
+      self.assertEqual(sorted(rows), sorted(truth))
+      for row in rows:
+        self.assertEqual(row.keys(), db["data"].fields * 2)
+        # A's columns come first, then B's
+        self.assertEqual(row[db["data"].fields.index("a")], row[n + db["data"].fields.index("b")])
+
+  def test_duplicate_columns(self):
+    plan = ThetaJoin(Scan("data", "A"), Scan("data", "B"),
+                     parse_expr("(A.a = B.b) and (B.c = 0)"))
+    for interp in ("pull", "push", "batch"):
+      if interp == "pull":
+        rows = list(PullBasedInterpretor(db)(plan))
+      elif interp == "push":
+        rows = []
+        PushBasedInterpretor(db)(plan, rows.append)
+      else:
+        rows = list(BatchInterpretor(db, 7)(plan))
+      self.assertTrue(len(rows) > 0)
+      for row in rows:
+        # both tables' columns are kept
+        self.assertEqual(len(row), 2 * len(db["data"].fields))
+        self.assertEqual(Attr("a", "A")(row), Attr("b", "B")(row))
+        self.assertEqual(Attr("c", "B")(row), 0)
+        self.assertEqual(row["a"], Attr("a", "B")(row))
+
+  def test_batch_self_join(self):
+    # qualified attributes read their own table's column in batches too
+    q = parse_sql("SELECT A.a, B.a AS ba FROM data AS A, data AS B WHERE A.b = B.c")
+    plan = Optimizer(db)(q)
+    truth = list(PullBasedInterpretor(db)(plan))
+    self.assertTrue(any(row["a"] != row["ba"] for row in truth))
+    self.assertEqual(sorted(BatchInterpretor(db, 7)(plan)), sorted(truth))
+
+    plan = Optimizer(db)(parse_sql("SELECT * FROM data AS A, data AS B WHERE A.a = B.b"))
+    truth = list(PullBasedInterpretor(db)(plan))
+    rows = list(BatchInterpretor(db, 7)(plan))
+    self.assertEqual(len(rows[0]), 2 * len(db["data"].fields))
+    self.assertEqual(sorted(rows), sorted(truth))
+
+  def test_project(self):
+    plan = Project(ThetaJoin(Scan("data", "A"), Scan("data2", "B")),
+                   [Attr("a", "A"), Star(), Expr("+", Attr("a"), Literal(1))],
+                   ["x", None, "a"])
+    row = next(iter(PullBasedInterpretor(db)(plan)))
+    fields = db["data"].fields + db["data2"].fields
+    self.assertEqual(row.keys(), ["x"] + fields)
+    self.assertEqual(row["a"], row["x"] + 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
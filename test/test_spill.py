@@ -0,0 +1,62 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.query_compiler import QueryCompiler
+from databass.spill import SpillFile
+
+db = Database()
+
+
+class TestSpill(unittest.TestCase):
+
+  def test_spill_file(self):
+    f = SpillFile(chunksize=3)
+    scan = Scan("data")
+    scan.set_db(db)
+    rows = list(scan)
+    for row in rows:
+      f.append(row)
+    self.assertEqual(len(f), len(rows))
+    self.assertEqual(list(f), rows)
+    self.assertEqual(list(f)[0].schema, rows[0].schema)
+    f.close()
+
+  def test_groupby(self):
+    queries = [
+      "SELECT a, b, count(1) AS c, sum(c) AS s, avg(d) AS x FROM data GROUP BY a, b",
+      "SELECT a, count(1) AS n FROM data GROUP BY a, b, c",
+      "SELECT a, b, __group__ FROM data GROUP BY a, b",
+    ]
+    for q in queries:
+      plan = Optimizer(db)(parse(q))
+      truth = sorted(PullBasedInterpretor(db)(plan))
+
+      for max_groups in [1, 2, 5]:
+        plan.collectone("GroupBy").max_groups = max_groups
+        self.assertEqual(sorted(PullBasedInterpretor(db)(plan)), truth)
+        push = []
+        PushBasedInterpretor(db)(plan, push.append)
+        self.assertEqual(sorted(push), truth)
+        self.assertEqual(sorted(QueryCompiler(db)(plan)), truth)
+
+  def test_partitions(self):
+    scan = Scan("data")
+    scan.set_db(db)
+    gb = GroupBy(scan, ["a", "b", "c"])
+    truth = dict((row["__key__"], row["__group__"]) for row in gb)
+
+    groups = HashAggregator(gb, max_groups=2, fanout=2)
+    for row in scan:
+      groups.add(row)
+    self.assertEqual(len(groups.hashtable), 2)
+    self.assertTrue(sum(map(len, groups.partitions)) > 0)
+    # each group's rows are kept in input order
+    self.assertEqual(dict((key, group) for key, _, group in groups), truth)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from databass import sqlparser
+from databass.parse_sql import Visitor, parse
+from databass.sqlparser import same_tree
+
+QUERIES = [
+  "SELECT a FROM data",
+  "  select a,b , c FROM data  ",
+  "SELECT * FROM data WHERE a > 15 AND b < 18 and c = 1",
+  "SELECT data.*, d.m FROM data, data2 AS d WHERE data.a = d.m",
+  "SELECT a*2+b-c/d AS x, -a, +b, --c FROM data",
+  "SELECT a FROM data WHERE a BETWEEN 3 AND 6 AND b + c BETWEEN c AND 10",
+  "SELECT lower(e), f(), g( a , 1 ) AS y FROM data WHERE e like 'a\\'b' AND e LIKE \"x\"",
+  "SELECT a, count(1) AS c FROM data GROUP BY a, b ORDER BY c DESC, a ASC, b LIMIT 5",
+  "SELECT x FROM (SELECT a AS x FROM data LIMIT 3) AS t, (SELECT b FROM data)",
+  "SELECT `my-col`, [br] FROM `tbl` AS `t` WHERE `t`.a <> 1.5 AND b != .5",
+  "SELECT (a + (b)) * 2, true, false, TRUE, _x FROM generate(10) AS g",
+  "SELECT a FROM data WHERE a < ? AND b = ? LIMIT ?",
+  "SELECT a FROM data WHERE a < :hi AND b > :lo AND c = :hi",
+  "SELECT a FROM data ORDER BY a desc",
+  # not accepted by the fast parser, or by neither parser
+  "SELECT notes + 1 FROM data",
+  "SELECT notes FROM data",
+  "SELECT not(a) FROM data",
+  "SELECT truex FROM data",
+  "SELECT a FROM data GROUP BY a HAVING(a)",
+  "SELECT a FROM data WHERE a >= 1",
+  "SELECT a FROMdata",
+  "SELECT a FROM data WHERE(a = 1)",
+  "SELECT a likeb FROM data",
+  "SELECT a FROM data UNION SELECT b FROM data",
+  "SELECT a FROM data WHERE a < ? AND b < :x",
+  "SELECT a FROM data LIMIT b",
+]
+
+
+class TestSqlParser(unittest.TestCase):
+
+  def parse(self, f, q):
+    try:
+      return f(q)
+    except Exception:
+      return None
+
+  def test_same_trees(self):
+    accepted = 0
+    for q in QUERIES:
+      truth = self.parse(Visitor().parse, q)
+      fast = self.parse(sqlparser.parse, q)
+      if fast is not None:
+        accepted += 1
+        self.assertTrue(same_tree(truth, fast), q)
+      self.assertTrue(same_tree(truth, self.parse(parse, q)), q)
+    self.assertEqual(accepted, 14)
+
+  def test_right_assoc(self):
+    e = sqlparser.parse("SELECT a * b + c FROM data").exprs[0]
+    self.assertEqual((e.op, e.r.op), ("*", "+"))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from databass.db import Database, Table, Histogram
+from databass.ops import *
+from databass.optimizer import SelingerOpt
+from databass.sketches import HyperLogLog, Reservoir
+
+db = Database()
+
+
+class TestStats(unittest.TestCase):
+
+  def test_column_stats(self):
+    table = Table.from_rows([dict(a=i % 4, b=None if i % 5 == 0 else "x%d" % (i % 3), c=i) 
+                             for i in range(20)])
+    stats = table.stats
+    self.assertEqual(stats.card, 20)
+    self.assertEqual(stats["a"].domain, [0, 3])
+    self.assertEqual(stats["a"].ndistinct, 4)
+    self.assertEqual(stats["a"].nulls, 0)
+    self.assertEqual(stats["b"].nulls, 4)
+    self.assertEqual(stats["b"].ndistinct, 3)
+    self.assertEqual(stats["b"].domain, ["x0", "x2"])
+    self.assertEqual([stats[f].sorted for f in "abc"], [False, False, True])
+
+  def test_columnar_nulls(self):
+    stats = db["iowa-liquor-sample"].stats
+    self.assertEqual(stats.card, 1699)
+    for field in db["iowa-liquor-sample"].fields:
+      col = stats[field]
+      self.assertTrue(col.ndistinct + col.nulls <= stats.card)
+
+  def test_cached(self):
+    table = db["data"]
+    self.assertTrue(table.stats is table.stats)
+
+  def test_invalidated(self):
+    mydb = Database()
+    old = mydb["data"]
+    stats = old.stats
+    mydb.register_table("data", Table.from_rows([dict(a=1), dict(a=5)]))
+    self.assertEqual(mydb["data"].stats.card, 2)
+    self.assertEqual(mydb["data"].stats["a"].domain, [1, 5])
+    self.assertFalse(old.stats is stats)
+
+  def test_histogram(self):
+    hist = Histogram(range(100), 10)
+    self.assertEqual(len(hist.buckets), 10)
+    self.assertTrue(all(count == 10 for (lo, hi, count) in hist.buckets))
+    self.assertAlmostEqual(hist.selectivity(hi=49), .5)
+    self.assertAlmostEqual(hist.selectivity(lo=90), .1)
+    self.assertEqual(hist.selectivity(lo=200), 0)
+    skewed = Histogram(sorted([1] * 90 + range(10)), 10)
+    self.assertTrue(skewed.selectivity(1, 1) >= .8)
+
+  def test_range_selectivity(self):
+    stats = db["data"].stats["a"]
+    self.assertAlmostEqual(stats.selectivity("<=", 9), .5)
+    self.assertAlmostEqual(stats.selectivity(">=", 10), .5)
+    self.assertAlmostEqual(stats.selectivity("=", 3), .05)
+    self.assertEqual(stats.selectivity("=", 100), 0)
+    self.assertEqual(estimate_card(Filter(Scan("data"), "a <= 9"), db), 10)
+    self.assertEqual(estimate_card(Filter(Scan("data"), "(a <= 9) and (100 > a)"), db), 10)
+
+
+class TestSketches(unittest.TestCase):
+
+  def test_hyperloglog(self):
+    for p in (8, 12):
+      hll = HyperLogLog(p)
+      for i in range(50000):
+        hll.add(i % 20000)
+      self.assertTrue(abs(len(hll) - 20000) < 4 * hll.error * 20000)
+    self.assertEqual(HyperLogLog.precision_for(0.02), 12)
+    self.assertTrue(HyperLogLog(HyperLogLog.precision_for(0.01)).error <= 0.01)
+
+  def test_reservoir(self):
+    r = Reservoir(100)
+    for i in range(10000):
+      r.add(i)
+    self.assertEqual(len(r), 100)
+    self.assertEqual(len(set(r)), 100)
+    # a uniform sample shouldn't be stuck on the first values
+    self.assertTrue(sum(1 for v in r if v >= 5000) > 25)
+
+  def test_sketch_stats(self):
+    mydb = Database()
+    exact = mydb["iowa-liquor-sample"].stats
+    mydb.set_stats_mode(sketch=True, error=0.05, sample_size=200)
+    sketch = mydb["iowa-liquor-sample"].stats
+    self.assertFalse(exact is sketch)
+    self.assertEqual(sketch.card, exact.card)
+    for field in ("ITEM", "CITY", "TOTAL", "STORE"):
+      self.assertEqual(sketch[field].domain, exact[field].domain)
+      self.assertEqual(sketch[field].sorted, exact[field].sorted)
+      self.assertEqual(sketch[field].nulls, exact[field].nulls)
+      self.assertTrue(abs(sketch[field].ndistinct - exact[field].ndistinct) <= 
+                      0.2 * exact[field].ndistinct)
+    self.assertAlmostEqual(sketch["TOTAL"].selectivity("<=", 100), 
+                           exact["TOTAL"].selectivity("<=", 100), delta=0.1)
+
+    opt = SelingerOpt(mydb)
+    sel = opt.selectivity_attr(Scan("iowa-liquor-sample"), "CITY")
+    self.assertAlmostEqual(sel, 1.0 / exact["CITY"].ndistinct, delta=0.02)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from databass.db import Database
+from databass.interpretor import PullBasedInterpretor, PushBasedInterpretor, BatchInterpretor
+from databass.ops import *
+from databass.optimizer import Optimizer
+from databass.parse_sql import parse
+from databass.prepared import prepare
+from databass.query_compiler import QueryCompiler
+
+db = Database()
+
+
+class TestTopK(unittest.TestCase):
+
+  def run_all(self, plan):
+    rows = list(PullBasedInterpretor(db)(plan))
+    push = []
+    PushBasedInterpretor(db)(plan, push.append)
+    self.assertEqual(rows, push)
+    self.assertEqual(rows, list(BatchInterpretor(db, batchsize=7)(plan)))
+    self.assertEqual(rows, list(QueryCompiler(db)(plan)))
+    return rows
+
+  def test_rewrite(self):
+    plan = Optimizer(db)(parse("SELECT a, b FROM data ORDER BY b DESC, a LIMIT 4"))
+    self.assertTrue(isinstance(plan, TopK))
+    self.assertEqual(plan.collect(Limit), [])
+    self.assertEqual(plan.collect(OrderBy), [plan])
+
+    # a subquery's Limit over OrderBy is rewritten too
+    plan = Optimizer(db)(parse(
+        "SELECT x FROM (SELECT a AS x FROM data ORDER BY a LIMIT 2) AS t LIMIT 1"))
+    self.assertEqual(len(plan.collect(TopK)), 1)
+    self.assertEqual(len(plan.collect(Limit)), 1)
+
+  def test_same_rows(self):
+    for order in ["b DESC, a", "a", "c, e DESC", "b"]:
+      for k in [0, 1, 3, 4, 7, 1000]:
+        q = "SELECT a, b, c, e FROM data ORDER BY %s LIMIT %d" % (order, k)
+        truth = list(PullBasedInterpretor(db)(Optimizer(db)(parse(q).c)))[:k]
+        self.assertEqual(self.run_all(Optimizer(db)(parse(q))), truth, q)
+
+  def test_heap(self):
+    scan = Scan("data")
+    scan.set_db(db)
+    topk = TopK(scan, ["b"], "desc", 3)
+    rows = TopKHeap(topk, 3)
+    for row in scan:
+      rows.add(row)
+    self.assertTrue(len(rows.buf) < 6)
+    self.assertEqual(list(rows), list(topk))
+
+  def test_prepared(self):
+    stmt = prepare(db, "SELECT a FROM data ORDER BY a DESC LIMIT ?")
+    self.assertTrue(stmt.plan.collect(TopK))
+    truth = list(PullBasedInterpretor(db)(Optimizer(db)(parse(
+      "SELECT a FROM data ORDER BY a DESC"))))
+    self.assertEqual(stmt(2), truth[:2])
+    self.assertEqual(stmt.bind(5).run(QueryCompiler(db)), truth[:5])
+
+
+if __name__ == '__main__':
+  unittest.main()